@@ -2,7 +2,7 @@
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
 
-from .models import DeveloperKey, MasterKey, PGPSignature, StaffGroup, UserProfile
+from .models import DeveloperKey, MasterKey, PackagerIdentity, PGPSignature, StaffGroup, UserProfile
 
 
 class UserProfileInline(admin.StackedInline):
@@ -39,6 +39,11 @@ class PGPSignatureAdmin(admin.ModelAdmin):
     date_hierarchy = 'created'
 
 
+class PackagerIdentityAdmin(admin.ModelAdmin):
+    list_display = ('packager', 'user')
+    search_fields = ('packager', 'user__username')
+
+
 admin.site.unregister(User)
 admin.site.register(User, UserProfileAdmin)
 admin.site.register(StaffGroup, StaffGroupAdmin)
@@ -46,5 +51,6 @@ class PGPSignatureAdmin(admin.ModelAdmin):
 admin.site.register(MasterKey, MasterKeyAdmin)
 admin.site.register(DeveloperKey, DeveloperKeyAdmin)
 admin.site.register(PGPSignature, PGPSignatureAdmin)
+admin.site.register(PackagerIdentity, PackagerIdentityAdmin)
 
 # vim: set ts=4 sw=4 et:
@@ -1,24 +1,374 @@
+import _thread
+import heapq
+import itertools
 import logging
 import multiprocessing
 import os
+import queue
+import resource
 import threading
 import time
+from contextlib import contextmanager, nullcontext
 
 import pyinotify
-from django.db.utils import OperationalError
+from django.core.management.base import CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import DatabaseError, OperationalError
+
+from devel.utils import advisory_lock_key
 
 logger = logging.getLogger("command")
 logger.setLevel(logging.WARNING)
 
 
+def mp_context():
+    # Python 3.14 changed the non-macOS POSIX default to forkserver
+    # but the code in this module does not work with it
+    # See https://github.com/python/cpython/issues/125714
+    if multiprocessing.get_start_method() == 'forkserver':
+        return multiprocessing.get_context(method='fork')
+    return multiprocessing.get_context()
+
+
+def run_callback(callback_func, arch, path, retry_limit, options=None):
+    '''Invoke callback_func for a database, retrying a few times if the
+    database is not reachable.'''
+    # A retry mechanism exists for when reporead_inotify runs on a different machine.
+    retry = True
+    retry_count = 0
+    while retry and retry_count < retry_limit:
+        try:
+            callback_func(arch, path, options or {})
+            retry = False
+        except OperationalError as exc:
+            retry_count += 1
+            logger.error('Unable to update database \'%s\', retrying=%d',
+                         path, retry_count, exc_info=exc)
+            time.sleep(5)
+
+    if retry_count == retry_limit:
+        logger.error('Unable to update database, exceeded maximum retries')
+
+
+def worker_main(conn, callback_func, nice, retry_limit, max_jobs, max_rss):
+    '''Main loop of a WorkerPool process: run the updates sent over conn and
+    answer each with whether this process is retiring afterwards.'''
+    if nice != 0:
+        os.nice(nice)
+    jobs = 0
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        arch, path, options = job
+        failed = False
+        try:
+            # the connection and caches stay around for the next update
+            run_callback(callback_func, arch, path, retry_limit, {**options, 'keep_connection': True})
+        except Exception:
+            # don't trust whatever state the failed update left behind
+            logger.exception('Unable to update database %s', path)
+            failed = True
+        jobs += 1
+        # ru_maxrss is the peak resident set size, in kilobytes on Linux
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        retire = failed or jobs >= max_jobs or bool(max_rss and rss > max_rss)
+        conn.send(retire)
+        if retire:
+            break
+    conn.close()
+
+
+class PoolJob:
+    def __init__(self, arch, path, options):
+        self.arch = arch
+        self.path = path
+        self.options = options
+        self.done = threading.Event()
+
+
+class WorkerPool:
+    '''A fixed number of long-lived worker processes running database
+    updates, so that the database connection and the user index built up by
+    one import are reused by the next instead of starting from scratch in a
+    freshly forked process. A worker is replaced by a new process
+    after max_jobs updates or once its peak RSS exceeds max_rss kilobytes,
+    which keeps the memory from large imports from sticking around. Updates
+    of a path which is still waiting in the queue are coalesced.'''
+    def __init__(self, callback_func, workers=2, max_jobs=50, max_rss=None, nice=3,
+                 retry_limit=5):
+        self.callback_func = callback_func
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss
+        self.nice = nice
+        self.retry_limit = retry_limit
+        self.queue = queue.Queue()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._dispatch, name=f'worker-{i}', daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, arch, path, options=None):
+        '''Queue an update of the database at path, returning its PoolJob. If
+        an update of the same path is still queued, that job is returned.'''
+        with self.lock:
+            job = self.pending.get(path)
+            if job is None:
+                job = PoolJob(arch, path, options or {})
+                self.pending[path] = job
+                self.queue.put(job)
+            else:
+                logger.debug('Coalescing update of %s with a queued one', path)
+        return job
+
+    def run(self, arch, path, options=None):
+        '''Queue an update of the database at path and wait until it is done.'''
+        self.submit(arch, path, options).done.wait()
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def _spawn(self):
+        context = mp_context()
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(
+            target=worker_main,
+            args=(child_conn, self.callback_func, self.nice, self.retry_limit,
+                  self.max_jobs, self.max_rss))
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def _dispatch(self):
+        process = conn = None
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            with self.lock:
+                # from now on a new update of this path needs another run
+                del self.pending[job.path]
+            try:
+                if process is None:
+                    process, conn = self._spawn()
+                conn.send((job.arch, job.path, job.options))
+                retire = conn.recv()
+            except (EOFError, OSError):
+                logger.error('Worker process died while updating database %s', job.path)
+                retire = True
+            finally:
+                job.done.set()
+            if retire:
+                conn.close()
+                process.join()
+                process = conn = None
+        if process is not None:
+            conn.send(None)
+            conn.close()
+            process.join()
+
+
+# import priorities, lowest first
+PRIORITY_STABLE = 0
+PRIORITY_TESTING = 1
+PRIORITY_STAGING = 2
+
+
+def repo_priority(repo):
+    if repo.staging:
+        return PRIORITY_STAGING
+    if repo.testing:
+        return PRIORITY_TESTING
+    return PRIORITY_STABLE
+
+
+class ImportScheduler:
+    '''Hands out a limited number of import slots shared by all databases,
+    so a push touching many repos at once doesn't start all of their imports
+    at the same time. Waiting imports get a slot by priority, then in the
+    order they asked for one. Queue depth and wait times are logged; the
+    wait of each import is also passed on to it, reporead records it in its
+    report.'''
+    def __init__(self, max_concurrent=2):
+        self.max_concurrent = max_concurrent
+        self.running = 0
+        self.waiting = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.imports = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self, priority=PRIORITY_STABLE):
+        with self.condition:
+            entry = (priority, next(self.counter))
+            heapq.heappush(self.waiting, entry)
+            start = time.monotonic()
+            while self.running >= self.max_concurrent or self.waiting[0] != entry:
+                self.condition.wait()
+            heapq.heappop(self.waiting)
+            self.running += 1
+            waited = time.monotonic() - start
+            self.imports += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            # the next waiting import may fit in a free slot as well
+            self.condition.notify_all()
+        return waited
+
+    def release(self):
+        with self.condition:
+            self.running -= 1
+            self.condition.notify_all()
+            logger.info('%d imports waiting, %d running; waited %.1f seconds on average, '
+                        '%.1f seconds at most', len(self.waiting), self.running,
+                        self.total_wait / self.imports, self.max_wait)
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_STABLE):
+        waited = self.acquire(priority)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+
+def add_import_arguments(parser):
+    parser.add_argument('--max-imports',
+                        type=int,
+                        default=2,
+                        help='Maximum number of updates to run at the same time.')
+    parser.add_argument('--workers',
+                        type=int,
+                        default=0,
+                        help='Run updates in this many long-lived worker processes '
+                             'instead of a new process per update.')
+    parser.add_argument('--max-jobs',
+                        type=int,
+                        default=50,
+                        help='Replace a worker process after this many updates.')
+    parser.add_argument('--max-rss',
+                        type=int,
+                        default=None,
+                        help='Replace a worker process once its memory use exceeds this many MiB.')
+    parser.add_argument('--leader',
+                        action='store_true',
+                        default=False,
+                        help='Only handle updates while no other node running this '
+                             'command against the same database does; stand by otherwise.')
+
+
+class LeaderLock:
+    '''
+    Leader election between nodes watching the same repos for the same
+    database: only the one holding the PostgreSQL advisory lock with the given
+    name acts on updates, the others stand by until it goes away. The lock is
+    held on a connection of its own, which is checked every interval seconds.
+    '''
+    def __init__(self, name, interval=30.0):
+        self.name = name
+        self.key = advisory_lock_key(name)
+        self.interval = interval
+        self.connection = None
+        self.lost = False
+        self.stopped = threading.Event()
+
+    def acquire(self):
+        '''Blocks until this node is the leader.'''
+        self.connection = connections.create_connection(DEFAULT_DB_ALIAS)
+        if self.connection.vendor != 'postgresql':
+            raise CommandError('Leader election requires PostgreSQL.')
+        # held() runs in the watch() thread
+        self.connection.inc_thread_sharing()
+        standing_by = False
+        while True:
+            with self.connection.cursor() as cursor:
+                cursor.execute('SELECT pg_try_advisory_lock(%s)', [self.key])
+                if cursor.fetchone()[0]:
+                    break
+            if not standing_by:
+                logger.info('Another node is the leader for %s, standing by', self.name)
+                standing_by = True
+            time.sleep(self.interval)
+        logger.info('Became the leader for %s', self.name)
+
+    def held(self):
+        '''Whether the session holding the lock is still alive.'''
+        # a bigint key shows up split into two oids in pg_locks
+        key = self.key & 0xffffffffffffffff
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute("SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' "
+                               "AND pid = pg_backend_pid() AND granted AND classid = %s::oid "
+                               "AND objid = %s::oid AND objsubid = 1", [key >> 32, key & 0xffffffff])
+                return cursor.fetchone()[0] > 0
+        except DatabaseError:
+            return False
+
+    def watch(self, on_lost):
+        '''Calls on_lost from another thread once the lock was lost.'''
+        def check():
+            while not self.stopped.wait(self.interval):
+                if not self.held():
+                    logger.error('Lost the leader lock for %s', self.name)
+                    self.lost = True
+                    on_lost()
+                    return
+
+        threading.Thread(target=check, name='leader-lock', daemon=True).start()
+
+    def release(self):
+        self.stopped.set()
+        if self.connection is not None:
+            # closing the session releases the lock
+            self.connection.close()
+
+
+def elect_leader(name, options):
+    '''With --leader, blocks until this node holds the leader lock with the
+    given name and returns it, watched so the main thread gets interrupted
+    once it is lost. Returns None otherwise.'''
+    if not options.get('leader'):
+        return None
+    leader = LeaderLock(name)
+    leader.acquire()
+    leader.watch(_thread.interrupt_main)
+    return leader
+
+
+def create_scheduler(options):
+    return ImportScheduler(max_concurrent=options.get('max_imports') or 2)
+
+
+def create_pool(callback_func, options):
+    '''Returns a WorkerPool configured from the add_import_arguments()
+    options, or None if updates should run in a new process each.'''
+    if not options.get('workers'):
+        return None
+    max_rss = options.get('max_rss')
+    return WorkerPool(callback_func, workers=options['workers'],
+                      max_jobs=options.get('max_jobs') or 50,
+                      max_rss=max_rss * 1024 if max_rss else None)
+
+
 class Database:
     '''A object representing a pacman database on the filesystem. It stores
     various bits of metadata and state representing the file path, when we last
     updated, how long our delay is before performing the update, whether we are
     updating now, etc.'''
-    def __init__(self, arch, path, callback_func, delay=60.0, nice=3, retry_limit=5):
+    def __init__(self, arch, path, callback_func, delay=60.0, nice=3, retry_limit=5, pool=None,
+                 scheduler=None, priority=PRIORITY_STABLE):
         self.arch = arch
         self.path = path
+        self.priority = priority
         self.delay = delay
         self.nice = nice
         self.retry_limit = retry_limit
@@ -26,9 +376,12 @@ def __init__(self, arch, path, callback_func, delay=60.0, nice=3, retry_limit=5)
         self.last_import = None
         self.update_thread = None
         self.updating = False
+        self.started = False
         self.run_again = False
         self.lock = threading.Lock()
         self.callback_func = callback_func
+        self.pool = pool
+        self.scheduler = scheduler
 
     def _start_update_countdown(self):
         self.update_thread = threading.Timer(self.delay, self.update)
@@ -41,8 +394,10 @@ def queue_for_update(self, mtime):
         with self.lock:
             self.mtime = mtime
             if self.updating:
-                # store the fact that we will need to run it again
-                self.run_again = True
+                # an update still waiting for its turn will read the new
+                # file anyway; otherwise we will need to run it again
+                if self.started:
+                    self.run_again = True
                 return
             if self.update_thread:
                 self.update_thread.cancel()
@@ -50,44 +405,20 @@ def queue_for_update(self, mtime):
             self._start_update_countdown()
 
     def update(self):
-        logger.debug('Updating database %s...', self.path)
+        logger.debug('Queueing update of database %s...', self.path)
         with self.lock:
-            self.last_import = time.time()
             self.updating = True
+            self.started = False
 
         try:
-            # invoke reporead's primary method. we do this in a separate
-            # process for memory conservation purposes; these processes grow
-            # rather large so it is best to free up the memory ASAP.
-            # A retry mechanism exists for when reporead_inotify runs on a different machine.
-            def run():
-                retry = True
-                retry_count = 0
-                if self.nice != 0:
-                    os.nice(self.nice)
-                while retry and retry_count < self.retry_limit:
-                    try:
-                        self.callback_func(self.arch, self.path, {})
-                        retry = False
-                    except OperationalError as exc:
-                        retry_count += 1
-                        logger.error('Unable to update database \'%s\', retrying=%d',
-                                     self.path, retry_count, exc_info=exc)
-                        time.sleep(5)
-
-                if retry_count == self.retry_limit:
-                    logger.error('Unable to update database, exceeded maximum retries')
-
-            # Python 3.14 changed the non-macOS POSIX default to forkserver
-            # but the code in this module does not work with it
-            # See https://github.com/python/cpython/issues/125714
-            if multiprocessing.get_start_method() == 'forkserver':
-                _mp_context = multiprocessing.get_context(method='fork')
-            else:
-                _mp_context = multiprocessing.get_context()
-            process = _mp_context.Process(target=run)
-            process.start()
-            process.join()
+            slot = self.scheduler.slot(self.priority) if self.scheduler else nullcontext(0.0)
+            with slot as waited:
+                logger.debug('Updating database %s after waiting %.1f seconds...',
+                             self.path, waited)
+                with self.lock:
+                    self.last_import = time.time()
+                    self.started = True
+                self._run_update({'queue_wait': waited})
         finally:
             logger.debug('Done updating database %s.', self.path)
             with self.lock:
@@ -97,18 +428,40 @@ def run():
                     self.run_again = False
                     self._start_update_countdown()
 
+    def _run_update(self, options):
+        if self.pool is not None:
+            self.pool.run(self.arch, self.path, options)
+            return
+
+        # invoke reporead's primary method. we do this in a separate
+        # process for memory conservation purposes; these processes grow
+        # rather large so it is best to free up the memory ASAP.
+        def run():
+            if self.nice != 0:
+                os.nice(self.nice)
+            run_callback(self.callback_func, self.arch, self.path, self.retry_limit, options)
+
+        process = mp_context().Process(target=run)
+        process.start()
+        process.join()
+
 
 class EventHandler(pyinotify.ProcessEvent):
     '''Our main event handler which listens for database change events. Because
     we are watching the whole directory, we filter down and only look at those
     events dealing with files databases.'''
 
-    def my_init(self, filename_suffix, callback_func, **kwargs):
+    def my_init(self, filename_suffix, callback_func, pool=None, scheduler=None,
+                repo_priorities=None, delay=60.0, **kwargs):
         self.databases = {}
         self.arch_lookup = {}
 
         self.filename_suffix = filename_suffix
         self.callback_func = callback_func
+        self.pool = pool
+        self.scheduler = scheduler
+        self.repo_priorities = repo_priorities or {}
+        self.delay = delay
 
         # we really want a single path to arch mapping, so massage the data
         arch_paths = kwargs['arch_paths']
@@ -133,7 +486,10 @@ def process_default(self, event):
                         'Could not determine arch for %s, skipping update',
                         path)
                     return
-                database = Database(arch, path, self.callback_func)
+                repo = name[:-len(self.filename_suffix)]
+                database = Database(arch, path, self.callback_func, delay=self.delay,
+                                    pool=self.pool, scheduler=self.scheduler,
+                                    priority=self.repo_priorities.get(repo, PRIORITY_STABLE))
                 self.databases[path] = database
             database.queue_for_update(stat.st_mtime)
 
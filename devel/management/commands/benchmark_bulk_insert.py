@@ -0,0 +1,71 @@
+"""
+benchmark_bulk_insert command
+
+Compares the two ways reporead can load package file lists: the generic
+bulk_create() path and, on PostgreSQL, streaming the rows through COPY. All
+rows are attached to an existing package and inserted in a transaction that
+is rolled back at the end, so the database is left untouched.
+
+Usage: ./manage.py benchmark_bulk_insert [--rows N]
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from main.models import Package, PackageFile
+from main.utils import database_vendor
+
+from .reporead import (
+    PACKAGE_FILE_FIELDS,
+    batched_bulk_create,
+    copy_rows,
+    create_pkg_files,
+    delete_pkg_files,
+)
+
+
+class Command(BaseCommand):
+    help = "Benchmark bulk_create() against COPY for loading package file lists."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows',
+                            type=int,
+                            default=200000,
+                            help='Number of package file rows to insert per run.')
+
+    def handle(self, **options):
+        pkg = Package.objects.order_by('id').first()
+        if pkg is None:
+            raise CommandError('At least one package is required to attach file rows to.')
+
+        paths = [f'usr/share/benchmark/{i // 100}/file-{i}' for i in range(options['rows'])]
+
+        def generic():
+            rows = create_pkg_files(pkg, paths)
+            batched_bulk_create(PackageFile, [PackageFile(**dict(zip(PACKAGE_FILE_FIELDS, row, strict=True)))
+                                              for row in rows])
+
+        def copy():
+            copy_rows(PackageFile, PACKAGE_FILE_FIELDS, create_pkg_files(pkg, paths))
+
+        runs = [('bulk_create', generic)]
+        if database_vendor(PackageFile, 'write') == 'postgresql':
+            runs.append(('COPY', copy))
+        else:
+            self.stdout.write('COPY is only available on PostgreSQL, skipping it.')
+
+        for name, func in runs:
+            with transaction.atomic():
+                start = time.perf_counter()
+                func()
+                inserted = time.perf_counter()
+                delete_pkg_files(pkg)
+                deleted = time.perf_counter()
+                transaction.set_rollback(True)
+            insert_time = inserted - start
+            self.stdout.write(f'{name}: inserted {len(paths)} rows in {insert_time:.2f}s '
+                              f'({len(paths) / insert_time:.0f} rows/s), deleted in {deleted - inserted:.2f}s')
+
+# vim: set ts=4 sw=4 et:
@@ -0,0 +1,75 @@
+"""
+benchmark_parse_repo command
+
+Generates a synthetic repo (see generate_repodb) and times parse_repo() on its
+package database, first serially and then with each given number of worker
+processes, checking that every run returns the same packages, and reports the
+memory the parsed packages take up. Nothing is written to the database.
+
+Usage: ./manage.py benchmark_parse_repo <arch> [--packages N]
+           [--workers N [N ...]]
+"""
+
+import gc
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+
+from .generate_repodb import generate_repo
+from .reporead import parse_repo
+
+
+class Command(BaseCommand):
+    help = "Benchmark serial against parallel parsing of a synthetic package database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('arch', help='Architecture of the packages.')
+        parser.add_argument('--packages', type=int, default=15000,
+                            help='Number of packages.')
+        parser.add_argument('--workers', type=int, nargs='+',
+                            default=[2, os.cpu_count() or 2],
+                            help='Numbers of worker processes to compare.')
+
+    def handle(self, arch, **options):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            db_path, _ = generate_repo(tmpdir, 'core', arch, packages=options['packages'], files=0)
+            self.stdout.write(f'{"workers":>7} {"seconds":>9} {"speedup":>8}')
+            serial = None
+            for workers in [1, *sorted(set(options['workers']) - {1})]:
+                start = time.perf_counter()
+                _, pkgs = parse_repo(db_path, workers=workers)
+                seconds = time.perf_counter() - start
+                records = package_records(pkgs)
+                if serial is None:
+                    serial = (seconds, records)
+                elif records != serial[1]:
+                    raise CommandError(f'Parsing with {workers} workers gave different packages.')
+                self.stdout.write(f'{workers:>7} {seconds:>9.2f} {serial[0] / seconds:>7.2f}x')
+            self.stdout.write(f'Memory per parsed package: {retained_memory(db_path):.0f} bytes')
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+def package_records(pkgs):
+    '''The parsed content of a list of RepoPackage objects, comparable across
+    parse_repo() runs.'''
+    return [(pkg.repo, pkg.files_member, pkg.digest, pkg.record()) for pkg in pkgs]
+
+
+def retained_memory(path):
+    '''Bytes allocated per package that stay alive after parsing path.'''
+    gc.collect()
+    tracemalloc.start()
+    try:
+        _, pkgs = parse_repo(path)
+        gc.collect()
+        return tracemalloc.get_traced_memory()[0] / len(pkgs)
+    finally:
+        tracemalloc.stop()
+
+# vim: set ts=4 sw=4 et:
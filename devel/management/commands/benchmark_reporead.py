@@ -0,0 +1,121 @@
+"""
+benchmark_reporead command
+
+Generates a synthetic repo (see generate_repodb) and times read_repo() on it
+through the phases an import goes through in practice:
+
+ * cold: importing the package database into an empty repo
+ * filesonly: loading the file lists from the files database
+ * noop: importing the unchanged files database again
+ * bump: importing it after a tenth of the packages got a new pkgrel
+ * force: a forced import of the same database
+
+For each phase the wall time, the number of queries and the peak memory
+allocated by Python, as traced by tracemalloc, are reported, followed by the
+peak RSS of the whole process. The packages are imported into the given repo, which
+must exist and should be empty; all of its packages for the given
+architecture are removed again at the end. Only run this against a
+development database.
+
+Usage: ./manage.py benchmark_reporead <arch> [--repo core] [--packages N]
+           [--files N] [--bump RATIO] [--batch-size N] [--low-memory]
+"""
+
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+
+from main.models import Arch, Package, Repo, RepoDatabase
+
+from .generate_repodb import generate_repo
+from .reporead import read_repo
+
+
+class Command(BaseCommand):
+    help = "Benchmark reporead on a synthetic repo."
+
+    def add_arguments(self, parser):
+        parser.add_argument('arch', help='Architecture to import the packages as.')
+        parser.add_argument('--repo', default='core', help='Repo to import the packages into.')
+        parser.add_argument('--packages', type=int, default=1000,
+                            help='Number of packages.')
+        parser.add_argument('--files', type=int, default=100,
+                            help='Average number of files per package.')
+        parser.add_argument('--bump', type=float, default=0.1,
+                            help='Fraction of package bases updated in the bump phase.')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Passed on to reporead.')
+        parser.add_argument('--low-memory', action='store_true', default=False,
+                            help='Passed on to reporead.')
+
+    def handle(self, arch, **options):
+        try:
+            repo = Repo.objects.get(name__iexact=options['repo'])
+            arch = Arch.objects.get(name=arch, agnostic=False)
+        except (Repo.DoesNotExist, Arch.DoesNotExist) as exc:
+            raise CommandError(str(exc)) from exc
+        arches = [arch, *Arch.objects.filter(agnostic=True)]
+        if Package.objects.filter(repo=repo, arch__in=arches).exists():
+            raise CommandError(f'Repo {repo.name} already has packages for {arch.name}.')
+
+        reponame = repo.name.lower()
+        shape = {'packages': options['packages'], 'files': options['files']}
+        tmpdir = tempfile.mkdtemp()
+        try:
+            db_path, files_path = generate_repo(tmpdir, reponame, arch.name, **shape)
+            bumped_dir = tempfile.mkdtemp(dir=tmpdir)
+            _, bumped_path = generate_repo(bumped_dir, reponame, arch.name,
+                                           bump=options['bump'], **shape)
+
+            phases = [
+                ('cold', db_path, {}),
+                ('filesonly', files_path, {'filesonly': True}),
+                ('noop', files_path, {}),
+                ('bump', bumped_path, {}),
+                ('force', bumped_path, {'force': True}),
+            ]
+            common = {'batch_size': options['batch_size'], 'low_memory': options['low_memory']}
+            self.stdout.write(f'{"phase":<10} {"seconds":>9} {"queries":>9} {"peak MiB":>9}')
+            for name, path, phase_options in phases:
+                with measure() as result:
+                    read_repo(arch, path, {**common, **phase_options})
+                self.stdout.write(f'{name:<10} {result["time"]:>9.2f} {result["queries"]:>9} '
+                                  f'{result["peak"] / 2 ** 20:>9.1f}')
+            # ru_maxrss is the peak resident set size, in kilobytes on Linux
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.stdout.write(f'Peak RSS of the process: {rss / 1024:.1f} MiB')
+        finally:
+            shutil.rmtree(tmpdir)
+            Package.objects.filter(repo=repo, arch__in=arches).delete()
+            RepoDatabase.objects.filter(repo=repo, arch__in=arches).delete()
+
+
+@contextmanager
+def measure():
+    '''Measures the wall time, number of queries and peak memory traced by
+    tracemalloc, in bytes, of the block, returned in the yielded dict once it
+    is done.'''
+    result = {'queries': 0}
+
+    def count_queries(execute, sql, params, many, context):
+        result['queries'] += 1
+        return execute(sql, params, many, context)
+
+    connection = connections[router.db_for_write(Package)]
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(count_queries):
+            yield result
+        result['time'] = time.perf_counter() - start
+        result['peak'] = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+# vim: set ts=4 sw=4 et:
@@ -0,0 +1,145 @@
+"""
+generate_repodb command
+
+Writes a synthetic repo.db.tar.gz and repo.files.tar.gz pair for trying out
+and benchmarking reporead without real mirror data. The content is
+deterministic for a given set of options, so two runs differing only in
+--bump describe the same repo before and after some of its packages were
+updated.
+
+Usage: ./manage.py generate_repodb <arch> <directory> [--repo core]
+           [--packages N] [--split RATIO] [--any RATIO] [--depends N]
+           [--provides N] [--files N] [--bump RATIO] [--seed N]
+"""
+
+import io
+import os
+import random
+import tarfile
+from base64 import b64encode
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Generate a synthetic package database and files database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('arch', help='Architecture of the packages.')
+        parser.add_argument('directory', help='Directory to write the databases to.')
+        parser.add_argument('--repo', default='core', help='Name of the repo.')
+        parser.add_argument('--packages', type=int, default=1000,
+                            help='Number of packages.')
+        parser.add_argument('--split', type=float, default=0.1,
+                            help='Fraction of package bases built as split packages.')
+        parser.add_argument('--any', type=float, default=0.2, dest='agnostic',
+                            help="Fraction of packages built for 'any'.")
+        parser.add_argument('--depends', type=int, default=8,
+                            help='Maximum number of dependencies per package.')
+        parser.add_argument('--provides', type=int, default=2,
+                            help='Maximum number of provisions per package.')
+        parser.add_argument('--files', type=int, default=100,
+                            help='Average number of files per package.')
+        parser.add_argument('--bump', type=float, default=0.0,
+                            help='Fraction of package bases with a newer pkgrel.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed for the random generator.')
+
+    def handle(self, arch, directory, **options):
+        if not os.path.isdir(directory):
+            raise CommandError('Specified directory does not exist.')
+
+        db_path, files_path = generate_repo(
+            directory, options['repo'], arch, packages=options['packages'],
+            split=options['split'], agnostic=options['agnostic'],
+            depends=options['depends'], provides=options['provides'],
+            files=options['files'], bump=options['bump'], seed=options['seed'])
+        self.stdout.write(f'Wrote {db_path} and {files_path}')
+
+
+def generate_packages(arch, packages=1000, split=0.1, agnostic=0.2, depends=8, provides=2,
+                      files=100, bump=0.0, seed=0):
+    '''Returns a list of (pkgid, desc, files) tuples describing a repo of the
+    given shape, where files is a callable generating the package's paths.'''
+    rng = random.Random(seed)
+    # decided independently of everything else, so the same packages are
+    # generated whatever the bump ratio
+    bump_rng = random.Random(seed + 1)
+
+    result = []
+    names = []
+    base = 0
+    while len(result) < packages:
+        basename = f'pkg{base:06d}'
+        pkgrel = 2 if bump_rng.random() < bump else 1
+        if rng.random() < split:
+            pkgnames = [f'{basename}-{part}' for part in range(rng.randint(2, 5))]
+        else:
+            pkgnames = [basename]
+        base += 1
+
+        for pkgname in pkgnames[:packages - len(result)]:
+            pkgarch = 'any' if rng.random() < agnostic else arch
+            version = f'{base % 10}.{base % 7}.{base % 3}-{pkgrel}'
+            pkgid = f'{pkgname}-{version}'
+            deps = rng.sample(names, min(len(names), rng.randint(0, depends)))
+            provs = [f'lib{pkgname}-{i}.so={i}' for i in range(rng.randint(0, provides))]
+            nfiles = max(1, int(rng.expovariate(1 / files))) if files else 0
+            lines = [
+                '%FILENAME%', f'{pkgid}-{pkgarch}.pkg.tar.zst', '',
+                '%NAME%', pkgname, '',
+                '%BASE%', basename, '',
+                '%VERSION%', version, '',
+                '%DESC%', f'Synthetic package {pkgname}', '',
+                '%CSIZE%', str(rng.randint(10000, 10000000)), '',
+                '%ISIZE%', str(rng.randint(10000, 100000000)), '',
+                '%SHA256SUM%', f'{rng.getrandbits(256):064x}', '',
+                '%PGPSIG%', b64encode(rng.randbytes(119)).decode(), '',
+                '%URL%', f'https://example.org/{basename}', '',
+                '%LICENSE%', 'GPL-3.0-or-later', '',
+                '%ARCH%', pkgarch, '',
+                '%BUILDDATE%', str(1700000000 + base * 60 + pkgrel), '',
+                '%PACKAGER%', f'Packager {base % 50} <packager{base % 50}@example.org>', '',
+            ]
+            if provs:
+                lines += ['%PROVIDES%', *provs, '']
+            if deps:
+                lines += ['%DEPENDS%', *deps, '']
+            desc = '\n'.join([*lines, '']).encode()
+
+            def package_files(pkgname=pkgname, nfiles=nfiles):
+                yield 'usr/'
+                yield f'usr/share/{pkgname}/'
+                for i in range(nfiles):
+                    if i % 100 == 0:
+                        subdir = f'usr/share/{pkgname}/{i // 100}/'
+                        yield subdir
+                    yield f'{subdir}file{i}'
+
+            result.append((pkgid, desc, package_files))
+            names.append(pkgname)
+    return result
+
+
+def add_member(archive, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = 0o644
+    archive.addfile(info, io.BytesIO(data))
+
+
+def generate_repo(directory, reponame, arch, **options):
+    '''Writes <reponame>.db.tar.gz and <reponame>.files.tar.gz for a repo
+    shaped by options (see generate_packages()) into directory, and returns
+    their paths.'''
+    db_path = os.path.join(directory, f'{reponame}.db.tar.gz')
+    files_path = os.path.join(directory, f'{reponame}.files.tar.gz')
+    with tarfile.open(db_path, 'w:gz') as db, tarfile.open(files_path, 'w:gz') as files_db:
+        for pkgid, desc, package_files in generate_packages(arch, **options):
+            add_member(db, f'{pkgid}/desc', desc)
+            add_member(files_db, f'{pkgid}/desc', desc)
+            data = '\n'.join(['%FILES%', *package_files(), '']).encode()
+            add_member(files_db, f'{pkgid}/files', data)
+    return db_path, files_path
+
+# vim: set ts=4 sw=4 et:
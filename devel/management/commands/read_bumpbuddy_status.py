@@ -15,20 +15,18 @@
 from django.conf import settings
 from django.core.cache import cache
 from django.core.management.base import BaseCommand
+from django.db.models import Q
 from django.utils.timezone import now
 
 from main.models import Package
 from main.utils import gitlab_project_name_to_path
-from packages.alpm import AlpmAPI
+from packages.alpm import version_key
 from packages.models import FlagRequest
 
 logger = logging.getLogger("command")
 logger.setLevel(logging.WARNING)
 
 
-alpm = AlpmAPI()
-
-
 class PkgData(TypedDict):
     last_check: int
     local_version: str
@@ -48,18 +46,24 @@ def process_package(self, pkgdata: PkgData) -> FlagRequest | None:
         logger.debug("Import new out of date package '%s'", pkgbase)
 
         packages = Package.objects.filter(pkgbase=pkgbase)
-        found_packages = list(packages)
+        found_packages = list(packages.values_list('epoch', 'flag_date'))
 
         if len(found_packages) == 0:
             logger.error("no matching packages found for pkgbase='%s'", pkgbase)
             return None
 
         # already flagged
-        not_flagged_packages = [pkg for pkg in found_packages if pkg.flag_date is None]
-        if len(not_flagged_packages) == 0:
+        epochs = {epoch for epoch, flag_date in found_packages if flag_date is None}
+        if len(epochs) == 0:
             return None
 
-        ood_packages = [pkg for pkg in not_flagged_packages if alpm.vercmp(upstream_version, pkg.pkgver) > 0]
+        # compare the upstream version against the pkgver of the packages of
+        # each epoch, all their pkgrels sort after a version without one
+        upstream_pkgver = str(upstream_version).rsplit('-', 1)[0]
+        older = Q()
+        for epoch in epochs:
+            older |= Q(epoch=epoch, version_key__lt=version_key(f'{epoch}:{upstream_pkgver}'))
+        ood_packages = list(packages.filter(older, flag_date__isnull=True))
         if len(ood_packages) == 0:
             logger.debug("package is not out of date for pkgbase='%s'", pkgbase)
             return None
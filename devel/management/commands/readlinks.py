@@ -2,11 +2,16 @@
 import os
 import re
 import tarfile
+import time
+from collections import defaultdict
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
 from main.models import Package, Repo, Soname
 
+from .reporead import batched_bulk_create, batches
+
 logger = logging.getLogger("command")
 
 
@@ -59,43 +64,58 @@ def read_links(repopath):
         logger.error("File does not have the proper extension")
         raise Exception("File does not have the proper extension")
 
+    start = time.monotonic()
     repository = Repo.objects.get(name__iexact=reponame)
-    sonames = []
+
+    # load the packages and sonames of the whole repo up front, so matching
+    # the links db against them does not need a query per package or soname
+    pkg_ids = {}
+    for pkgid, pkgname, epoch, pkgver, pkgrel in Package.objects.filter(
+            repo=repository).order_by('pkgname', 'id').values_list(
+            'id', 'pkgname', 'epoch', 'pkgver', 'pkgrel'):
+        pkg_ids.setdefault((pkgname, str(epoch), pkgver, pkgrel), pkgid)
+
+    old_sonames = defaultdict(dict)
+    for sonameid, pkgid, name in Soname.objects.filter(
+            pkg__repo=repository).values_list('id', 'pkg_id', 'name'):
+        old_sonames[pkgid][name] = sonameid
+
+    added = []
+    removed = []
+    packages = 0
 
     with tarfile.open(repopath, 'r') as repodb:
         logger.debug("Starting soname parsing")
 
-        for tarinfo in repodb.getmembers():
+        for tarinfo in repodb:
             if tarinfo.isreg():
                 pkgnamever = os.path.dirname(tarinfo.name)
                 pkgnamever = pkgnamever.replace('./', '')
                 pkgname, epoch, pkgver, pkgrel = get_pkginfo(pkgnamever)
 
-                dbpkg = Package.objects.filter(pkgname=pkgname, pkgver=pkgver,
-                                               pkgrel=pkgrel, epoch=epoch,
-                                               repo=repository).first()
-
-                if not dbpkg:
-                    logging.info("Package name '%s' not found in repo database", pkgname)
+                pkgid = pkg_ids.get((pkgname, epoch, pkgver, pkgrel))
+                if pkgid is None:
+                    logger.info("Package name '%s' not found in repo database", pkgname)
                     continue
 
+                packages += 1
                 files_data = repodb.extractfile(tarinfo)
-                old_sonames = Soname.objects.filter(pkg=dbpkg)
-                pkg_sonames = []
-                found_sonames = []
-
-                for soname in files_data:
-                    soname = soname.strip().decode()
-                    # New soname which we do not track yet for this package
-                    if not old_sonames.filter(name=soname):
-                        pkg_sonames.append(Soname(pkg=dbpkg, name=soname))
-
-                    found_sonames.append(soname)
+                found_sonames = dict.fromkeys(soname.strip().decode() for soname in files_data)
+                pkg_sonames = old_sonames.get(pkgid, {})
 
+                # New sonames which we do not track yet for this package
+                added.extend(Soname(pkg_id=pkgid, name=soname)
+                             for soname in found_sonames if soname not in pkg_sonames)
                 # Clean up sonames which are not linked to the package anymore
-                old_sonames.exclude(name__in=found_sonames).delete()
-
-                sonames.extend(pkg_sonames)
-
-    if sonames:
-        Soname.objects.bulk_create(sonames)
+                removed.extend(sonameid for soname, sonameid in pkg_sonames.items()
+                               if soname not in found_sonames)
+
+    with transaction.atomic():
+        for batch in batches(removed, 500):
+            Soname.objects.filter(id__in=batch).delete()
+        batched_bulk_create(Soname, added)
+
+    elapsed = time.monotonic() - start
+    logger.info("Imported sonames of %d packages in %.1f seconds (%.0f packages/s), "
+                "%d added, %d removed", packages, elapsed, packages / elapsed if elapsed else 0,
+                len(added), len(removed))
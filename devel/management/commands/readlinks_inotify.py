@@ -7,7 +7,14 @@
 
 from main.models import Arch, Repo
 
-from .archweb_inotify import EventHandler
+from .archweb_inotify import (
+    EventHandler,
+    add_import_arguments,
+    create_pool,
+    create_scheduler,
+    elect_leader,
+    repo_priority,
+)
 from .readlinks import read_links
 
 logger = logging.getLogger("command")
@@ -21,6 +28,9 @@ class Command(BaseCommand):
     help = "Watch links files and run an update when necessary."
     args = "[path_template]"
 
+    def add_arguments(self, parser):
+        add_import_arguments(parser)
+
     def handle(self, path_template=None, **options):
         v = int(options.get('verbosity', 0))
         if v == 0:
@@ -34,7 +44,10 @@ def handle(self, path_template=None, **options):
             path_template = '/srv/ftp/%(repo)s/os/%(arch)s/'
         self.path_template = path_template
 
-        notifier = self.setup_notifier()
+        leader = elect_leader('readlinks_inotify', options)
+        pool = create_pool(wrapper_read_links, options)
+        scheduler = create_scheduler(options)
+        notifier = self.setup_notifier(pool, scheduler)
         # this thread is done using the database; all future access is done in
         # the spawned read_repo() processes, so close the otherwise completely
         # idle connection.
@@ -47,9 +60,15 @@ def handle(self, path_template=None, **options):
         for thread in threading.enumerate():
             if hasattr(thread, 'cancel'):
                 thread.cancel()
+        if pool is not None:
+            pool.close()
+        if leader is not None:
+            leader.release()
+            if leader.lost:
+                raise CommandError('Lost the leader lock, exiting')
 
     @transaction.atomic
-    def setup_notifier(self):
+    def setup_notifier(self, pool=None, scheduler=None):
         '''Set up and configure the inotify machinery and logic.
         This takes the provided or default path_template and builds a list of
         directories we need to watch for database updates. It then validates
@@ -91,7 +110,9 @@ def setup_notifier(self):
 
         handler = EventHandler(arch_paths=arch_path_map,
                                filename_suffix='.links.tar.gz',
-                               callback_func=wrapper_read_links)
+                               callback_func=wrapper_read_links,
+                               pool=pool, scheduler=scheduler,
+                               repo_priorities={repo.name.lower(): repo_priority(repo) for repo in repos})
         return pyinotify.Notifier(manager, handler)
 
 
@@ -0,0 +1,284 @@
+"""
+rebuild_files command
+
+Rebuilds the file lists of all packages from the repo.files.tar.gz files. The
+rows are loaded into a new table, which is indexed and checked against the
+parsed databases. Only then are packages and package_files locked, briefly,
+to catch up with the imports that ran during the load and to swap the new
+table in for package_files. Readers keep seeing the complete old table until
+then, and the new one starts out without any of the bloat of rewriting file
+lists in place. Packages with no up to date file list in any of the
+databases, or changed by an import during the load, keep their current rows.
+
+Only PostgreSQL is supported.
+
+Usage: ./manage.py rebuild_files [path_template]
+
+Where 'path_template' is the same template reporead_inotify takes, by default
+'/srv/ftp/%(repo)s/os/%(arch)s/'.
+"""
+
+import logging
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+from django.utils.timezone import now
+
+from devel.utils import advisory_lock
+from main.models import Arch, Package, PackageFile, Repo
+from main.utils import database_vendor
+
+from .reporead import PACKAGE_FILE_FIELDS, RepoArchive, copy_rows, create_pkg_files, parse_repo, pkg_same_version
+
+logger = logging.getLogger("command")
+logger.setLevel(logging.WARNING)
+
+# rows sent to the database per COPY
+COPY_BATCH_SIZE = 100000
+
+
+class Command(BaseCommand):
+    help = "Rebuild the file lists of all packages in a new table and swap it in."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path_template', nargs='?', default='/srv/ftp/%(repo)s/os/%(arch)s/',
+                            help='Template of the directories holding the files databases.')
+
+    def handle(self, path_template, **options):
+        v = int(options.get('verbosity', 0))
+        if v == 0:
+            logger.level = logging.ERROR
+        elif v == 1:
+            logger.level = logging.INFO
+        elif v >= 2:
+            logger.level = logging.DEBUG
+
+        if database_vendor(PackageFile, 'write') != 'postgresql':
+            raise CommandError('Rebuilding the file lists requires PostgreSQL.')
+
+        databases = []
+        for repo in Repo.objects.all():
+            for arch in Arch.objects.filter(agnostic=False):
+                directory = path_template % {'repo': repo.name.lower(), 'arch': arch.name}
+                path = os.path.join(directory, f'{repo.name.lower()}.files.tar.gz')
+                if os.path.isfile(path):
+                    databases.append((repo, arch, path))
+                else:
+                    logger.info('No files database for %s (%s) at %s', repo.name, arch.name, path)
+        if not databases:
+            raise CommandError('No files databases found.')
+
+        rebuild_files(databases)
+
+
+def file_rows(repo, arch, path, loaded):
+    """
+    Yields the PackageFile rows of every package of a files database whose
+    version matches the one in the web database, skipping those in loaded.
+    The packages are added to loaded, mapping their id to the number of rows
+    yielded for them and to their (last_update, files_last_update) at the
+    time, which tells whether an import changed them since.
+    """
+    archive = RepoArchive(path)
+    try:
+        _, pkgs = parse_repo(path, archive)
+        arches = {arch.id: arch.name for arch in Arch.objects.filter(agnostic=True)}
+        arches[arch.id] = arch.name
+        dbpkgs = {(dbpkg.pkgname, arches[dbpkg.arch_id]): dbpkg for dbpkg in
+                  Package.objects.filter(repo=repo, arch__in=arches).only(
+                      'id', 'pkgname', 'arch', 'epoch', 'pkgver', 'pkgrel',
+                      'last_update', 'files_last_update')}
+        for pkg in pkgs:
+            dbpkg = dbpkgs.get((pkg.name, pkg.arch))
+            if dbpkg is None or dbpkg.id in loaded or not pkg.has_files:
+                continue
+            if not pkg_same_version(pkg, dbpkg):
+                logger.info('Files database has %s for package %s, keeping its files',
+                            pkg.full_version, dbpkg.pkgname)
+                continue
+            files = pkg.files_list
+            # same as populate_files(), keep what we have if this is unusable
+            if not files:
+                continue
+            loaded[dbpkg.id] = (len(files), (dbpkg.last_update, dbpkg.files_last_update))
+            yield from create_pkg_files(dbpkg, sorted(files))
+    finally:
+        archive.close()
+
+
+def check_loaded_rows(cursor, shadow, loaded):
+    """
+    Compares the rows in shadow of every loaded package against the number
+    of files its database listed, raising CommandError on any mismatch.
+    """
+    pkg_column = PackageFile._meta.get_field('pkg').column
+    cursor.execute(f'SELECT {pkg_column}, count(*) FROM {shadow} GROUP BY {pkg_column}')
+    counts = dict(cursor.fetchall())
+    mismatched = [pkg_id for pkg_id, (rows, _) in loaded.items() if counts.get(pkg_id, 0) != rows]
+    unexpected = counts.keys() - loaded.keys()
+    if mismatched or unexpected:
+        raise CommandError(f'New table does not match the files databases: {len(mismatched)} packages '
+                           f'have the wrong number of rows, {len(unexpected)} packages were never loaded.')
+
+
+def stale_packages(loaded):
+    """
+    The ids of the loaded packages an import removed or changed since their
+    files were read, their rows in the new table are out of date.
+    """
+    current = {pkg_id: (last_update, files_last_update) for pkg_id, last_update, files_last_update in
+               Package.objects.filter(id__in=loaded).values_list('id', 'last_update', 'files_last_update')}
+    return {pkg_id for pkg_id, (_, stamp) in loaded.items() if current.get(pkg_id) != stamp}
+
+
+def copy_constraints(cursor, table, shadow):
+    """
+    Creates the primary key, indexes and constraints other than foreign keys
+    of table on shadow, under temporary names. Returns the (kind, temporary
+    name, name) renames to apply once shadow replaced table and the foreign
+    keys, as (temporary name, name, definition), left for add_foreign_keys().
+    """
+    renames = []
+    foreign_keys = []
+    cursor.execute("SELECT conname, pg_get_constraintdef(oid), contype FROM pg_constraint "
+                   "WHERE conrelid = %s::regclass ORDER BY conname", [table])
+    constraints = cursor.fetchall()
+    cursor.execute("SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i "
+                   "JOIN pg_class c ON c.oid = i.indexrelid WHERE i.indrelid = %s::regclass "
+                   "AND i.indexrelid NOT IN (SELECT conindid FROM pg_constraint WHERE conrelid = %s::regclass)",
+                   [table, table])
+    indexes = cursor.fetchall()
+
+    for name, definition, kind in constraints:
+        temporary = f'{name[:59]}_new'
+        renames.append(('CONSTRAINT', temporary, name))
+        if kind == 'f':
+            # a foreign key would keep imports from deleting packages the
+            # new table still has rows of
+            foreign_keys.append((temporary, name, definition))
+            continue
+        cursor.execute(f'ALTER TABLE {shadow} ADD CONSTRAINT {temporary} {definition}')
+    for name, definition in indexes:
+        temporary = f'{name[:59]}_new'
+        prefix, columns = definition.split(' USING ', 1)
+        unique = 'UNIQUE ' if prefix.startswith('CREATE UNIQUE') else ''
+        cursor.execute(f'CREATE {unique}INDEX {temporary} ON {shadow} USING {columns}')
+        renames.append(('INDEX', temporary, name))
+    return renames, foreign_keys
+
+
+def add_foreign_keys(cursor, shadow, foreign_keys):
+    """
+    Adds the foreign keys left out by copy_constraints() without checking
+    the existing rows, which would scan the whole table. They are validated
+    by validate_foreign_keys() once the table is in use.
+    """
+    for temporary, _, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE {shadow} ADD CONSTRAINT {temporary} {definition} NOT VALID')
+
+
+def validate_foreign_keys(cursor, table, foreign_keys):
+    """
+    Checks the rows of table, which replaced the shadow table, against the
+    foreign keys added by add_foreign_keys(). This does not keep anyone from
+    reading or writing the table or the ones it refers to.
+    """
+    for _, name, _ in foreign_keys:
+        cursor.execute(f'ALTER TABLE {table} VALIDATE CONSTRAINT {name}')
+
+
+def swap_tables(cursor, table, shadow, renames):
+    '''Replaces table with shadow, which takes over its names and sequence.'''
+    cursor.execute('SELECT pg_get_serial_sequence(%s, %s), pg_get_serial_sequence(%s, %s)',
+                   [table, 'id', shadow, 'id'])
+    sequence, shadow_sequence = cursor.fetchone()
+    cursor.execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE')
+    if shadow_sequence is None and sequence:
+        # a serial column shares its sequence with the copied table, which
+        # would drop it along with itself
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {shadow}.id')
+    cursor.execute(f'DROP TABLE {table}')
+    cursor.execute(f'ALTER TABLE {shadow} RENAME TO {table}')
+    for kind, temporary, name in renames:
+        if kind == 'CONSTRAINT':
+            cursor.execute(f'ALTER TABLE {table} RENAME CONSTRAINT {temporary} TO {name}')
+        else:
+            cursor.execute(f'ALTER INDEX {temporary} RENAME TO {name}')
+    if shadow_sequence and sequence:
+        # an identity column got a sequence of its own
+        cursor.execute(f'ALTER SEQUENCE {shadow_sequence} RENAME TO {sequence.rsplit(".", 1)[-1]}')
+
+
+def rebuild_files(databases):
+    """
+    Rebuilds package_files from the given (repo, arch, path) files databases
+    in a new table and swaps it in. Returns the number of rows loaded from
+    the databases and kept from the current table.
+    """
+    database = router.db_for_write(PackageFile)
+    connection = connections[database]
+    table = PackageFile._meta.db_table
+    shadow = f'{table}_new'
+    columns = ', '.join(PackageFile._meta.get_field(name).column for name in PACKAGE_FILE_FIELDS)
+    pkg_column = PackageFile._meta.get_field('pkg').column
+    start = time.perf_counter()
+
+    # another rebuild would load into the same new table
+    with advisory_lock('rebuild_files', using=database):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {shadow}')
+            cursor.execute(f'CREATE TABLE {shadow} (LIKE {table} INCLUDING DEFAULTS INCLUDING IDENTITY)')
+        try:
+            # nothing is locked while loading, imports and the web carry on
+            loaded = {}
+            for repo, arch, path in databases:
+                logger.info('Loading files of %s (%s) from %s', repo.name, arch.name, path)
+                batch = []
+                for row in file_rows(repo, arch, path, loaded):
+                    batch.append(row)
+                    if len(batch) >= COPY_BATCH_SIZE:
+                        copy_rows(PackageFile, PACKAGE_FILE_FIELDS, batch, table=shadow)
+                        batch = []
+                if batch:
+                    copy_rows(PackageFile, PACKAGE_FILE_FIELDS, batch, table=shadow)
+
+            with connection.cursor() as cursor:
+                renames, foreign_keys = copy_constraints(cursor, table, shadow)
+                check_loaded_rows(cursor, shadow, loaded)
+
+            with transaction.atomic(using=database), connection.cursor() as cursor:
+                # imports only wait for the catch-up and the swap
+                cursor.execute(f'LOCK TABLE {Package._meta.db_table}, {table} IN EXCLUSIVE MODE')
+                stale = stale_packages(loaded)
+                if stale:
+                    logger.info('%d packages changed during the load, keeping their current rows', len(stale))
+                    cursor.execute(f'DELETE FROM {shadow} WHERE {pkg_column} = ANY(%s)', [list(stale)])
+                    for pkg_id in stale:
+                        del loaded[pkg_id]
+                cursor.execute(f'INSERT INTO {shadow} ({columns}) SELECT {columns} FROM {table} '
+                               f'WHERE NOT ({pkg_column} = ANY(%s))', [list(loaded)])
+                kept_rows = cursor.rowcount
+                loaded_rows = sum(rows for rows, _ in loaded.values())
+                logger.info('Loaded %d rows for %d packages, kept %d rows of other packages',
+                            loaded_rows, len(loaded), kept_rows)
+
+                add_foreign_keys(cursor, shadow, foreign_keys)
+                Package.objects.filter(id__in=loaded).update(files_last_update=now())
+                swap_tables(cursor, table, shadow, renames)
+        except BaseException:
+            with connection.cursor() as cursor:
+                cursor.execute(f'DROP TABLE IF EXISTS {shadow}')
+            raise
+
+    with connection.cursor() as cursor:
+        validate_foreign_keys(cursor, table, foreign_keys)
+        cursor.execute(f'ANALYZE {table}')
+
+    elapsed = time.perf_counter() - start
+    logger.info('Rebuilt %s with %d rows in %.1fs (%.0f rows/s)',
+                table, loaded_rows + kept_rows, elapsed, loaded_rows / elapsed)
+    return loaded_rows, kept_rows
+
+# vim: set ts=4 sw=4 et:
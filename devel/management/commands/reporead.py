@@ -10,33 +10,58 @@
 
 Example:
   ./manage.py reporead x86_64 /tmp/core.db.tar.gz
+
+Every run is recorded in the import history (see main.models.ImportRun) with
+the time, queries and rows of each of its phases; --report additionally
+writes that as JSON.
 """
 
+import hashlib
+import heapq
 import io
+import json
 import logging
+import multiprocessing
 import os
 import re
+import sys
 import tarfile
+import time
+import tracemalloc
 from base64 import b64decode
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
 from copy import copy
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from itertools import repeat
+from operator import attrgetter, itemgetter
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.management.base import BaseCommand, CommandError
 from django.db import connections, router, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Collate
 from django.db.utils import IntegrityError
 from django.utils.timezone import now
 
-from devel.utils import UserFinder
-from main.models import Arch, Package, PackageFile, Repo
+from devel.signals import ChangeSet, packages_changed
+from devel.utils import UserFinder, advisory_lock
+from main.models import Arch, ImportRun, Package, PackageFile, Repo, RepoDatabase
+from main.utils import database_vendor, set_version_key
 from packages.models import (
     Conflict,
     Depend,
     FlagRequest,
+    License,
+    PackageGroup,
     PackageRelation,
     Provision,
     Replacement,
+    ReverseDepend,
     Update,
 )
 from packages.utils import parse_version
@@ -69,6 +94,68 @@ def add_arguments(self, parser):
                             not add or remove any packages. Will not touch the \
                             \'last updated\' value.')
 
+        parser.add_argument('--batch-size',
+                            type=int,
+                            dest='batch_size',
+                            default=None,
+                            help='Add, remove and update packages in batches \
+                            of this size using bulk queries, instead of one \
+                            transaction per package.')
+
+        parser.add_argument('--commit-size',
+                            type=int,
+                            dest='commit_size',
+                            default=None,
+                            help='Without --batch-size, commit this many \
+                            packages per transaction instead of every \
+                            package on its own.')
+
+        parser.add_argument('--no-digest',
+                            action='store_false',
+                            dest='digest',
+                            default=True,
+                            help='Do not skip databases and packages whose \
+                            content is unchanged since they were last imported.')
+
+        parser.add_argument('--low-memory',
+                            action='store_true',
+                            dest='low_memory',
+                            default=False,
+                            help='Diff against the packages in the database a \
+                            batch at a time in name order instead of loading \
+                            them all at once. Use with --batch-size to bound \
+                            memory use on huge repos.')
+
+        parser.add_argument('--parse-workers',
+                            type=int,
+                            dest='parse_workers',
+                            default=None,
+                            help='Parse the package metadata in this many \
+                            processes instead of in this one.')
+
+        parser.add_argument('--files-workers',
+                            type=int,
+                            dest='files_workers',
+                            default=None,
+                            help='With --filesonly, load the file lists in \
+                            this many processes, each with its own database \
+                            connection.')
+
+        parser.add_argument('--report',
+                            dest='report',
+                            default=None,
+                            metavar='PATH',
+                            help='Write a JSON report of the time, queries and \
+                            rows of each import phase to PATH, or to stdout \
+                            if PATH is -.')
+
+        parser.add_argument('--trace-memory',
+                            action='store_true',
+                            dest='trace_memory',
+                            default=False,
+                            help='Also trace the peak memory allocated in each \
+                            import phase. This slows down the import.')
+
     def handle(self, arch=None, filename=None, **options):
         if not arch:
             raise CommandError('Architecture is required.')
@@ -86,7 +173,7 @@ def handle(self, arch=None, filename=None, **options):
         elif v >= 2:
             logger.level = logging.DEBUG
 
-        return read_repo(arch, filename, options)
+        return read_repo(arch, filename, options, stdout=self.stdout)
 
 
 class RepoPackage:
@@ -96,9 +183,17 @@ class RepoPackage:
     number = ('csize', 'isize')
     collections = ('depends', 'optdepends', 'makedepends', 'checkdepends',
                    'conflicts', 'provides', 'replaces', 'groups', 'license')
-
-    def __init__(self, repo):
+    # the fields read from the desc and depends members, see record()
+    parsed = ('ver', 'rel', 'epoch', 'desc', 'pgpsig', 'builddate',
+              *bare, *number, *collections)
+    # values repeated across many packages, which are stored only once
+    interned = ('name', 'base', 'arch', 'packager', *collections)
+    # tens of thousands of these are alive during an import
+    __slots__ = ('repo', 'archive', 'files_member', 'digest', *parsed)
+
+    def __init__(self, repo, archive=None):
         self.repo = repo
+        self.archive = archive
         self.ver = None
         self.rel = None
         self.epoch = 0
@@ -109,13 +204,18 @@ def __init__(self, repo):
         for k in self.collections:
             setattr(self, k, ())
         self.builddate = None
-        self.files = None
+        # (offset, size) of the 'files' member within the archive; the data
+        # itself is only read when populate_files() actually needs it
+        self.files_member = None
+        # SHA-256 over the raw desc/depends members, see parse_repo()
+        self.digest = None
 
     def populate(self, values):
         for k, v in values.items():
             # ensure we stay under our DB character limit
             if k in self.bare:
-                setattr(self, k, v[0][:254])
+                value = v[0][:254]
+                setattr(self, k, sys.intern(value) if k in self.interned else value)
             elif k in self.number:
                 setattr(self, k, int(v[0]))
             elif k in ('desc', 'pgpsig'):
@@ -130,9 +230,29 @@ def populate(self, values):
                     logger.warning(
                         'Package %s had unparsable build date %s',
                         self.name, v[0])
-            else:
-                # anything left in collections
-                setattr(self, k, tuple(v))
+            elif k in self.collections:
+                setattr(self, k, tuple(sys.intern(item) for item in v))
+
+    def record(self):
+        """The parsed fields as a tuple, to pass the package between processes."""
+        return tuple(getattr(self, k) for k in self.parsed)
+
+    def load_record(self, record):
+        for k, value in zip(self.parsed, record, strict=True):
+            if value and k in self.interned:
+                # unpickled strings are new objects, intern them here again
+                value = tuple(map(sys.intern, value)) if k in self.collections else sys.intern(value)
+            setattr(self, k, value)
+
+    @property
+    def has_files(self):
+        return self.files_member is not None
+
+    @property
+    def files(self):
+        if self.files_member is None:
+            return None
+        return self.archive.read_member(*self.files_member)
 
     @property
     def files_list(self):
@@ -156,67 +276,112 @@ def full_version(self):
 DEPEND_RE = re.compile(r"^(.+?)((>=|<=|=|>|<)(.+))?$")
 
 
-def create_depend(package, dep_str, deptype='D'):
-    depend = Depend(pkg=package, deptype=deptype)
+@lru_cache(maxsize=65536)
+def parse_relation(rel_str):
+    """
+    Splits a 'name[<comparison><version>]' string, returning a (name,
+    comparison, version) tuple or None if it is unparsable. The same strings
+    recur all over a repo, so the results are cached.
+    """
+    match = DEPEND_RE.match(rel_str)
+    if not match:
+        return None
+    return sys.intern(match.group(1)), match.group(3), match.group(4)
+
+
+@lru_cache(maxsize=65536)
+def parse_depend(dep_str):
+    """
+    Like parse_relation(), for depend strings which may carry a description,
+    returning a (name, comparison, version, description) tuple.
+    """
     # lop off any description first, don't get confused by epoch
     parts = dep_str.split(': ', 1)
-    if len(parts) > 1:
-        depend.description = parts[1].strip()
-    match = DEPEND_RE.match(parts[0].strip())
-    if match:
-        depend.name = match.group(1)
-        if match.group(3):
-            depend.comparison = match.group(3)
-        if match.group(4):
-            depend.version = match.group(4)
-    else:
+    relation = parse_relation(parts[0].strip())
+    if relation is None:
+        return None
+    description = parts[1].strip() if len(parts) > 1 else None
+    return (*relation, description)
+
+
+def create_depend(package, dep_str, deptype='D'):
+    depend = Depend(pkg=package, deptype=deptype)
+    parsed = parse_depend(dep_str)
+    if parsed is None:
         logger.warning('Package %s had unparsable depend string %s',
                        package.pkgname, dep_str)
         return None
+    name, comparison, version, description = parsed
+    depend.name = name
+    if description is not None:
+        depend.description = description
+    if comparison:
+        depend.comparison = comparison
+    if version:
+        depend.version = version
     return depend
 
 
 def create_related(model, package, rel_str, equals_only=False):
     related = model(pkg=package)
-    match = DEPEND_RE.match(rel_str)
-    if match:
-        related.name = match.group(1)
-        if match.group(3):
-            comp = match.group(3)
-            if not equals_only:
-                related.comparison = comp
-            elif comp != '=':
-                logger.warning(
-                    'Package %s had unexpected comparison operator %s for %s in %s',
-                    package.pkgname, comp, model.__name__, rel_str)
-        if match.group(4):
-            related.version = match.group(4)
-    else:
+    parsed = parse_relation(rel_str)
+    if parsed is None:
         logger.warning('Package %s had unparsable %s string %s',
-                       package.pkgname, model.___name__, rel_str)
+                       package.pkgname, model.__name__, rel_str)
         return None
+    related.name, comp, version = parsed
+    if comp:
+        if not equals_only:
+            related.comparison = comp
+        elif comp != '=':
+            logger.warning(
+                'Package %s had unexpected comparison operator %s for %s in %s',
+                package.pkgname, comp, model.__name__, rel_str)
+    if version:
+        related.version = version
     return related
 
 
-def create_multivalued(dbpkg, repopkg, db_attr, repo_attr):
-    '''Populate the simplest of multivalued attributes. These are those that
-    only deal with a 'name' attribute, such as licenses, groups, etc. The input
-    and output objects and attribute names are specified, and everything is
-    done via getattr().'''
-    collection = getattr(dbpkg, db_attr)
-    collection.all().delete()
-    model = collection.model
-    new_items = []
-    for name in getattr(repopkg, repo_attr):
-        new_items.append(model(pkg=dbpkg, name=name))
-    if new_items:
-        model.objects.bulk_create(new_items)
+def create_multivalued(dbpkg, repopkg, model, repo_attr):
+    '''Build the simplest of multivalued attributes. These are those that
+    only deal with a 'name' attribute, such as licenses, groups, etc. The output
+    model and the input attribute name are specified, and the input values are
+    retrieved via getattr().'''
+    return [model(pkg=dbpkg, name=name) for name in getattr(repopkg, repo_attr)]
+
+
+def create_related_objects(dbpkg, repopkg):
+    '''Build, but do not save, all rows in related tables for this package,
+    returned as a dict of model to list of instances.'''
+    deps = [create_depend(dbpkg, y) for y in repopkg.depends]
+    deps += [create_depend(dbpkg, y, 'O') for y in repopkg.optdepends]
+    deps += [create_depend(dbpkg, y, 'M') for y in repopkg.makedepends]
+    deps += [create_depend(dbpkg, y, 'C') for y in repopkg.checkdepends]
+    related = {
+        Depend: deps,
+        Conflict: [create_related(Conflict, dbpkg, y) for y in repopkg.conflicts],
+        Provision: [create_related(Provision, dbpkg, y, equals_only=True) for y in repopkg.provides],
+        Replacement: [create_related(Replacement, dbpkg, y) for y in repopkg.replaces],
+        PackageGroup: create_multivalued(dbpkg, repopkg, PackageGroup, 'groups'),
+        License: create_multivalued(dbpkg, repopkg, License, 'license'),
+    }
+    # unparsable strings were already logged, just drop them here
+    return {model: [item for item in items if item is not None]
+            for model, items in related.items()}
 
 
 finder = UserFinder()
 
+# the Package fields written by populate_pkg_fields(); used for bulk updates
+PACKAGE_FIELDS = ('pkgbase', 'pkgver', 'pkgrel', 'epoch', 'version_key', 'pkgdesc', 'url',
+                  'filename', 'compressed_size', 'installed_size', 'build_date',
+                  'packager_str', 'packager', 'signature_bytes', 'last_update',
+                  'flag_date', 'metadata_digest')
 
-def populate_pkg(dbpkg, repopkg, force=False, timestamp=None, package_sigs=False, repo_dir=None):
+
+def populate_pkg_fields(dbpkg, repopkg, timestamp=None, repo_dir=None):
+    '''Copy all single-valued package data from the repo package onto the
+    database package. Nothing is saved.'''
     # we reset the flag date only if the upstream version components change;
     # e.g. epoch or pkgver, but not pkgrel
     if dbpkg.epoch is None or dbpkg.epoch != repopkg.epoch:
@@ -224,13 +389,6 @@ def populate_pkg(dbpkg, repopkg, force=False, timestamp=None, package_sigs=False
     elif dbpkg.pkgver is None or dbpkg.pkgver != repopkg.ver:
         dbpkg.flag_date = None
 
-    # Remove flagged out of date objects when a package is updated.
-    if dbpkg.epoch != repopkg.epoch or dbpkg.pkgver != repopkg.ver:
-        repo = Repo.objects.get(name__iexact=repopkg.repo)
-        requests = FlagRequest.objects.filter(pkgbase=repopkg.base, repo=repo)
-        requests = requests.exclude(pkgver=repopkg.ver, epoch=repopkg.epoch)
-        requests.delete()
-
     if repopkg.base:
         dbpkg.pkgbase = repopkg.base
     else:
@@ -238,6 +396,8 @@ def populate_pkg(dbpkg, repopkg, force=False, timestamp=None, package_sigs=False
     dbpkg.pkgver = repopkg.ver
     dbpkg.pkgrel = repopkg.rel
     dbpkg.epoch = repopkg.epoch
+    # bulk saves skip the pre_save signal setting it
+    set_version_key(Package, instance=dbpkg)
     dbpkg.pkgdesc = repopkg.desc
     dbpkg.url = repopkg.url
     dbpkg.filename = repopkg.filename
@@ -260,41 +420,72 @@ def populate_pkg(dbpkg, repopkg, force=False, timestamp=None, package_sigs=False
 
     if timestamp:
         dbpkg.last_update = timestamp
-    dbpkg.save()
+    dbpkg.metadata_digest = repopkg.digest
 
-    populate_files(dbpkg, repopkg, force=force)
 
-    dbpkg.depends.all().delete()
-    deps = [create_depend(dbpkg, y) for y in repopkg.depends]
-    deps += [create_depend(dbpkg, y, 'O') for y in repopkg.optdepends]
-    deps += [create_depend(dbpkg, y, 'M') for y in repopkg.makedepends]
-    deps += [create_depend(dbpkg, y, 'C') for y in repopkg.checkdepends]
-    Depend.objects.bulk_create(deps)
-
-    dbpkg.conflicts.all().delete()
-    conflicts = [create_related(Conflict, dbpkg, y) for y in repopkg.conflicts]
-    Conflict.objects.bulk_create(conflicts)
+def populate_pkg(dbpkg, repopkg, force=False, timestamp=None, package_sigs=False, repo_dir=None):
+    # Remove flagged out of date objects when a package is updated.
+    if dbpkg.epoch != repopkg.epoch or dbpkg.pkgver != repopkg.ver:
+        repo = Repo.objects.get(name__iexact=repopkg.repo)
+        requests = FlagRequest.objects.filter(pkgbase=repopkg.base, repo=repo)
+        requests = requests.exclude(pkgver=repopkg.ver, epoch=repopkg.epoch)
+        requests.delete()
 
-    dbpkg.provides.all().delete()
-    provides = [create_related(Provision, dbpkg, y, equals_only=True) for y in repopkg.provides]
-    Provision.objects.bulk_create(provides)
+    populate_pkg_fields(dbpkg, repopkg, timestamp=timestamp, repo_dir=repo_dir)
+    dbpkg.save()
 
-    dbpkg.replaces.all().delete()
-    replaces = [create_related(Replacement, dbpkg, y) for y in repopkg.replaces]
-    Replacement.objects.bulk_create(replaces)
+    populate_files(dbpkg, repopkg, force=force)
 
-    create_multivalued(dbpkg, repopkg, 'groups', 'groups')
-    create_multivalued(dbpkg, repopkg, 'licenses', 'license')
+    for model, items in create_related_objects(dbpkg, repopkg).items():
+        model.objects.filter(pkg=dbpkg).delete()
+        bulk_insert_objects(model, items)
 
 
 pkg_same_version = lambda pkg, dbpkg: pkg.ver == dbpkg.pkgver \
     and pkg.rel == dbpkg.pkgrel and pkg.epoch == dbpkg.epoch
 
 
+def pkg_unchanged(pkg, dbpkg):
+    '''Whether even a forced import can skip this package: its metadata is
+    byte for byte what we imported last time and, if this database carries
+    file lists, they were loaded after that import.'''
+    if pkg.digest is None or pkg.digest != dbpkg.metadata_digest:
+        return False
+    if pkg.has_files:
+        if not dbpkg.files_last_update or not dbpkg.last_update:
+            return False
+        if dbpkg.files_last_update < dbpkg.last_update:
+            return False
+    return True
+
+
 def delete_pkg_files(dbpkg):
-    database = router.db_for_write(Package, instance=dbpkg)
-    cursor = connections[database].cursor()
-    cursor.execute('DELETE FROM package_files WHERE pkg_id = %s', [dbpkg.id])
+    delete_pkgs_files([dbpkg.id])
+
+
+# package ids per DELETE where each needs a parameter of its own, well below the
+# 999 variables older SQLite versions allow
+DELETE_CHUNK_SIZE = 500
+
+
+def delete_pkgs_files(pkg_ids):
+    if not pkg_ids:
+        return
+    database = router.db_for_write(Package)
+    connection = connections[database]
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        # a single array parameter keeps the statement the same for any count
+        cursor.execute('DELETE FROM package_files WHERE pkg_id = ANY(%s)', [list(pkg_ids)])
+    else:
+        for batch in batches(list(pkg_ids), DELETE_CHUNK_SIZE):
+            placeholders = ', '.join(['%s'] * len(batch))
+            cursor.execute(f'DELETE FROM package_files WHERE pkg_id IN ({placeholders})', batch)
+
+
+def batches(items, size):
+    for offset in range(0, len(items), size):
+        yield items[offset:offset + size]
 
 
 def batched_bulk_create(model, all_objects):
@@ -315,53 +506,290 @@ def chunks():
     return ret
 
 
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def copy_format_row(row):
+    '''Format a tuple of values as a line of PostgreSQL's COPY text format.'''
+    values = []
+    for value in row:
+        if value is None:
+            values.append('\\N')
+        elif isinstance(value, bool):
+            values.append('t' if value else 'f')
+        else:
+            values.append(str(value).translate(COPY_ESCAPES))
+    return '\t'.join(values) + '\n'
+
+
+def copy_rows(model, fields, rows, table=None):
+    '''Stream rows into the table of the given model, or into another table
+    with the same columns, with COPY FROM STDIN.'''
+    database = router.db_for_write(model)
+    table = table or model._meta.db_table
+    columns = ', '.join(model._meta.get_field(name).column for name in fields)
+    sql = f'COPY {table} ({columns}) FROM STDIN'
+    with connections[database].cursor() as cursor:
+        raw_cursor = cursor.cursor
+        for batch in batches(rows, 10000):
+            data = ''.join(copy_format_row(row) for row in batch)
+            if hasattr(raw_cursor, 'copy_expert'):
+                # psycopg2
+                raw_cursor.copy_expert(sql, io.StringIO(data))
+            else:
+                # psycopg 3
+                with raw_cursor.copy(sql) as copy:
+                    copy.write(data)
+    # COPY goes around the cursor wrapper the import report counts rows with
+    report = current_report.get()
+    if report is not None:
+        report.add_rows(table, 'insert', len(rows))
+
+
+def bulk_insert_rows(model, fields, rows):
+    '''Insert rows, given as tuples of values for the named fields, into the
+    table of the given model. On PostgreSQL this goes through COPY, which
+    avoids building a model instance and query parameters per row; other
+    databases fall back to bulk_create().'''
+    if not rows:
+        return
+    if database_vendor(model, 'write') == 'postgresql':
+        copy_rows(model, fields, rows)
+    else:
+        batched_bulk_create(model, [model(**dict(zip(fields, row, strict=True))) for row in rows])
+
+
+def bulk_insert_objects(model, objects):
+    '''Like bulk_insert_rows(), for unsaved model instances.'''
+    if not objects:
+        return
+    if database_vendor(model, 'write') == 'postgresql':
+        fields = [f.attname for f in model._meta.concrete_fields if not f.primary_key]
+        rows = [tuple(getattr(obj, name) for name in fields) for obj in objects]
+        copy_rows(model, fields, rows)
+    else:
+        batched_bulk_create(model, objects)
+
+
+def split_file_path(path):
+    if '/' in path:
+        dirname, filename = path.rsplit('/', 1)
+        dirname += '/'
+    else:
+        dirname, filename = '', path
+    if filename == '':
+        filename = None
+    return dirname, filename
+
+
+PACKAGE_FILE_FIELDS = ('pkg_id', 'is_directory', 'directory', 'filename')
+
+
+def create_pkg_files(dbpkg, paths):
+    '''Build PackageFile rows, as tuples of PACKAGE_FILE_FIELDS, for paths.'''
+    pkg_files = []
+    for path in paths:
+        dirname, filename = split_file_path(path)
+        pkg_files.append((dbpkg.id, filename is None, dirname, filename))
+    return pkg_files
+
+
 def populate_files(dbpkg, repopkg, force=False):
+    """Loads the file list of a package if needed, returning the number of
+    file rows inserted."""
     if not force:
         if not pkg_same_version(repopkg, dbpkg):
             logger.info("DB version (%s) didn't match repo version "
                         "(%s) for package %s, skipping file list addition",
                         dbpkg.full_version, repopkg.full_version, dbpkg.pkgname)
-            return
+            return 0
         if not dbpkg.files_last_update or not dbpkg.last_update:
             pass
         elif dbpkg.files_last_update >= dbpkg.last_update:
-            return
+            return 0
 
     # only delete files if we are reading a DB that contains them
-    if repopkg.files:
+    if not repopkg.has_files:
+        return 0
+
+    with import_phase('files'):
         files = repopkg.files_list
         # we had files data, but it couldn't be parsed, so skip
         if not files:
-            return
-        delete_pkg_files(dbpkg)
-        logger.info("adding %d files for package %s",
-                    len(files), dbpkg.pkgname)
-        pkg_files = []
+            return 0
+
+        stored = {}
+        if dbpkg.files_last_update:
+            stored = {directory + (filename or ''): file_id for file_id, directory, filename in
+                      PackageFile.objects.filter(pkg=dbpkg).values_list('id', 'directory', 'filename')}
+        new_files = set(files)
+        removed = [file_id for path, file_id in stored.items() if path not in new_files]
         # sort in normal alpha-order that pacman uses, rather than makepkg's
         # default breadth-first, directory-first ordering
-        for f in sorted(files):
-            if '/' in f:
-                dirname, filename = f.rsplit('/', 1)
-                dirname += '/'
-            else:
-                dirname, filename = '', f
-            if filename == '':
-                filename = None
-            pkgfile = PackageFile(pkg=dbpkg,
-                                  is_directory=(filename is None),
-                                  directory=dirname,
-                                  filename=filename)
-            pkg_files.append(pkgfile)
-        batched_bulk_create(PackageFile, pkg_files)
+        added = sorted(new_files.difference(stored))
+
+        if stored and len(removed) + len(added) <= settings.FILES_DIFF_CHURN_RATIO * len(stored):
+            logger.info("updating files for package %s, %d added, %d removed",
+                        dbpkg.pkgname, len(added), len(removed))
+            for batch in batches(removed, 500):
+                PackageFile.objects.filter(id__in=batch).delete()
+        else:
+            delete_pkg_files(dbpkg)
+            logger.info("adding %d files for package %s",
+                        len(files), dbpkg.pkgname)
+            added = sorted(files)
+        bulk_insert_rows(PackageFile, PACKAGE_FILE_FIELDS, create_pkg_files(dbpkg, added))
         dbpkg.files_last_update = now()
         dbpkg.save()
+        return len(added)
+
+
+DML_RE = re.compile(r'^\s*(INSERT INTO|UPDATE|DELETE FROM)\s+["`]?([\w.]+)', re.IGNORECASE)
+DML_ACTIONS = {'insert into': 'insert', 'update': 'update', 'delete from': 'delete'}
 
 
-def update_common(archname, reponame, pkgs, sanity_check=True):
+class ImportReport:
+    """
+    Collects what a read_repo() run spent its time on: the duration and number
+    of queries of each phase, the rows inserted, updated and deleted per
+    table, counts of events like lock waits and, if trace_memory is set, the
+    peak memory allocated by Python. The packages it changed are collected
+    in changes.
+    Phases may nest; a nested phase is counted in its enclosing ones too.
+    """
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.phases = {}
+        self.stack = []
+        self.queries = 0
+        self.rows = defaultdict(lambda: defaultdict(int))
+        self.events = defaultdict(int)
+        self.changes = ChangeSet()
+        self.peak_memory = None
+
+    def _phase(self, name):
+        if name not in self.phases:
+            self.phases[name] = {'seconds': 0.0, 'queries': 0, 'peak_memory': None}
+        return self.phases[name]
+
+    def _update_peak(self):
+        peak = tracemalloc.get_traced_memory()[1]
+        self.peak_memory = max(self.peak_memory or 0, peak)
+        for name in self.stack:
+            phase = self.phases[name]
+            phase['peak_memory'] = max(phase['peak_memory'] or 0, peak)
+
+    @contextmanager
+    def phase(self, name):
+        phase = self._phase(name)
+        if self.trace_memory:
+            # remember the peak so far for the enclosing phases before the
+            # nested phase starts measuring its own
+            self._update_peak()
+            tracemalloc.reset_peak()
+        self.stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            phase['seconds'] += time.perf_counter() - start
+            if self.trace_memory:
+                self._update_peak()
+            self.stack.pop()
+
+    def add_rows(self, table, action, count):
+        self.rows[table][action] += count
+
+    def add_event(self, name, value=1):
+        self.events[name] += value
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        self.queries += 1
+        for name in set(self.stack):
+            self.phases[name]['queries'] += 1
+        match = DML_RE.match(sql)
+        if match:
+            count = context['cursor'].rowcount
+            if count < 0 or (count == 0 and not many and params and 'RETURNING' in sql.upper()):
+                # SQLite only knows the row count of an INSERT ... RETURNING
+                # once its results are fetched, so count the VALUES tuples
+                columns = sql.split('(', 1)[1].split(')', 1)[0].count(',') + 1
+                count = len(params) // columns
+            self.add_rows(match.group(2), DML_ACTIONS[match.group(1).lower()], count)
+        return result
+
+    def merge(self, data):
+        """Adds the counts of another report, given as_dict(), to this one."""
+        self.queries += data['queries']
+        for name, other in data['phases'].items():
+            phase = self._phase(name)
+            phase['seconds'] += other['seconds']
+            phase['queries'] += other['queries']
+        for table, actions in data['rows'].items():
+            for action, count in actions.items():
+                self.add_rows(table, action, count)
+        for name, value in data['events'].items():
+            self.add_event(name, value)
+
+    def as_dict(self):
+        return {
+            'phases': self.phases,
+            'queries': self.queries,
+            'rows': {table: dict(actions) for table, actions in self.rows.items()},
+            'events': dict(self.events),
+            'peak_memory': self.peak_memory,
+        }
+
+
+current_report = ContextVar('current_report', default=None)
+
+
+@contextmanager
+def import_phase(name):
+    """Time the enclosed block as the given phase of the running import."""
+    report = current_report.get()
+    if report is None:
+        yield
+        return
+    with report.phase(name):
+        yield
+
+
+def import_event(name, value=1):
+    """Count an event, like waiting for a lock, in the running import."""
+    report = current_report.get()
+    if report is not None:
+        report.add_event(name, value)
+
+
+def import_changes(action, dbpkgs):
+    """Record packages changed by the running import in its change set."""
+    report = current_report.get()
+    if report is not None:
+        report.changes.add(action, dbpkgs)
+
+
+@contextmanager
+def import_lock(reponame, archname):
+    """
+    Serializes imports of the packages of a repo and arch, also between
+    importers on different hosts, with an advisory lock on PostgreSQL.
+    """
+    name = f'reporead:{reponame.lower()}:{archname}'
+    with advisory_lock(name, using=router.db_for_write(Package)) as waited:
+        if waited is not None:
+            logger.info('Waited %.1fs for another import of %s (%s)', waited, reponame, archname)
+            import_event('lock_waits')
+            import_event('lock_wait_seconds', waited)
+        yield
+
+
+def update_common(archname, reponame, pkgs, sanity_check=True, count_only=False):
     # If isolation level is repeatable-read, we need to ensure each package
     # update starts a new transaction and re-queries the database as
     # necessary to guard against simultaneous updates.
-    with transaction.atomic():
+    with import_phase('sanity'), transaction.atomic():
         # force the transaction dirty, even though we will only do reads
         # https://github.com/django/django/blob/3c447b108ac70757001171f7a4791f493880bf5b/docs/releases/1.3.txt#L606
         # transaction.set_dirty()
@@ -370,12 +798,14 @@ def update_common(archname, reponame, pkgs, sanity_check=True):
         architecture = Arch.objects.get(name=archname)
         # no-arg order_by() removes even the default ordering; we don't need it
         dbpkgs = Package.objects.filter(arch=architecture, repo=repository).order_by()
+        # with count_only the packages are left for the caller to fetch
+        dbcount = dbpkgs.count() if count_only else len(dbpkgs)
 
-        logger.info("%d packages in current web DB", len(dbpkgs))
+        logger.info("%d packages in current web DB", dbcount)
         logger.info("%d packages in new updating DB", len(pkgs))
 
-        if len(dbpkgs):
-            dbpercent = 100.0 * len(pkgs) / len(dbpkgs)
+        if dbcount:
+            dbpercent = 100.0 * len(pkgs) / dbcount
         else:
             dbpercent = 0.0
         logger.info("DB package ratio: %.1f%%", dbpercent)
@@ -387,9 +817,9 @@ def update_common(archname, reponame, pkgs, sanity_check=True):
             pass
         elif repository.testing or repository.public_testing or repository.staging:
             pass
-        elif len(dbpkgs) == 0 and len(pkgs) == 0:
+        elif dbcount == 0 and len(pkgs) == 0:
             pass
-        elif len(dbpkgs) > 20 and dbpercent < 50.0:
+        elif dbcount > 20 and dbpercent < 50.0:
             logger.error(msg, reponame, archname, dbpercent)
             raise Exception(msg % (reponame, archname, dbpercent))
         elif dbpercent < 75.0:
@@ -398,10 +828,289 @@ def update_common(archname, reponame, pkgs, sanity_check=True):
     return dbpkgs
 
 
-def db_update(archname, reponame, pkgs, force=False, repo_dir=None):
+def add_package(architecture, repository, pkg, repo_dir=None):
+    logger.info("Adding package %s", pkg.name)
+    timestamp = now()
+    dbpkg = Package(pkgname=pkg.name, arch=architecture, repo=repository,
+                    created=timestamp)
+    try:
+        with transaction.atomic():
+            populate_pkg(dbpkg, pkg, timestamp=timestamp, repo_dir=repo_dir)
+            Update.objects.log_update(None, dbpkg)
+            ReverseDepend.objects.mark_stale([dbpkg.id])
+
+            if not Package.objects.filter(
+                    pkgname=pkg.name).exclude(id=dbpkg.id).exists():
+                if not User.objects.filter(
+                        package_relations__pkgbase=dbpkg.pkgbase,
+                        package_relations__type=PackageRelation.MAINTAINER).exists():
+                    packager = finder.find(pkg.packager)
+                    if packager:
+                        prel = PackageRelation(pkgbase=dbpkg.pkgbase,
+                                               user=packager,
+                                               type=PackageRelation.MAINTAINER)
+                        prel.save()
+
+    except IntegrityError:
+        import_event('conflicts')
+        if architecture.agnostic:
+            logger.warning("Could not add package %s; "
+                           "not fatal if another thread beat us to it.",
+                           pkg.name)
+        else:
+            import_event('failed_adds')
+            logger.exception("Could not add package %s", pkg.name)
+    else:
+        import_changes('added', [dbpkg])
+
+
+def remove_package(dbpkg):
+    logger.info("Removing package %s", dbpkg.pkgname)
+    with transaction.atomic():
+        Update.objects.log_update(dbpkg, None)
+        # no race condition here as long as simultaneous threads both
+        # issue deletes; second delete will be a no-op
+        delete_pkg_files(dbpkg)
+
+        # Delete all matching FlagRequests when removing a package from a repo.
+        requests = FlagRequest.objects.filter(pkgbase=dbpkg.pkgbase, repo=dbpkg.repo)
+        requests.delete()
+
+        import_changes('removed', [dbpkg])
+        dbpkg.delete()
+
+
+def update_package(dbpkg, pkg, force=False, timestamp=None, repo_dir=None):
+    # The odd select_for_update song and dance here are to ensure
+    # simultaneous updates don't happen on a package, causing
+    # files/depends/all related items to be double-imported.
+    with transaction.atomic():
+        dbpkg = Package.objects.select_for_update().get(id=dbpkg.id)
+        if not force and pkg_same_version(pkg, dbpkg):
+            logger.debug("Package %s was already updated", pkg.name)
+            return
+        logger.info("Updating package %s", pkg.name)
+        prevpkg = copy(dbpkg)
+        populate_pkg(dbpkg, pkg, force=force, timestamp=timestamp, repo_dir=repo_dir)
+        Update.objects.log_update(prevpkg, dbpkg)
+        ReverseDepend.objects.mark_stale([dbpkg.id])
+        import_changes('updated', [dbpkg])
+
+
+def bulk_delete_flag_requests(repository, pairs):
+    '''Delete the flag requests made obsolete by the given (dbpkg, repopkg)
+    updates, the bulk equivalent of what populate_pkg() does.'''
+    obsolete = Q()
+    for dbpkg, pkg in pairs:
+        if dbpkg.epoch != pkg.epoch or dbpkg.pkgver != pkg.ver:
+            obsolete |= Q(pkgbase=pkg.base) & ~Q(pkgver=pkg.ver, epoch=pkg.epoch)
+    if obsolete:
+        FlagRequest.objects.filter(obsolete, repo=repository).delete()
+
+
+def bulk_replace_related(pairs, delete=True):
+    '''Replace the depends, conflicts, provides, etc. of all packages in the
+    given (dbpkg, repopkg) pairs with one DELETE and one INSERT per table.'''
+    related = defaultdict(list)
+    for dbpkg, pkg in pairs:
+        for model, items in create_related_objects(dbpkg, pkg).items():
+            related[model].extend(items)
+    pkg_ids = [dbpkg.id for dbpkg, _ in pairs]
+    for model in (Depend, Conflict, Provision, Replacement, PackageGroup, License):
+        if delete:
+            model.objects.filter(pkg_id__in=pkg_ids).delete()
+        bulk_insert_objects(model, related[model])
+
+
+def bulk_add_maintainers(pairs, timestamp):
+    '''Make the packager the maintainer of every brand new pkgbase that does
+    not have one yet, the bulk equivalent of what add_package() does.'''
+    pkg_ids = [dbpkg.id for dbpkg, _ in pairs]
+    existing = set(Package.objects.filter(
+        pkgname__in=[dbpkg.pkgname for dbpkg, _ in pairs]).exclude(
+        id__in=pkg_ids).values_list('pkgname', flat=True))
+    pairs = [(dbpkg, pkg) for dbpkg, pkg in pairs if dbpkg.pkgname not in existing]
+    maintained = set(PackageRelation.objects.filter(
+        pkgbase__in={dbpkg.pkgbase for dbpkg, _ in pairs},
+        type=PackageRelation.MAINTAINER).values_list('pkgbase', flat=True))
+
+    relations = {}
+    for dbpkg, pkg in pairs:
+        if dbpkg.pkgbase in maintained or dbpkg.pkgbase in relations:
+            continue
+        packager = finder.find(pkg.packager)
+        if packager:
+            relations[dbpkg.pkgbase] = PackageRelation(
+                pkgbase=dbpkg.pkgbase, user=packager,
+                type=PackageRelation.MAINTAINER, created=timestamp)
+    PackageRelation.objects.bulk_create(relations.values())
+
+
+def bulk_add_packages(architecture, repository, pkgs, repo_dir=None):
+    timestamp = now()
+    pairs = []
+    for pkg in pkgs:
+        logger.info("Adding package %s", pkg.name)
+        dbpkg = Package(pkgname=pkg.name, arch=architecture, repo=repository,
+                        created=timestamp)
+        pairs.append((dbpkg, pkg))
+    try:
+        with transaction.atomic():
+            bulk_delete_flag_requests(repository, pairs)
+            for dbpkg, pkg in pairs:
+                populate_pkg_fields(dbpkg, pkg, timestamp=timestamp, repo_dir=repo_dir)
+            dbpkgs = Package.objects.bulk_create([dbpkg for dbpkg, _ in pairs])
+            if any(dbpkg.id is None for dbpkg in dbpkgs):
+                # not every backend returns primary keys from a bulk insert
+                ids = dict(Package.objects.filter(
+                    arch=architecture, repo=repository,
+                    pkgname__in=[dbpkg.pkgname for dbpkg in dbpkgs]).values_list('pkgname', 'id'))
+                for dbpkg in dbpkgs:
+                    dbpkg.id = ids[dbpkg.pkgname]
+            Update.objects.log_updates((None, dbpkg) for dbpkg in dbpkgs)
+            ReverseDepend.objects.mark_stale(dbpkg.id for dbpkg in dbpkgs)
+            bulk_replace_related(pairs, delete=False)
+            for dbpkg, pkg in pairs:
+                populate_files(dbpkg, pkg)
+            bulk_add_maintainers(pairs, timestamp)
+    except IntegrityError:
+        # most likely another import added some of these packages in the
+        # meantime; let the single package path sort out which ones
+        import_event('conflicts')
+        logger.warning("Could not bulk add %d packages, adding them one by one",
+                       len(pairs))
+        for pkg in pkgs:
+            add_package(architecture, repository, pkg, repo_dir=repo_dir)
+    else:
+        import_changes('added', dbpkgs)
+
+
+def bulk_remove_packages(dbpkgs):
+    for dbpkg in dbpkgs:
+        logger.info("Removing package %s", dbpkg.pkgname)
+    pkg_ids = [dbpkg.id for dbpkg in dbpkgs]
+    with transaction.atomic():
+        Update.objects.log_updates((dbpkg, None) for dbpkg in dbpkgs)
+        delete_pkgs_files(pkg_ids)
+        # Delete all matching FlagRequests when removing packages from a repo.
+        FlagRequest.objects.filter(
+            repo=dbpkgs[0].repo, pkgbase__in={dbpkg.pkgbase for dbpkg in dbpkgs}).delete()
+        Package.objects.filter(id__in=pkg_ids).delete()
+    import_changes('removed', dbpkgs)
+
+
+def bulk_update_packages(repository, pairs, force=False, timestamp=None, repo_dir=None):
+    with transaction.atomic():
+        # lock all rows at once, see update_package() for the reasoning; the
+        # arch and repo rows are shared with other imports and stay unlocked
+        locked = Package.objects.select_for_update(of=('self',)).select_related(
+            'arch', 'repo').in_bulk([dbpkg.id for dbpkg, _ in pairs])
+        changes = []
+        for dbpkg, pkg in pairs:
+            dbpkg = locked.get(dbpkg.id)
+            if dbpkg is None:
+                logger.debug("Package %s was already removed", pkg.name)
+                continue
+            if not force and pkg_same_version(pkg, dbpkg):
+                logger.debug("Package %s was already updated", pkg.name)
+                continue
+            logger.info("Updating package %s", pkg.name)
+            changes.append((copy(dbpkg), dbpkg, pkg))
+        if not changes:
+            return
+
+        bulk_delete_flag_requests(repository, [(dbpkg, pkg) for _, dbpkg, pkg in changes])
+        for _, dbpkg, pkg in changes:
+            populate_pkg_fields(dbpkg, pkg, timestamp=timestamp, repo_dir=repo_dir)
+        Package.objects.bulk_update([dbpkg for _, dbpkg, _ in changes], PACKAGE_FIELDS)
+        Update.objects.log_updates((prevpkg, dbpkg) for prevpkg, dbpkg, _ in changes)
+        ReverseDepend.objects.mark_stale(dbpkg.id for _, dbpkg, _ in changes)
+        bulk_replace_related([(dbpkg, pkg) for _, dbpkg, pkg in changes])
+        for _, dbpkg, pkg in changes:
+            populate_files(dbpkg, pkg, force=force)
+        import_changes('updated', [dbpkg for _, dbpkg, _ in changes])
+
+
+def commit_group(commit_size=None):
+    """The transaction a group of commit_size per-package changes is applied
+    in, each package getting a savepoint of its own; with no commit_size,
+    every package is committed on its own."""
+    return transaction.atomic() if commit_size else nullcontext()
+
+
+def add_packages(architecture, repository, pkgs, batch_size=None, repo_dir=None, commit_size=None):
+    with import_phase('add'):
+        if batch_size:
+            for batch in batches(pkgs, batch_size):
+                bulk_add_packages(architecture, repository, batch, repo_dir=repo_dir)
+        else:
+            for group in batches(pkgs, commit_size or 1):
+                with commit_group(commit_size):
+                    for pkg in group:
+                        add_package(architecture, repository, pkg, repo_dir=repo_dir)
+
+
+def remove_packages(dbpkgs, batch_size=None, commit_size=None):
+    with import_phase('remove'):
+        if batch_size:
+            for batch in batches(dbpkgs, batch_size):
+                bulk_remove_packages(batch)
+        else:
+            for group in batches(dbpkgs, commit_size or 1):
+                with commit_group(commit_size):
+                    for dbpkg in group:
+                        remove_package(dbpkg)
+
+
+def update_packages(repository, pairs, force=False, batch_size=None, repo_dir=None,
+                    commit_size=None):
+    # for a force, we don't want to update the timestamp.
+    timestamp = None
+    with import_phase('update'):
+        if batch_size:
+            for batch in batches(pairs, batch_size):
+                if not force:
+                    timestamp = now()
+                bulk_update_packages(repository, batch, force=force,
+                                     timestamp=timestamp, repo_dir=repo_dir)
+        else:
+            for group in batches(pairs, commit_size or 1):
+                with commit_group(commit_size):
+                    for dbpkg, pkg in group:
+                        if not force:
+                            timestamp = now()
+                        update_package(dbpkg, pkg, force=force, timestamp=timestamp,
+                                       repo_dir=repo_dir)
+
+
+def needs_update(pkg, dbpkg, force=False, use_digest=True):
+    logger.debug("Checking package %s", pkg.name)
+    # for a non-force, we don't want to do anything at all.
+    if not force and pkg_same_version(pkg, dbpkg):
+        return False
+    if use_digest and pkg_unchanged(pkg, dbpkg):
+        logger.debug("Package %s is unchanged", pkg.name)
+        return False
+    return True
+
+
+def db_update(archname, reponame, pkgs, force=False, repo_dir=None, batch_size=None,
+              use_digest=True, low_memory=False, commit_size=None):
     """
     Parses a list of packages and updates the packages database accordingly.
+    If batch_size is given, packages are added, removed and updated in
+    batches of that size, each applied with a handful of bulk statements in
+    a single transaction, instead of one transaction per package. Otherwise
+    commit_size packages are committed per transaction if given.
+    Unless use_digest is False, a forced update skips packages whose metadata
+    is unchanged since they were last imported.
+    With low_memory, the update is done by merge_update() instead.
     """
+    if low_memory:
+        return merge_update(archname, reponame, pkgs, force, repo_dir=repo_dir,
+                            batch_size=batch_size, use_digest=use_digest,
+                            commit_size=commit_size)
+
     logger.info('Updating %s (%s)', reponame, archname)
     dbpkgs = update_common(archname, reponame, pkgs, sanity_check=True)
     repository = Repo.objects.get(name__iexact=reponame)
@@ -418,105 +1127,324 @@ def db_update(archname, reponame, pkgs, force=False, repo_dir=None):
     in_sync_not_db = syncset - dbset
     logger.info("%d packages in sync not db", len(in_sync_not_db))
     # packages in syncdb and not in database (add to database)
-    for pkg in (pkg for pkg in pkgs if pkg.name in in_sync_not_db):
-        logger.info("Adding package %s", pkg.name)
-        timestamp = now()
-        dbpkg = Package(pkgname=pkg.name, arch=architecture, repo=repository,
-                        created=timestamp)
-        try:
-            with transaction.atomic():
-                populate_pkg(dbpkg, pkg, timestamp=timestamp, repo_dir=repo_dir)
-                Update.objects.log_update(None, dbpkg)
-
-                if not Package.objects.filter(
-                        pkgname=pkg.name).exclude(id=dbpkg.id).exists():
-                    if not User.objects.filter(
-                            package_relations__pkgbase=dbpkg.pkgbase,
-                            package_relations__type=PackageRelation.MAINTAINER).exists():
-                        packager = finder.find(pkg.packager)
-                        if packager:
-                            prel = PackageRelation(pkgbase=dbpkg.pkgbase,
-                                                   user=packager,
-                                                   type=PackageRelation.MAINTAINER)
-                            prel.save()
-
-        except IntegrityError:
-            if architecture.agnostic:
-                logger.warning("Could not add package %s; "
-                               "not fatal if another thread beat us to it.",
-                               pkg.name)
-            else:
-                logger.exception("Could not add package %s", pkg.name)
+    added = [pkg for pkg in pkgs if pkg.name in in_sync_not_db]
+    add_packages(architecture, repository, added, batch_size=batch_size, repo_dir=repo_dir,
+                 commit_size=commit_size)
 
     # packages in database and not in syncdb (remove from database)
-    for pkgname in (dbset - syncset):
-        logger.info("Removing package %s", pkgname)
-        dbpkg = dbdict[pkgname]
-        with transaction.atomic():
-            Update.objects.log_update(dbpkg, None)
-            # no race condition here as long as simultaneous threads both
-            # issue deletes; second delete will be a no-op
-            delete_pkg_files(dbpkg)
-
-            # Delete all matching FlagRequests when removing a package from a repo.
-            requests = FlagRequest.objects.filter(pkgbase=dbpkg.pkgbase, repo=dbpkg.repo)
-            requests.delete()
-
-            dbpkg.delete()
+    removed = [dbdict[pkgname] for pkgname in (dbset - syncset)]
+    remove_packages(removed, batch_size=batch_size, commit_size=commit_size)
 
     # packages in both database and in syncdb (update in database)
     pkg_in_both = syncset & dbset
-    for pkg in (x for x in pkgs if x.name in pkg_in_both):
-        logger.debug("Checking package %s", pkg.name)
-        dbpkg = dbdict[pkg.name]
-        timestamp = None
-        # for a force, we don't want to update the timestamp.
-        # for a non-force, we don't want to do anything at all.
-        if not force and pkg_same_version(pkg, dbpkg):
-            continue
-        elif not force:
-            timestamp = now()
+    updated = [(dbdict[pkg.name], pkg) for pkg in pkgs
+               if pkg.name in pkg_in_both and needs_update(pkg, dbdict[pkg.name], force, use_digest)]
+    update_packages(repository, updated, force=force, batch_size=batch_size, repo_dir=repo_dir,
+                    commit_size=commit_size)
+
+    logger.info('Finished updating arch: %s', archname)
 
-        # The odd select_for_update song and dance here are to ensure
-        # simultaneous updates don't happen on a package, causing
-        # files/depends/all related items to be double-imported.
-        with transaction.atomic():
-            dbpkg = Package.objects.select_for_update().get(id=dbpkg.id)
-            if not force and pkg_same_version(pkg, dbpkg):
-                logger.debug("Package %s was already updated", pkg.name)
-                continue
-            logger.info("Updating package %s", pkg.name)
-            prevpkg = copy(dbpkg)
-            populate_pkg(dbpkg, pkg, force=force, timestamp=timestamp, repo_dir=repo_dir)
-            Update.objects.log_update(prevpkg, dbpkg)
 
+# the fields of the database packages merge_update() diffs against
+MERGE_FIELDS = ('id', 'pkgname', 'pkgbase', 'epoch', 'pkgver', 'pkgrel',
+                'last_update', 'files_last_update', 'metadata_digest')
+# packages fetched and changes applied at a time in merge_update() when no
+# batch size is given
+MERGE_BATCH_SIZE = 1000
+
+
+def pkgname_order():
+    '''An expression sorting package names by code point, the way Python
+    sorts strings, whatever collation the database uses for the column.'''
+    vendor = database_vendor(Package, 'read')
+    if vendor == 'postgresql':
+        return Collate('pkgname', 'C')
+    if vendor == 'mysql':
+        return Collate('pkgname', 'utf8mb4_bin')
+    # SQLite compares strings bytewise, which for UTF-8 is code point order
+    return F('pkgname')
+
+
+def iter_sorted_packages(architecture, repository, batch_size):
+    '''Yields the packages of a repo and arch sorted by name, with only the
+    fields in MERGE_FIELDS, fetching batch_size of them per query. Every page
+    starts after the last name of the previous one, so packages added or
+    removed behind the current position are never seen twice or skipped.'''
+    packages = Package.objects.filter(arch=architecture, repo=repository).annotate(
+        sort_name=pkgname_order()).only(*MERGE_FIELDS).order_by('sort_name')
+    page = list(packages[:batch_size])
+    while page:
+        yield from page
+        if len(page) < batch_size:
+            break
+        page = list(packages.filter(sort_name__gt=page[-1].pkgname)[:batch_size])
+
+
+def merge_packages(pkgs, dbpkgs):
+    '''Joins the parsed packages and the database packages, both sorted by
+    name, yielding (pkg, dbpkg) pairs in which one side is None if the package
+    exists only on the other.'''
+    pkgs, dbpkgs = iter(pkgs), iter(dbpkgs)
+    pkg, dbpkg = next(pkgs, None), next(dbpkgs, None)
+    while pkg is not None or dbpkg is not None:
+        if dbpkg is None or (pkg is not None and pkg.name < dbpkg.pkgname):
+            yield pkg, None
+            pkg = next(pkgs, None)
+        elif pkg is None or dbpkg.pkgname < pkg.name:
+            yield None, dbpkg
+            dbpkg = next(dbpkgs, None)
+        else:
+            yield pkg, dbpkg
+            pkg, dbpkg = next(pkgs, None), next(dbpkgs, None)
+
+
+def merge_update(archname, reponame, pkgs, force=False, repo_dir=None, batch_size=None,
+                 use_digest=True, commit_size=None):
+    """
+    A variant of db_update() for huge repos that does not load every package
+    of the repo at once. The database packages are read sorted by name a
+    batch at a time, with only the fields needed to diff them, and merged with
+    the parsed packages in a single pass. Pending adds, removals and updates
+    are applied as soon as a batch of them is collected, so the number of
+    package rows in memory is bounded by the batch size instead of the size
+    of the repo. Without batch_size, MERGE_BATCH_SIZE rows are read at a time
+    and changes are applied one package at a time as in db_update().
+    """
+    logger.info('Updating %s (%s) in low memory mode', reponame, archname)
+    update_common(archname, reponame, pkgs, sanity_check=True, count_only=True)
+    repository = Repo.objects.get(name__iexact=reponame)
+    architecture = Arch.objects.get(name=archname)
+    size = batch_size or MERGE_BATCH_SIZE
+
+    def apply_removals(dbpkgs):
+        # the merge only loaded the fields needed for the diff
+        remove_packages(list(Package.objects.filter(id__in=[dbpkg.id for dbpkg in dbpkgs])),
+                        batch_size=batch_size, commit_size=commit_size)
+
+    added, removed, updated = [], [], []
+    counts = {'added': 0, 'removed': 0, 'updated': 0}
+    dbpkgs = iter_sorted_packages(architecture, repository, size)
+    for pkg, dbpkg in merge_packages(sorted(pkgs, key=attrgetter('name')), dbpkgs):
+        if dbpkg is None:
+            added.append(pkg)
+        elif pkg is None:
+            removed.append(dbpkg)
+        elif needs_update(pkg, dbpkg, force, use_digest):
+            updated.append((dbpkg, pkg))
+
+        if len(added) >= size:
+            add_packages(architecture, repository, added, batch_size=batch_size, repo_dir=repo_dir,
+                         commit_size=commit_size)
+            counts['added'] += len(added)
+            added = []
+        if len(removed) >= size:
+            apply_removals(removed)
+            counts['removed'] += len(removed)
+            removed = []
+        if len(updated) >= size:
+            update_packages(repository, updated, force=force, batch_size=batch_size,
+                            repo_dir=repo_dir, commit_size=commit_size)
+            counts['updated'] += len(updated)
+            updated = []
+
+    add_packages(architecture, repository, added, batch_size=batch_size, repo_dir=repo_dir,
+                 commit_size=commit_size)
+    if removed:
+        apply_removals(removed)
+    update_packages(repository, updated, force=force, batch_size=batch_size,
+                    repo_dir=repo_dir, commit_size=commit_size)
+    counts['added'] += len(added)
+    counts['removed'] += len(removed)
+    counts['updated'] += len(updated)
+
+    logger.info("%(added)d packages added, %(removed)d removed, %(updated)d updated", counts)
     logger.info('Finished updating arch: %s', archname)
 
 
-def filesonly_update(archname, reponame, pkgs, force=False):
+def agnostic_digest(pkgs):
+    """
+    Returns a digest of the metadata of a list of packages that does not
+    depend on the database or the order they were read in.
+    """
+    hasher = hashlib.sha256()
+    for pkg in sorted(pkgs, key=lambda pkg: pkg.name):
+        hasher.update(f'{pkg.name} {pkg.digest}\n'.encode())
+    return hasher.hexdigest()
+
+
+def agnostic_update(archname, reponame, pkgs, force=False, repo_dir=None, batch_size=None,
+                    use_digest=True, low_memory=False, commit_size=None, kind=RepoDatabase.PACKAGES):
+    """
+    Updates the packages of an agnostic architecture, which are listed in the
+    database of every architecture of a repo. Unless forced, nothing is done
+    if the same packages were already imported from another database of the
+    same kind; only a files database also carries their file lists. The
+    caller holds import_lock() for the agnostic architecture, so concurrent
+    imports of the repo process these packages once.
+    """
+    digest = agnostic_digest(pkgs)
+    repository = Repo.objects.get(name__iexact=reponame)
+    architecture = Arch.objects.get(name=archname)
+
+    if use_digest and not force and RepoDatabase.objects.filter(
+            repo=repository, arch=architecture, kind=kind, digest=digest).exists():
+        logger.info('Packages for %s (%s) were already imported, skipping.', reponame, archname)
+        return
+    db_update(archname, reponame, pkgs, force, repo_dir=repo_dir,
+              batch_size=batch_size, use_digest=use_digest, low_memory=low_memory,
+              commit_size=commit_size)
+    RepoDatabase.objects.update_or_create(
+        repo=repository, arch=architecture, kind=kind,
+        defaults={'digest': digest, 'last_import': now()})
+
+
+def load_package_files(dbpkg_id, pkg, force=False):
+    """Loads the file list of a package, returning the number of file rows
+    inserted."""
+    # The odd select_for_update song and dance here are to ensure
+    # simultaneous updates don't happen on a package, causing
+    # files to be double-imported.
+    with transaction.atomic():
+        dbpkg = Package.objects.select_for_update().filter(id=dbpkg_id).first()
+        if dbpkg is None:
+            logger.debug("Package %s was removed in the meantime", pkg.name)
+            return 0
+        logger.debug("Checking files for package %s", pkg.name)
+        inserted = populate_files(dbpkg, pkg, force=force)
+        if inserted:
+            import_changes('files', [dbpkg])
+        return inserted
+
+
+def partition_packages(pkgs, count):
+    """
+    Splits a list of (dbpkg_id, pkg) tuples into at most count lists with
+    file lists of about the same total size. Each list is in archive order,
+    as seeking backwards in a compressed archive decompresses it again from
+    the start.
+    """
+    shards = [(0, i, []) for i in range(min(count, len(pkgs)))]
+    for item in sorted(pkgs, key=lambda item: item[1].files_member[1], reverse=True):
+        size, i, shard = heapq.heappop(shards)
+        shard.append(item)
+        heapq.heappush(shards, (size + item[1].files_member[1], i, shard))
+    return [sorted(shard, key=lambda item: item[1].files_member[0])
+            for _, _, shard in sorted(shards, key=itemgetter(1))]
+
+
+def load_files_shard(archive, reponame, shard, force=False):
+    """
+    Loads the file lists of a shard of (dbpkg_id, files_member, record)
+    packages from the RepoArchive archive, returning the number of packages
+    and of file rows loaded.
+    """
+    packages = rows = 0
+    try:
+        for dbpkg_id, files_member, record in shard:
+            pkg = RepoPackage(reponame, archive)
+            pkg.load_record(record)
+            pkg.files_member = files_member
+            inserted = load_package_files(dbpkg_id, pkg, force=force)
+            packages += inserted > 0
+            rows += inserted
+    finally:
+        archive.close()
+    return packages, rows
+
+
+def files_worker(archive, reponame, shard, force=False):
+    """Runs load_files_shard() in a forked worker, which reports its queries,
+    rows and changes back to the importing process."""
+    report = ImportReport()
+    connection = connections[router.db_for_write(Package)]
+    # the wrappers of the importing process were inherited by the fork
+    connection.execute_wrappers[:] = [report.execute_wrapper]
+    current_report.set(report)
+    try:
+        packages, rows = load_files_shard(archive, reponame, shard, force=force)
+    finally:
+        connection.close()
+    return packages, rows, report.as_dict(), report.changes.as_dict()
+
+
+def parallel_load_files(pkgs, workers, force=False):
+    """
+    Loads the file lists of the given (dbpkg_id, pkg) tuples in workers forked
+    processes, each with its own database connection, returning the number of
+    packages and of file rows loaded.
+    """
+    # every worker gets a copy of the archive, which opens the file again
+    archive, reponame = pkgs[0][1].archive, pkgs[0][1].repo
+    shards = [[(dbpkg_id, pkg.files_member, pkg.record()) for dbpkg_id, pkg in shard]
+              for shard in partition_packages(pkgs, workers)]
+    # forked processes must not share the connection of this one
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    packages = rows = 0
+    report = current_report.get()
+    with ProcessPoolExecutor(max_workers=len(shards), mp_context=context) as executor:
+        for shard_packages, shard_rows, data, changes in executor.map(
+                files_worker, repeat(archive), repeat(reponame), shards, repeat(force)):
+            packages += shard_packages
+            rows += shard_rows
+            if report is not None:
+                report.merge(data)
+                report.changes.merge(changes)
+    return packages, rows
+
+
+def filesonly_update(archname, reponame, pkgs, force=False, use_digest=True, workers=None,
+                     commit_size=None):
     """
     Parses a list of packages and updates the packages database accordingly.
+    If workers is more than one, the file lists are loaded by that many
+    processes in parallel; packages are still locked one at a time, so a
+    concurrent regular import of the repo is safe. Otherwise commit_size
+    packages are committed per transaction if given.
     """
     logger.info('Updating files for %s (%s)', reponame, archname)
     dbpkgs = update_common(archname, reponame, pkgs, sanity_check=False)
     dbdict = {dbpkg.pkgname: dbpkg for dbpkg in dbpkgs}
     dbset = set(dbdict.keys())
 
+    outdated = []
     for pkg in (pkg for pkg in pkgs if pkg.name in dbset):
         dbpkg = dbdict[pkg.name]
-
-        # The odd select_for_update song and dance here are to ensure
-        # simultaneous updates don't happen on a package, causing
-        # files to be double-imported.
-        with transaction.atomic():
-            if not dbpkg.files_last_update or not dbpkg.last_update:
-                pass
-            elif not force and dbpkg.files_last_update >= dbpkg.last_update:
-                logger.debug("Files for %s are up to date", pkg.name)
-                continue
-            dbpkg = Package.objects.select_for_update().get(id=dbpkg.id)
-            logger.debug("Checking files for package %s", pkg.name)
-            populate_files(dbpkg, pkg, force=force)
+        if not dbpkg.files_last_update or not dbpkg.last_update:
+            pass
+        elif not force and dbpkg.files_last_update >= dbpkg.last_update:
+            logger.debug("Files for %s are up to date", pkg.name)
+            continue
+        if use_digest and pkg_unchanged(pkg, dbpkg):
+            logger.debug("Package %s is unchanged", pkg.name)
+            continue
+        outdated.append((dbpkg.id, pkg))
+    del dbpkgs, dbdict
+
+    parallel = workers is not None and workers > 1
+    if parallel and database_vendor(Package, 'write') == 'sqlite':
+        logger.warning('SQLite allows a single writer, loading files serially')
+        parallel = False
+    elif parallel and transaction.get_connection(router.db_for_write(Package)).in_atomic_block:
+        logger.warning('Workers cannot take part in the current transaction, loading files serially')
+        parallel = False
+
+    start = time.perf_counter()
+    outdated_files = [(dbpkg_id, pkg) for dbpkg_id, pkg in outdated if pkg.has_files]
+    if parallel and outdated_files:
+        packages, rows = parallel_load_files(outdated_files, workers, force=force)
+    else:
+        packages = rows = 0
+        for group in batches(outdated, commit_size or 1):
+            with commit_group(commit_size):
+                for dbpkg_id, pkg in group:
+                    inserted = load_package_files(dbpkg_id, pkg, force=force)
+                    packages += inserted > 0
+                    rows += inserted
+    elapsed = time.perf_counter() - start
+    if packages:
+        logger.info('Loaded %d file rows for %d packages in %.1fs (%.0f packages/s, %.0f rows/s)',
+                    rows, packages, elapsed, packages / elapsed, rows / elapsed)
 
     logger.info('Finished updating arch: %s', archname)
 
@@ -542,12 +1470,127 @@ def parse_info(pkgname, filename, iofile):
     return store
 
 
-def parse_repo(repopath):
+class RepoArchive:
+    """
+    A handle on a repo db file, used to read the contents of single tar
+    members by their data offset. parse_repo() reads the database through
+    open() and only records where each package's 'files' member lives; the
+    (potentially huge) file lists are read through the same open file once a
+    package is known to need them, so a database replaced in the meantime is
+    never mixed in. A copy handed to another process has to open the file by
+    path again, and refuses to read from it if it was replaced since.
+    """
+
+    def __init__(self, repopath):
+        self.repopath = repopath
+        # SHA-256 of the raw file and its (device, inode, size, mtime), both
+        # taken when it is first opened
+        self.digest = None
+        self.identity = None
+        self._file = None
+        self._tarfile = None
+
+    def __getstate__(self):
+        # open files are not handed to other processes
+        return {**self.__dict__, '_file': None, '_tarfile': None}
+
+    def open(self):
+        """Returns the TarFile of the database, opening it if needed."""
+        if self._tarfile is not None:
+            return self._tarfile
+        fp = open(self.repopath, 'rb')
+        try:
+            stat = os.fstat(fp.fileno())
+            identity = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            if self.identity is None:
+                self.identity = identity
+                self.digest = hashlib.file_digest(fp, 'sha256').hexdigest()
+                fp.seek(0)
+            elif identity != self.identity:
+                raise Exception(f"Database {self.repopath} was replaced since it was parsed")
+            self._tarfile = tarfile.open(fileobj=fp, mode='r')
+        except BaseException:
+            fp.close()
+            raise
+        self._file = fp
+        return self._tarfile
+
+    def read_member(self, offset, size):
+        fileobj = self.open().fileobj
+        # seeking forward in the decompressed stream is cheap, but seeking
+        # backwards decompresses it again from the start, so callers read
+        # members in archive order where they can
+        fileobj.seek(offset)
+        return fileobj.read(size)
+
+    def close(self):
+        if self._tarfile is not None:
+            self._tarfile.close()
+            self._file.close()
+            self._tarfile = self._file = None
+
+
+def match_repo_file(repopath):
+    filename = os.path.split(repopath)[1]
+    m = re.match(r"^(.*)\.(db|files)\.tar(\..*)?$", filename)
+    if not m:
+        logger.error("File does not have the proper extension")
+        raise Exception("File does not have the proper extension")
+    return m
+
+
+def parse_repo_name(repopath):
+    return match_repo_file(repopath).group(1)
+
+
+def parse_repo_kind(repopath):
+    """The RepoDatabase kind of a repo database file, package or files."""
+    return match_repo_file(repopath).group(2)
+
+
+def parse_members(pkg, pkgid, members):
+    """Populates a RepoPackage from the (name, data) desc and depends members
+    of its package."""
+    for fname, data in members:
+        data_file = io.TextIOWrapper(io.BytesIO(data), encoding='UTF-8')
+        try:
+            pkg.populate(parse_info(pkgid, fname, data_file))
+        except UnicodeDecodeError:
+            logger.warning("Could not correctly decode %s/%s, skipping file", pkgid, fname)
+        data_file.close()
+        logger.debug("Done parsing file %s/%s", pkgid, fname)
+
+
+def parse_chunk(reponame, chunk):
+    """
+    Parses a chunk of [(pkgid, members)] in a worker process, returning a list
+    of (pkgid, record) tuples of the populated RepoPackage objects.
+    """
+    records = []
+    for pkgid, members in chunk:
+        pkg = RepoPackage(reponame)
+        parse_members(pkg, pkgid, members)
+        records.append((pkgid, pkg.record()))
+    return records
+
+
+# packages handed to a parse_repo() worker at a time
+PARSE_CHUNK_SIZE = 500
+
+
+def parse_repo(repopath, archive=None, workers=None):
     """
     Parses an Arch repo db file, and returns a list of RepoPackage objects.
+    File lists are not read here; each package only keeps the offset of its
+    'files' member, see RepoArchive.
 
     Arguments:
      repopath -- The path of a repository db file.
+     archive -- The RepoArchive later used to read file lists; if not given,
+                one is created for repopath.
+     workers -- If more than one, the database is still decompressed once
+                here, but the desc and depends members are parsed by a pool
+                of this many processes. The result is the same either way.
 
     """
     logger.info("Starting repo parsing")
@@ -555,37 +1598,46 @@ def parse_repo(repopath):
         logger.error("Could not read file %s", repopath)
 
     logger.info("Reading repo tarfile %s", repopath)
-    filename = os.path.split(repopath)[1]
-    m = re.match(r"^(.*)\.(db|files)\.tar(\..*)?$", filename)
-    if m:
-        reponame = m.group(1)
-    else:
-        logger.error("File does not have the proper extension")
-        raise Exception("File does not have the proper extension")
-
-    with tarfile.open(repopath, 'r') as repodb:
-        logger.debug("Starting package parsing")
-        newpkg = lambda: RepoPackage(reponame)
-        pkgs = defaultdict(newpkg)
-        for tarinfo in repodb.getmembers():
-            if tarinfo.isreg():
-                pkgid, fname = os.path.split(tarinfo.name)
-                if fname == 'files':
-                    # don't parse yet for speed and memory consumption reasons
-                    files_data = repodb.extractfile(tarinfo)
-                    pkgs[pkgid].files = files_data.read()
-                    del files_data
-                elif fname in ('desc', 'depends'):
-                    data_file = repodb.extractfile(tarinfo)
-                    data_file = io.TextIOWrapper(io.BytesIO(data_file.read()), encoding='UTF-8')
-                    try:
-                        pkgs[pkgid].populate(parse_info(pkgid, fname, data_file))
-                    except UnicodeDecodeError:
-                        logger.warning("Could not correctly decode %s, skipping file", tarinfo.name)
-                    data_file.close()
-                    del data_file
-
-                logger.debug("Done parsing file %s/%s", pkgid, fname)
+    reponame = parse_repo_name(repopath)
+
+    if archive is None:
+        archive = RepoArchive(repopath)
+    newpkg = lambda: RepoPackage(reponame, archive)
+    pkgs = defaultdict(newpkg)
+    digests = defaultdict(hashlib.sha256)
+    parallel = workers is not None and workers > 1
+    members = defaultdict(list)
+    # the archive stays open, file lists are read from the same file later
+    repodb = archive.open()
+    logger.debug("Starting package parsing")
+    for tarinfo in repodb:
+        if tarinfo.isreg():
+            pkgid, fname = os.path.split(tarinfo.name)
+            if fname == 'files':
+                # don't read yet for speed and memory consumption reasons
+                pkgs[pkgid].files_member = (tarinfo.offset_data, tarinfo.size)
+            elif fname in ('desc', 'depends'):
+                pkg = pkgs[pkgid]
+                data = repodb.extractfile(tarinfo).read()
+                digests[pkgid].update(data)
+                if parallel:
+                    members[pkgid].append((fname, data))
+                else:
+                    parse_members(pkg, pkgid, [(fname, data)])
+
+    if members:
+        chunks = batches(list(members.items()), PARSE_CHUNK_SIZE)
+        del members
+        # forked workers inherit the loaded Django setup, which spawned or
+        # forkserver ones would have to set up again just to import this module
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            for records in executor.map(parse_chunk, repeat(reponame), chunks):
+                for pkgid, record in records:
+                    pkgs[pkgid].load_record(record)
+
+    for pkgid, digest in digests.items():
+        pkgs[pkgid].digest = digest.hexdigest()
 
     logger.info("Finished repo parsing, %d total packages", len(pkgs))
     return (reponame, pkgs.values())
@@ -601,47 +1653,176 @@ def locate_arch(arch):
         raise CommandError("Specified architecture %s is not currently known." % arch) from None
 
 
-def read_repo(primary_arch, repo_file, options):
+def import_repo(primary_arch, repo_file, options, report):
     """
-    Parses repo.db.tar.gz file and returns exit status.
+    Parses repo.db.tar.gz file and updates the database from it.
     """
-    # always returns an Arch object, regardless of what is passed in
-    primary_arch = locate_arch(primary_arch)
     force = options.get('force', False)
     filesonly = options.get('filesonly', False)
+    batch_size = options.get('batch_size')
+    use_digest = options.get('digest', True)
+    low_memory = options.get('low_memory', False)
+    commit_size = options.get('commit_size')
+
+    # skip the whole run if we already imported this exact file; a forced or
+    # files-only run is always done, but may still skip unchanged packages.
+    # The file is opened once, so the digest and all data read belong to the
+    # same file even if it is replaced during the import.
+    kind = parse_repo_kind(repo_file)
+    archive = RepoArchive(repo_file)
+    try:
+        archive.open()
+        if use_digest and not force and not filesonly:
+            if RepoDatabase.objects.filter(repo__name__iexact=parse_repo_name(repo_file),
+                                           arch=primary_arch, kind=kind,
+                                           digest=archive.digest).exists():
+                logger.info('Database %s is unchanged since the last import, skipping.', repo_file)
+                report.status = ImportRun.SKIPPED
+                return
+
+        with import_phase('parse'):
+            repo, packages = parse_repo(repo_file, archive, workers=options.get('parse_workers'))
+        repo_dir = os.path.dirname(repo_file)
+
+        # group packages by arch -- to handle noarch stuff
+        packages_arches = {}
+        agnostic_arches = set(Arch.objects.filter(agnostic=True).values_list('name', flat=True))
+        for arch in agnostic_arches:
+            packages_arches[arch] = []
+        packages_arches[primary_arch.name] = []
+
+        for package in packages:
+            if package.arch in packages_arches:
+                packages_arches[package.arch].append(package)
+            else:
+                raise Exception(
+                    f"Package {package.name} in database {repo_file} had wrong architecture {package.arch}")
+        del packages
+
+        database = router.db_for_write(Package)
+        connection = connections[database]
+        if connection.vendor == 'sqlite':
+            cursor = connection.cursor()
+            cursor.execute('PRAGMA synchronous = NORMAL')
+
+        # users may have changed since the last import in this process; matched
+        # packager strings are reloaded from the database in a single query
+        finder.refresh()
+
+        logger.info('Starting database updates for %s.', repo_file)
+        for arch in sorted(packages_arches.keys()):
+            with import_lock(repo, arch):
+                if filesonly:
+                    filesonly_update(arch, repo, packages_arches[arch], force,
+                                     use_digest=use_digest, workers=options.get('files_workers'),
+                                     commit_size=commit_size)
+                elif arch in agnostic_arches:
+                    agnostic_update(arch, repo, packages_arches[arch], force, repo_dir=repo_dir,
+                                    batch_size=batch_size, use_digest=use_digest,
+                                    low_memory=low_memory, commit_size=commit_size, kind=kind)
+                else:
+                    db_update(arch, repo, packages_arches[arch], force, repo_dir=repo_dir,
+                              batch_size=batch_size, use_digest=use_digest, low_memory=low_memory,
+                              commit_size=commit_size)
+    finally:
+        archive.close()
+    failed_adds = report.events.get('failed_adds')
+    if failed_adds:
+        # the next run must not skip this file, or the packages stay missing
+        logger.warning('Could not add %d packages, not recording the digest of %s.',
+                       failed_adds, repo_file)
+    elif not filesonly:
+        RepoDatabase.objects.update_or_create(
+            repo=Repo.objects.get(name__iexact=repo), arch=primary_arch, kind=kind,
+            defaults={'digest': archive.digest, 'last_import': now()})
+    logger.info('Finished database updates for %s.', repo_file)
 
-    repo, packages = parse_repo(repo_file)
-    repo_dir = os.path.dirname(repo_file)
 
-    # group packages by arch -- to handle noarch stuff
-    packages_arches = {}
-    for arch in Arch.objects.filter(agnostic=True):
-        packages_arches[arch.name] = []
-    packages_arches[primary_arch.name] = []
+def read_repo(primary_arch, repo_file, options, stdout=None):
+    """
+    Parses repo.db.tar.gz file and returns exit status. Every run is recorded
+    as an ImportRun with a report of where its time went, which is also
+    written as JSON to options['report'] if given ('-' for stdout, or the
+    given stream). If any
+    packages changed, devel.signals.packages_changed is sent with them.
+    The database connection is closed afterwards, unless keep_connection is
+    set for the next run in this process and this one did not fail.
+    """
+    # always returns an Arch object, regardless of what is passed in
+    primary_arch = locate_arch(primary_arch)
+    report = ImportReport(trace_memory=options.get('trace_memory', False))
+    report.status = ImportRun.IMPORTED
+    if options.get('queue_wait') is not None:
+        # seconds archweb_inotify held this import back for a free slot
+        report.add_event('queue_wait_seconds', options['queue_wait'])
+
+    connection = connections[router.db_for_write(Package)]
+    started = now()
+    start = time.perf_counter()
+    token = current_report.set(report)
+    if report.trace_memory:
+        tracemalloc.start()
+    try:
+        with connection.execute_wrapper(report.execute_wrapper):
+            import_repo(primary_arch, repo_file, options, report)
+    except Exception:
+        report.status = ImportRun.FAILED
+        raise
+    finally:
+        if report.trace_memory:
+            report._update_peak()
+            tracemalloc.stop()
+        current_report.reset(token)
+        duration = time.perf_counter() - start
+        keep_connection = options.get('keep_connection') and report.status != ImportRun.FAILED
+        try:
+            record_import_run(primary_arch, repo_file, options, report, started, duration,
+                              stdout=stdout)
+            connection.commit()
+        except Exception:
+            # a broken connection fails here again, don't bury the error of
+            # the import itself
+            logger.exception('Unable to record the import of %s', repo_file)
+            keep_connection = False
+        if report.changes:
+            send_changes(primary_arch, repo_file, report.changes)
+        if not keep_connection:
+            connection.close()
+    return 0
 
-    for package in packages:
-        if package.arch in packages_arches:
-            packages_arches[package.arch].append(package)
-        else:
-            raise Exception(
-                f"Package {package.name} in database {repo_file} had wrong architecture {package.arch}")
-    del packages
 
-    database = router.db_for_write(Package)
-    connection = connections[database]
-    if connection.vendor == 'sqlite':
-        cursor = connection.cursor()
-        cursor.execute('PRAGMA synchronous = NORMAL')
-
-    logger.info('Starting database updates for %s.', repo_file)
-    for arch in sorted(packages_arches.keys()):
-        if filesonly:
-            filesonly_update(arch, repo, packages_arches[arch], force)
+def send_changes(arch, repo_file, changes):
+    logger.info('Sending %r of %s', changes, repo_file)
+    responses = packages_changed.send_robust(sender=Package, arch=arch, repo_file=repo_file,
+                                             changes=changes)
+    for receiver, response in responses:
+        if isinstance(response, Exception):
+            logger.error('Handler %r of the package changes failed', receiver, exc_info=response)
+
+
+def record_import_run(arch, repo_file, options, report, started, duration, stdout=None):
+    data = report.as_dict()
+    data['status'] = dict(ImportRun.STATUS_CHOICES)[report.status].lower()
+    data['seconds'] = duration
+    output = options.get('report')
+    if output:
+        report_data = {'repo': parse_repo_name(repo_file), 'arch': arch.name,
+                       'filename': repo_file, 'started': started.isoformat(), **data}
+        if output == '-':
+            (stdout or sys.stdout).write(json.dumps(report_data, indent=2) + '\n')
         else:
-            db_update(arch, repo, packages_arches[arch], force, repo_dir=repo_dir)
-    logger.info('Finished database updates for %s.', repo_file)
-    connection.commit()
-    connection.close()
-    return 0
+            with open(output, 'w') as fp:
+                json.dump(report_data, fp, indent=2)
+
+    repository = Repo.objects.filter(name__iexact=parse_repo_name(repo_file)).first()
+    if repository is None:
+        return
+    ImportRun.objects.create(
+        repo=repository, arch=arch, filename=os.path.basename(repo_file)[:255],
+        started=started, duration=duration, status=report.status,
+        files_only=options.get('filesonly', False), forced=options.get('force', False),
+        queries=report.queries, peak_memory=report.peak_memory, report=data)
+    cutoff = now() - timedelta(days=settings.IMPORT_HISTORY_RETENTION_PERIOD)
+    ImportRun.objects.filter(started__lt=cutoff).delete()
 
 # vim: set ts=4 sw=4 et:
@@ -4,13 +4,27 @@
 Watches repo.files.tar.gz files for updates and parses them after a short delay
 in order to catch all updates in a single bulk update.
 
-Usage: ./manage.py reporead_inotify [path_template]
+Usage: ./manage.py reporead_inotify [--max-imports N] [--leader]
+                                    [--workers N [--max-jobs N] [--max-rss MiB]]
+                                    [path_template]
 
 Where 'path_template' is an optional path_template for finding the
 repo.files.tar.gz files. The form is '/srv/ftp/%(repo)s/os/%(arch)s/', which is
 also the default template if none is specified. While 'repo' is not required to
 be present in the path_template, note that 'arch' is so reporead can function
 correctly.
+
+At most --max-imports updates (2 by default) run at the same time; updates of
+stable repos are started before those of testing and then staging repos.
+
+By default every update is parsed in a newly forked process. With --workers,
+updates are handed to that many long-lived worker processes instead, which
+keep their caches warm between updates and are replaced after --max-jobs
+updates or once they use more than --max-rss MiB of memory.
+
+With --leader, several nodes can watch the same repos for one database: only
+the node holding a PostgreSQL advisory lock handles updates, the others stand
+by and take over once it goes away.
 """
 
 import logging
@@ -22,7 +36,14 @@
 
 from main.models import Arch, Repo
 
-from .archweb_inotify import EventHandler
+from .archweb_inotify import (
+    EventHandler,
+    add_import_arguments,
+    create_pool,
+    create_scheduler,
+    elect_leader,
+    repo_priority,
+)
 from .reporead import read_repo
 
 logger = logging.getLogger("command")
@@ -33,6 +54,9 @@ class Command(BaseCommand):
     help = "Watch database files and run an update when necessary."
     args = "[path_template]"
 
+    def add_arguments(self, parser):
+        add_import_arguments(parser)
+
     def handle(self, path_template=None, **options):
         v = int(options.get('verbosity', 0))
         if v == 0:
@@ -46,7 +70,10 @@ def handle(self, path_template=None, **options):
             path_template = '/srv/ftp/%(repo)s/os/%(arch)s/'
         self.path_template = path_template
 
-        notifier = self.setup_notifier()
+        leader = elect_leader('reporead_inotify', options)
+        pool = create_pool(read_repo, options)
+        scheduler = create_scheduler(options)
+        notifier = self.setup_notifier(pool, scheduler)
         # this thread is done using the database; all future access is done in
         # the spawned read_repo() processes, so close the otherwise completely
         # idle connection.
@@ -59,9 +86,15 @@ def handle(self, path_template=None, **options):
         for thread in threading.enumerate():
             if hasattr(thread, 'cancel'):
                 thread.cancel()
+        if pool is not None:
+            pool.close()
+        if leader is not None:
+            leader.release()
+            if leader.lost:
+                raise CommandError('Lost the leader lock, exiting')
 
     @transaction.atomic
-    def setup_notifier(self):
+    def setup_notifier(self, pool=None, scheduler=None):
         '''Set up and configure the inotify machinery and logic.
         This takes the provided or default path_template and builds a list of
         directories we need to watch for database updates. It then validates
@@ -101,7 +134,9 @@ def setup_notifier(self):
         for name in all_paths:
             manager.add_watch(name, mask)
 
-        handler = EventHandler(arch_paths=arch_path_map, filename_suffix='.files.tar.gz', callback_func=read_repo)
+        handler = EventHandler(arch_paths=arch_path_map, filename_suffix='.files.tar.gz', callback_func=read_repo,
+                               pool=pool, scheduler=scheduler,
+                               repo_priorities={repo.name.lower(): repo_priority(repo) for repo in repos})
         return pyinotify.Notifier(manager, handler)
 
 
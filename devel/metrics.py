@@ -0,0 +1,71 @@
+from django.db.models import OuterRef, Subquery
+from prometheus_client.core import GaugeMetricFamily
+
+from main.models import ImportRun
+from main.utils import database_vendor
+
+
+def latest_runs():
+    '''The latest ImportRun of every repo, arch and import kind.'''
+    runs = ImportRun.objects.select_related('repo', 'arch')
+    if database_vendor(ImportRun) == 'postgresql':
+        # ordering by repo and arch would follow their default ordering
+        return runs.order_by('repo_id', 'arch_id', 'files_only', '-started', '-id').distinct(
+            'repo_id', 'arch_id', 'files_only')
+    latest = ImportRun.objects.filter(
+        repo=OuterRef('repo'), arch=OuterRef('arch'), files_only=OuterRef('files_only')).order_by(
+        '-started', '-id').values('id')[:1]
+    return runs.filter(id=Subquery(latest))
+
+
+class ImportRunCollector:
+    '''Exposes the latest reporead run of every repo, arch and import kind
+    (package or files database) from the import history.'''
+
+    def collect(self):
+        labels = ['repo', 'arch', 'files_only']
+        timestamp = GaugeMetricFamily(
+            'archweb_reporead_last_run_timestamp_seconds',
+            'Start time of the last reporead run', labels=labels)
+        duration = GaugeMetricFamily(
+            'archweb_reporead_last_run_duration_seconds',
+            'Wall time of the last reporead run', labels=labels)
+        status = GaugeMetricFamily(
+            'archweb_reporead_last_run_status',
+            'Status of the last reporead run (0 imported, 1 skipped, 2 failed)', labels=labels)
+        queries = GaugeMetricFamily(
+            'archweb_reporead_last_run_queries',
+            'Queries issued by the last reporead run', labels=labels)
+        phase_seconds = GaugeMetricFamily(
+            'archweb_reporead_last_run_phase_seconds',
+            'Time spent in each phase of the last reporead run', labels=[*labels, 'phase'])
+        phase_queries = GaugeMetricFamily(
+            'archweb_reporead_last_run_phase_queries',
+            'Queries issued in each phase of the last reporead run', labels=[*labels, 'phase'])
+        events = GaugeMetricFamily(
+            'archweb_reporead_last_run_events',
+            'Events like queue and lock waits, conflicting writes or failed package adds '
+            'in the last reporead run',
+            labels=[*labels, 'event'])
+        rows = GaugeMetricFamily(
+            'archweb_reporead_last_run_rows',
+            'Rows touched per table by the last reporead run', labels=[*labels, 'table', 'action'])
+
+        for run in latest_runs():
+            values = [run.repo.name.lower(), run.arch.name, str(run.files_only).lower()]
+            timestamp.add_metric(values, run.started.timestamp())
+            duration.add_metric(values, run.duration)
+            status.add_metric(values, run.status)
+            queries.add_metric(values, run.queries)
+            for name, phase in run.report.get('phases', {}).items():
+                phase_seconds.add_metric([*values, name], phase['seconds'])
+                phase_queries.add_metric([*values, name], phase['queries'])
+            for name, value in run.report.get('events', {}).items():
+                events.add_metric([*values, name], value)
+            for table, actions in run.report.get('rows', {}).items():
+                for action, count in actions.items():
+                    rows.add_metric([*values, table, action], count)
+
+        return [timestamp, duration, status, queries, phase_seconds, phase_queries, events, rows]
+
+# vim: set ts=4 sw=4 et:
@@ -1,13 +1,14 @@
+import re
 import zoneinfo
 
 from django.contrib.auth.models import Group, User
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.urls import reverse
 from django_countries.fields import CountryField
 
-from main.utils import make_choice, set_created_field
+from main.utils import bump_generations, make_choice, set_created_field
 from planet.models import Feed
 
 from .fields import PGPKeyField
@@ -149,6 +150,60 @@ def __str__(self):
         return f'{self.signer} → {self.signee}'
 
 
+def split_packager(userstring):
+    '''Splits a packager string like 'A. U. Thor <author@example.com>' into
+    its name and email, either of which may be None.'''
+    matches = re.match(r'^([^<]+)? ?<([^>]*)>?', userstring)
+    if not matches:
+        return userstring.strip(), None
+    return matches.group(1), matches.group(2)
+
+
+def packager_name_tokens(name):
+    '''The lowercased parts of a packager name that have to appear in the
+    names of a user, leaving out quoted ones like nicknames.'''
+    return [token.lower() for token in name.split() if not re.match(r'^[\'"].*[\'"]$', token)]
+
+
+class PackagerIdentityManager(models.Manager):
+    def forget(self, user_id, changes):
+        '''Deletes the identities matched to a user and those UserFinder could
+        match differently now that some of its FINDER_FIELDS changed, given as
+        {field: value} dicts of their values before and after. Packager
+        strings are looked for by the emails, username and name parts in
+        them, which leaves out names abbreviated beyond any part.'''
+        query = models.Q(user_id=user_id)
+        for values in changes:
+            for field, value in values.items():
+                if not value:
+                    continue
+                if field in ('email', 'public_email'):
+                    query |= models.Q(packager__contains=f'<{value}>')
+                elif field == 'username':
+                    query |= models.Q(packager__contains=f'<{value}@')
+                elif field in ('first_name', 'last_name'):
+                    for token in packager_name_tokens(value):
+                        query |= models.Q(packager__icontains=token)
+        self.filter(query).delete()
+
+
+class PackagerIdentity(models.Model):
+    '''The user a packager string such as 'A. U. Thor <author@example.com>'
+    was matched to by UserFinder, kept so later imports don't have to match
+    it again. Strings which matched no user are kept with a null user.'''
+    packager = models.CharField(max_length=255, unique=True)
+    user = models.ForeignKey(User, related_name='packager_identities', null=True,
+                             on_delete=models.CASCADE)
+
+    objects = PackagerIdentityManager()
+
+    class Meta:
+        verbose_name_plural = 'packager identities'
+
+    def __str__(self):
+        return self.packager
+
+
 def create_feed_model(sender, **kwargs):
     allowed_groups = ['Developers', 'Package Maintainers', 'Support Staff']
 
@@ -214,8 +269,60 @@ def delete_user_model(sender, **kwargs):
     Feed.objects.filter(website_rss=userprofile.website_rss).delete()
 
 
+# the fields UserFinder indexes users by; all but the PGP key are matched
+# against packager strings
+FINDER_FIELDS = {
+    User: ('username', 'email', 'first_name', 'last_name'),
+    UserProfile: ('public_email', 'pgp_key'),
+}
+
+
+def finder_user_id(sender, instance):
+    return instance.pk if sender is User else instance.user_id
+
+
+def store_finder_values(sender, instance, **kwargs):
+    '''Keeps the FINDER_FIELDS of a user or profile as stored before it is
+    saved, for forget_packager_identities() to tell what changed.'''
+    update_fields = kwargs.get('update_fields')
+    instance._stored_finder_values = None
+    if instance.pk is None or (update_fields and not update_fields & set(FINDER_FIELDS[sender])):
+        return
+    instance._stored_finder_values = sender.objects.filter(pk=instance.pk).values(
+        *FINDER_FIELDS[sender]).first()
+
+
+def forget_packager_identities(sender, instance, **kwargs):
+    '''A change to a user's names or emails can change which user the
+    packager strings naming them match, so forget those matching the user
+    before or after the change. Nothing is done if none of the FINDER_FIELDS
+    changed.'''
+    update_fields = kwargs.get('update_fields')
+    if update_fields and not update_fields & set(FINDER_FIELDS[sender]):
+        return
+    values = {field: getattr(instance, field) for field in FINDER_FIELDS[sender]}
+    if kwargs.get('signal') is post_delete:
+        changes = [values]
+    else:
+        stored = getattr(instance, '_stored_finder_values', None) or {}
+        changed = [field for field in values if stored.get(field) != values[field]]
+        if not changed:
+            return
+        changes = [{field: stored.get(field) for field in changed},
+                   {field: values[field] for field in changed}]
+    PackagerIdentity.objects.forget(finder_user_id(sender, instance), changes)
+    # importers keeping their user index around reload it
+    bump_generations('users')
+
+
 pre_save.connect(create_feed_model, sender=UserProfile, dispatch_uid="devel.models")
 
+for sender in (User, UserProfile):
+    pre_save.connect(store_finder_values, sender=sender,
+                     dispatch_uid='devel.models.packager_identities')
+    post_save.connect(forget_packager_identities, sender=sender, dispatch_uid='devel.models')
+    post_delete.connect(forget_packager_identities, sender=sender, dispatch_uid='devel.models')
+
 post_save.connect(delete_user_model, sender=User, dispatch_uid='main.models')
 
 # vim: set ts=4 sw=4 et:
@@ -0,0 +1,57 @@
+from django.dispatch import Signal
+
+# Sent by reporead once at the end of every run that changed any packages,
+# with sender=Package, the imported arch and file and the ChangeSet of the run
+# as changes. A failed run sends the changes it made before failing, some of
+# which may have been rolled back. Receivers run in the importing process
+# after its changes were committed; errors are logged but do not fail the
+# import.
+packages_changed = Signal()
+
+
+class ChangeSet:
+    """
+    The packages changed by a reporead run: the ids of those added, updated,
+    removed and of those which only had their file lists reloaded, and the
+    pkgbases, repo ids and arch ids all of them belong to.
+    """
+    ACTIONS = ('added', 'updated', 'removed', 'files')
+
+    def __init__(self):
+        self.added = set()
+        self.updated = set()
+        self.removed = set()
+        self.files = set()
+        self.pkgbases = set()
+        self.repos = set()
+        self.arches = set()
+
+    def __bool__(self):
+        return any(getattr(self, action) for action in self.ACTIONS)
+
+    def __repr__(self):
+        counts = ', '.join(f'{action}={len(getattr(self, action))}' for action in self.ACTIONS)
+        return f'<ChangeSet {counts}>'
+
+    @property
+    def packages(self):
+        '''The ids of all changed packages.'''
+        return self.added | self.updated | self.removed | self.files
+
+    def add(self, action, dbpkgs):
+        ids = getattr(self, action)
+        for dbpkg in dbpkgs:
+            ids.add(dbpkg.id)
+            self.pkgbases.add(dbpkg.pkgbase)
+            self.repos.add(dbpkg.repo_id)
+            self.arches.add(dbpkg.arch_id)
+
+    def merge(self, data):
+        """Adds the changes of another change set, given as_dict(), to this one."""
+        for name, values in data.items():
+            getattr(self, name).update(values)
+
+    def as_dict(self):
+        return {name: sorted(getattr(self, name)) for name in (*self.ACTIONS, 'pkgbases', 'repos', 'arches')}
+
+# vim: set ts=4 sw=4 et:
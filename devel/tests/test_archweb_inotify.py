@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase
+
+from devel.management.commands.archweb_inotify import (
+    PRIORITY_STABLE,
+    PRIORITY_STAGING,
+    PRIORITY_TESTING,
+    Database,
+    EventHandler,
+    ImportScheduler,
+    LeaderLock,
+    WorkerPool,
+)
+from devel.utils import advisory_lock, advisory_lock_key
+
+
+def record_pid(arch, path, options):
+    with open(path, 'a') as fp:
+        fp.write(f'{os.getpid()}\n')
+
+
+def record_options(arch, path, options):
+    with open(path, 'a') as fp:
+        fp.write(','.join(sorted(options)) + '\n')
+
+
+def record_import(arch, path, options):
+    with open(os.path.join(os.path.dirname(path), 'imports'), 'a') as fp:
+        fp.write(f'{os.path.basename(path)}\n')
+
+
+class WorkerPoolTest(SimpleTestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.unlink, self.path)
+
+    def read_pids(self):
+        with open(self.path) as fp:
+            return fp.read().split()
+
+    def test_worker_is_reused(self):
+        pool = WorkerPool(record_pid, workers=1, max_jobs=10, nice=0)
+        for _ in range(3):
+            pool.run('x86_64', self.path)
+        pool.close()
+        pids = self.read_pids()
+        self.assertEqual(len(pids), 3)
+        self.assertEqual(len(set(pids)), 1)
+
+    def test_worker_keeps_connection(self):
+        pool = WorkerPool(record_options, workers=1, nice=0)
+        pool.run('x86_64', self.path)
+        pool.close()
+        self.assertEqual(self.read_pids(), ['keep_connection'])
+
+    def test_queue_wait_is_passed_on(self):
+        pool = WorkerPool(record_options, workers=1, nice=0)
+        database = Database('x86_64', self.path, record_options, pool=pool, scheduler=ImportScheduler())
+        database.update()
+        pool.close()
+        self.assertEqual(self.read_pids(), ['keep_connection,queue_wait'])
+
+    def test_worker_is_recycled(self):
+        pool = WorkerPool(record_pid, workers=1, max_jobs=2, nice=0)
+        for _ in range(3):
+            pool.run('x86_64', self.path)
+        pool.close()
+        pids = self.read_pids()
+        self.assertEqual(len(pids), 3)
+        self.assertEqual(len(set(pids)), 2)
+
+    def test_queued_updates_are_coalesced(self):
+        # without workers nothing is taken off the queue
+        pool = WorkerPool(record_pid, workers=0)
+        job = pool.submit('x86_64', self.path)
+        self.assertIs(pool.submit('x86_64', self.path), job)
+        self.assertIsNot(pool.submit('x86_64', self.path + '.other'), job)
+        self.assertEqual(pool.queue.qsize(), 2)
+
+
+class ImportSchedulerTest(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def send_event(self, handler, name):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w'):
+            pass
+        handler.process_default(SimpleNamespace(name=name, pathname=path, path=self.tmpdir))
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 10
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_imports_are_prioritized(self):
+        scheduler = ImportScheduler(max_concurrent=1)
+        handler = EventHandler(arch_paths={'x86_64': [self.tmpdir]},
+                               filename_suffix='.files.tar.gz',
+                               callback_func=record_import,
+                               scheduler=scheduler,
+                               repo_priorities={'core': PRIORITY_STABLE,
+                                                'core-testing': PRIORITY_TESTING,
+                                                'staging': PRIORITY_STAGING},
+                               delay=0)
+
+        # keep the only slot busy until every update is waiting for it
+        scheduler.acquire()
+        for name in ('staging.files.tar.gz', 'core-testing.files.tar.gz', 'core.files.tar.gz'):
+            self.send_event(handler, name)
+        self.wait_for(lambda: len(scheduler.waiting) == 3)
+
+        # more events while waiting are folded into the queued update
+        self.send_event(handler, 'core.files.tar.gz')
+        scheduler.release()
+        self.wait_for(lambda: not any(db.updating or db.update_thread
+                                      for db in handler.databases.values()))
+
+        with open(os.path.join(self.tmpdir, 'imports')) as fp:
+            self.assertEqual(fp.read().split(), ['core.files.tar.gz', 'core-testing.files.tar.gz',
+                                                 'staging.files.tar.gz'])
+        self.assertEqual(scheduler.waiting, [])
+        self.assertEqual(scheduler.running, 0)
+        self.assertEqual(scheduler.imports, 4)
+
+
+class AdvisoryLockTest(TestCase):
+    def test_advisory_lock_key(self):
+        key = advisory_lock_key('reporead:core:x86_64')
+        self.assertEqual(key, advisory_lock_key('reporead:core:x86_64'))
+        self.assertNotEqual(key, advisory_lock_key('reporead:extra:x86_64'))
+        self.assertTrue(-2 ** 63 <= key < 2 ** 63)
+
+    def test_advisory_lock_without_postgres(self):
+        with advisory_lock('reporead:core:x86_64') as waited:
+            self.assertIsNone(waited)
+
+    def test_leader_lock_without_postgres(self):
+        with self.assertRaises(CommandError):
+            LeaderLock('reporead_inotify').acquire()
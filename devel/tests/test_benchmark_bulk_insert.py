@@ -0,0 +1,31 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TransactionTestCase
+
+from devel.management.commands.reporead import finder
+from main.models import PackageFile
+
+
+class BenchmarkBulkInsertTest(TransactionTestCase):
+    fixtures = ['main/fixtures/arches.json', 'main/fixtures/repos.json']
+
+    def setUp(self):
+        finder.clear_cache()
+
+    def test_no_packages(self):
+        with self.assertRaises(CommandError) as e:
+            call_command('benchmark_bulk_insert')
+        self.assertIn('At least one package is required', str(e.exception))
+
+    def test_benchmark(self):
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+        files = PackageFile.objects.count()
+
+        out = StringIO()
+        call_command('benchmark_bulk_insert', '--rows', '100', stdout=out)
+        self.assertIn('bulk_create: inserted 100 rows', out.getvalue())
+        self.assertEqual(files, PackageFile.objects.count())
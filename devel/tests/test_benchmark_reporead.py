@@ -0,0 +1,81 @@
+import shutil
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TransactionTestCase
+
+from devel.management.commands.benchmark_parse_repo import package_records
+from devel.management.commands.generate_repodb import generate_packages, generate_repo
+from devel.management.commands.reporead import finder, parse_repo
+from main.models import Package, RepoDatabase
+
+
+class GenerateRepoDBTest(TransactionTestCase):
+    def test_generate_packages(self):
+        packages = generate_packages('x86_64', packages=200, split=0.5, agnostic=0.5,
+                                     files=10, seed=1)
+        self.assertEqual(len(packages), 200)
+        self.assertEqual(len({pkgid for pkgid, _, _ in packages}), 200)
+        # the same packages, with a tenth of them having a newer pkgrel
+        bumped = generate_packages('x86_64', packages=200, split=0.5, agnostic=0.5,
+                                   files=10, bump=0.1, seed=1)
+        self.assertEqual([pkgid.rsplit('-', 2)[0] for pkgid, _, _ in packages],
+                         [pkgid.rsplit('-', 2)[0] for pkgid, _, _ in bumped])
+        changed = sum(old != new for (old, _, _), (new, _, _) in zip(packages, bumped, strict=True))
+        self.assertTrue(0 < changed < 100)
+
+    def test_generate_repodb(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        call_command('generate_repodb', 'x86_64', tmpdir, '--packages', '50', '--files', '20',
+                     stdout=StringIO())
+
+        with patch('devel.management.commands.reporead.logger'):
+            reponame, packages = parse_repo(f'{tmpdir}/core.files.tar.gz')
+        self.assertEqual(reponame, 'core')
+        self.assertEqual(len(packages), 50)
+        self.assertEqual({pkg.arch for pkg in packages}, {'x86_64', 'any'})
+        self.assertTrue(all(pkg.has_files for pkg in packages))
+
+
+class BenchmarkRepoReadTest(TransactionTestCase):
+    fixtures = ['main/fixtures/arches.json', 'main/fixtures/repos.json']
+
+    def setUp(self):
+        finder.clear_cache()
+
+    def test_benchmark(self):
+        out = StringIO()
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('benchmark_reporead', 'x86_64', '--packages', '40', '--files', '5',
+                         stdout=out)
+        lines = out.getvalue().splitlines()
+        phases = [line.split()[0] for line in lines[1:-1]]
+        self.assertEqual(phases, ['cold', 'filesonly', 'noop', 'bump', 'force'])
+        self.assertTrue(lines[-1].startswith('Peak RSS of the process:'))
+        self.assertFalse(Package.objects.exists())
+        self.assertFalse(RepoDatabase.objects.exists())
+
+
+class BenchmarkParseRepoTest(TransactionTestCase):
+    def test_parallel_parse(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        db_path, files_path = generate_repo(tmpdir, 'core', 'x86_64', packages=120, files=3)
+        for path in (db_path, files_path):
+            with patch('devel.management.commands.reporead.logger'), \
+                    patch('devel.management.commands.reporead.PARSE_CHUNK_SIZE', 25):
+                serial = package_records(parse_repo(path)[1])
+                parallel = package_records(parse_repo(path, workers=3)[1])
+            self.assertEqual(len(serial), 120)
+            self.assertEqual(parallel, serial)
+
+    def test_benchmark(self):
+        out = StringIO()
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('benchmark_parse_repo', 'x86_64', '--packages', '60', '--workers', '2',
+                         stdout=out)
+        workers = [line.split()[0] for line in out.getvalue().splitlines()[1:-1]]
+        self.assertEqual(workers, ['1', '2'])
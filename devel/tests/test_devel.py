@@ -1,7 +1,11 @@
+from datetime import datetime, timezone
+
 from django.contrib.auth.models import Group, User
 from django.test import TransactionTestCase
 
+from devel.metrics import ImportRunCollector
 from devel.models import UserProfile
+from main.models import Arch, ImportRun, Repo
 
 
 class DevelView(TransactionTestCase):
@@ -41,3 +45,30 @@ def test_profile(self):
     def test_stats(self):
         response = self.client.get('/devel/stats/')
         self.assertEqual(response.status_code, 200)
+
+    def test_imports(self):
+        now = datetime.now(tz=timezone.utc)
+        ImportRun.objects.create(repo=Repo.objects.get(name='Core'), arch=Arch.objects.get(name='x86_64'),
+                                 filename='core.files.tar.gz', started=now, duration=1.5,
+                                 report={'phases': {'parse': {'seconds': 0.5, 'queries': 0}}})
+        response = self.client.get('/devel/imports/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'core.files.tar.gz')
+        self.assertContains(response, 'parse: 0.50s')
+
+    def test_import_metrics(self):
+        core, arch = Repo.objects.get(name='Core'), Arch.objects.get(name='x86_64')
+        for started, duration in [(datetime(2024, 1, 1, tzinfo=timezone.utc), 1.0),
+                                  (datetime(2024, 1, 2, tzinfo=timezone.utc), 2.0)]:
+            ImportRun.objects.create(repo=core, arch=arch, filename='core.db.tar.gz', started=started,
+                                     duration=duration, report={'rows': {'packages': {'insert': 3}}})
+        ImportRun.objects.create(repo=core, arch=arch, filename='core.files.tar.gz', files_only=True,
+                                 started=datetime(2023, 1, 1, tzinfo=timezone.utc), duration=4.0)
+        with self.assertNumQueries(1):
+            metrics = {metric.name: metric.samples for metric in ImportRunCollector().collect()}
+        self.assertEqual(sorted(s.value for s in metrics['archweb_reporead_last_run_duration_seconds']),
+                         [2.0, 4.0])
+        [rows] = metrics['archweb_reporead_last_run_rows']
+        self.assertEqual(rows.labels, {'repo': 'core', 'arch': 'x86_64', 'files_only': 'false',
+                                       'table': 'packages', 'action': 'insert'})
+        self.assertEqual(rows.value, 3)
@@ -4,9 +4,6 @@
 
 from devel.management.commands.read_bumpbuddy_status import Command as BumpBuddyCommand
 from main.models import Arch, Package, Repo
-from packages.alpm import AlpmAPI
-
-alpm = AlpmAPI()
 
 
 @pytest.fixture
@@ -30,7 +27,6 @@ def package(arches, repos):
     pkg.delete()
 
 
-@pytest.mark.skipif(not alpm.available, reason="ALPM is unavailable")
 def test_not_outofdate(command, package):
     request = command.process_package({
         'pkgbase': 'systemd',
@@ -43,7 +39,6 @@ def test_not_outofdate(command, package):
     assert request is None
 
 
-@pytest.mark.skipif(not alpm.available, reason="ALPM is unavailable")
 def test_outofdate(command, package):
     request = command.process_package({
         'pkgbase': 'systemd',
@@ -56,7 +51,6 @@ def test_outofdate(command, package):
     assert request is not None
 
 
-@pytest.mark.skipif(not alpm.available, reason="ALPM is unavailable")
 def test_already_flagged(command, package):
     request = command.process_package({
         'pkgbase': 'systemd',
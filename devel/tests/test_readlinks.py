@@ -0,0 +1,73 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from devel.management.commands.reporead import finder
+from main.models import Soname
+
+
+class ReadLinksTest(TransactionTestCase):
+    fixtures = ['main/fixtures/arches.json', 'main/fixtures/repos.json']
+
+    def setUp(self):
+        finder.clear_cache()
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+
+    def create_links_db(self, links):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'core.links.tar.gz')
+        with tarfile.open(path, 'w:gz') as dest:
+            for pkgid, sonames in links.items():
+                data = ''.join(f'{soname}\n' for soname in sonames).encode()
+                info = tarfile.TarInfo(f'{pkgid}/links')
+                info.size = len(data)
+                dest.addfile(info, io.BytesIO(data))
+        return path
+
+    def sonames(self):
+        return sorted(Soname.objects.values_list('pkg__pkgname', 'name'))
+
+    def test_read_links(self):
+        path = self.create_links_db({
+            'glibc-2.25-5': ['libc.so.6', 'ld-linux-x86-64.so.2'],
+            'systemd-232-8': ['libc.so.6', 'libsystemd.so.0'],
+            'unknown-1.0-1': ['libunknown.so.1'],
+        })
+        with patch('devel.management.commands.readlinks.logger'):
+            call_command('readlinks', path)
+        self.assertEqual(self.sonames(), [
+            ('glibc', 'ld-linux-x86-64.so.2'),
+            ('glibc', 'libc.so.6'),
+            ('systemd', 'libc.so.6'),
+            ('systemd', 'libsystemd.so.0'),
+        ])
+        libc = Soname.objects.get(pkg__pkgname='glibc', name='libc.so.6')
+
+        path = self.create_links_db({
+            'glibc-2.25-5': ['libc.so.6'],
+            'systemd-232-8': ['libc.so.6', 'libsystemd.so.0', 'libudev.so.1'],
+        })
+        with patch('devel.management.commands.readlinks.logger'), \
+                CaptureQueriesContext(connection) as queries:
+            call_command('readlinks', path)
+        # repo, packages, sonames, one delete and one insert in a transaction;
+        # nothing per package or soname
+        self.assertLessEqual(len(queries), 7)
+        self.assertEqual(self.sonames(), [
+            ('glibc', 'libc.so.6'),
+            ('systemd', 'libc.so.6'),
+            ('systemd', 'libsystemd.so.0'),
+            ('systemd', 'libudev.so.1'),
+        ])
+        # unchanged sonames are kept as they are
+        self.assertTrue(Soname.objects.filter(id=libc.id).exists())
@@ -0,0 +1,105 @@
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection
+from django.test import TransactionTestCase
+
+from devel.management.commands.rebuild_files import file_rows
+from devel.management.commands.reporead import finder
+from devel.tests.utils import create_files_db
+from main.models import Arch, Package, PackageFile, Repo
+
+
+class RebuildFilesTest(TransactionTestCase):
+    fixtures = ['main/fixtures/arches.json', 'main/fixtures/repos.json']
+
+    def setUp(self):
+        finder.clear_cache()
+
+    def create_files_db(self):
+        path = create_files_db(self, directory='core/os/x86_64')
+        return path.removesuffix('core/os/x86_64/core.files.tar.gz'), path
+
+    def read_packages(self):
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+
+    @skipUnless(connection.vendor != 'postgresql', 'rebuild_files works on PostgreSQL')
+    def test_requires_postgresql(self):
+        with self.assertRaises(CommandError) as e:
+            call_command('rebuild_files', '/nonexistent/%(repo)s/%(arch)s/')
+        self.assertIn('requires PostgreSQL', str(e.exception))
+
+    def test_file_rows(self):
+        self.read_packages()
+        Package.objects.filter(pkgname='systemd').update(pkgrel='9')
+        _, path = self.create_files_db()
+        repo, arch = Repo.objects.get(name='Core'), Arch.objects.get(name='x86_64')
+
+        loaded = {}
+        with patch('devel.management.commands.rebuild_files.logger'):
+            rows = list(file_rows(repo, arch, path, loaded))
+        # systemd has a newer version than the files database and is skipped
+        expected = Package.objects.exclude(pkgname='systemd')
+        self.assertEqual(loaded.keys(), set(expected.values_list('id', flat=True)))
+        pacman = Package.objects.get(pkgname='pacman')
+        self.assertEqual(loaded[pacman.id], (3, (pacman.last_update, pacman.files_last_update)))
+        self.assertIn((pacman.id, False, 'usr/bin/', 'pacman'), rows)
+        self.assertIn((pacman.id, True, 'usr/bin/', None), rows)
+        self.assertIn((pacman.id, True, 'usr/', None), rows)
+        self.assertEqual(len(rows), 3 * len(loaded))
+
+        # packages loaded from another database already are left out
+        with patch('devel.management.commands.rebuild_files.logger'):
+            self.assertEqual(list(file_rows(repo, arch, path, loaded)), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'rebuild_files requires PostgreSQL')
+    def test_rebuild_files(self):
+        self.read_packages()
+        systemd = Package.objects.get(pkgname='systemd')
+        systemd.pkgrel = '9'
+        systemd.save()
+        PackageFile.objects.create(pkg=systemd, is_directory=False, directory='usr/lib/', filename='kept')
+        pacman = Package.objects.get(pkgname='pacman')
+        PackageFile.objects.create(pkg=pacman, is_directory=False, directory='usr/lib/', filename='stale')
+        tmpdir, _ = self.create_files_db()
+
+        with patch('devel.management.commands.rebuild_files.logger'):
+            call_command('rebuild_files', f'{tmpdir}%(repo)s/os/%(arch)s/')
+
+        # the file lists are replaced, systemd's newer version keeps its own
+        self.assertEqual(set(PackageFile.objects.filter(pkg=pacman).values_list('directory', 'filename')),
+                         {('usr/', None), ('usr/bin/', None), ('usr/bin/', 'pacman')})
+        self.assertEqual(list(PackageFile.objects.filter(pkg=systemd).values_list('directory', 'filename')),
+                         [('usr/lib/', 'kept')])
+        packages = Package.objects.exclude(pkgname='systemd')
+        self.assertEqual(PackageFile.objects.count(), 3 * packages.count() + 1)
+        self.assertFalse(packages.filter(files_last_update__isnull=True).exists())
+        # the new table took over the constraints and sequence of the old one
+        new = PackageFile.objects.create(pkg=pacman, is_directory=False, directory='usr/lib/', filename='new')
+        self.assertGreater(new.id, max(PackageFile.objects.exclude(id=new.id).values_list('id', flat=True)))
+        with self.assertRaises(IntegrityError):
+            PackageFile.objects.create(pkg_id=0, is_directory=False, directory='usr/', filename='orphan')
+
+    @skipUnless(connection.vendor == 'postgresql', 'rebuild_files requires PostgreSQL')
+    def test_rebuild_files_keeps_packages_changed_during_load(self):
+        self.read_packages()
+        tmpdir, _ = self.create_files_db()
+        pacman = Package.objects.get(pkgname='pacman')
+
+        def load_then_import(*args):
+            yield from file_rows(*args)
+            # an import reads the file list of pacman while the rebuild loads
+            PackageFile.objects.create(pkg=pacman, is_directory=False, directory='usr/lib/', filename='imported')
+            Package.objects.filter(id=pacman.id).update(files_last_update=pacman.last_update)
+
+        with patch('devel.management.commands.rebuild_files.logger'), \
+                patch('devel.management.commands.rebuild_files.file_rows', load_then_import):
+            call_command('rebuild_files', f'{tmpdir}%(repo)s/os/%(arch)s/')
+
+        self.assertEqual(list(PackageFile.objects.filter(pkg=pacman).values_list('directory', 'filename')),
+                         [('usr/lib/', 'imported')])
+        self.assertEqual(PackageFile.objects.exclude(pkg=pacman).count(),
+                         3 * Package.objects.exclude(pkgname='pacman').count())
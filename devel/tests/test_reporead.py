@@ -1,19 +1,43 @@
+import hashlib
+import io
+import json
+import os
+import pickle
+import shutil
+import sys
 import tarfile
+import tempfile
+from contextlib import contextmanager
 from datetime import datetime, timezone
+from itertools import pairwise
+from types import SimpleNamespace
 from unittest.mock import patch
 
+from django.contrib.auth.models import User
 from django.core.management import call_command
 from django.core.management.base import CommandError
-from django.test import TransactionTestCase
+from django.db import DatabaseError, IntegrityError, connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
-from main.models import Arch, Package, Repo
-from packages.models import FlagRequest
+from devel.management.commands import reporead
+from devel.management.commands.reporead import RepoArchive, RepoPackage, copy_format_row, finder
+from devel.signals import packages_changed
+from devel.tests.utils import create_files_db
+from main.models import Arch, ImportRun, Package, PackageFile, Repo, RepoDatabase
+from main.utils import get_generations
+from packages.alpm import vercmp, version_key
+from packages.models import Depend, FlagRequest, ReverseDepend, ReverseDependManager, StaleReverseDepend, Update
 
 
 # Django's TestCase is wrapped in transaction, therefore use TransactionTestCase
 class RepoReadTest(TransactionTestCase):
     fixtures = ['main/fixtures/arches.json', 'main/fixtures/repos.json']
 
+    def setUp(self):
+        # the module level finder caches users across imports
+        finder.clear_cache()
+
     def create_pkg(self, repo=None, pkgver='4.10.1', pkgrel='1'):
         if not repo:
             repo = Repo.objects.get(name__iexact='core')
@@ -26,6 +50,29 @@ def create_pkg(self, repo=None, pkgver='4.10.1', pkgrel='1'):
                                       compressed_size=10, installed_size=20,
                                       last_update=now, created=now)
 
+    def create_files_db(self, extra_files=()):
+        return create_files_db(self, extra_files)
+
+    def create_arch_db(self, arch, agnostic=()):
+        """Build a core.db.tar.gz for arch from the core.db fixture, turning
+        the packages named in agnostic into 'any' packages."""
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'core.db.tar.gz')
+        with tarfile.open('devel/fixtures/core.db.tar.gz') as source, \
+                tarfile.open(path, 'w:gz') as dest:
+            for member in source.getmembers():
+                if not member.isreg():
+                    dest.addfile(member)
+                    continue
+                data = source.extractfile(member).read()
+                pkgname = os.path.basename(os.path.dirname(member.name)).rsplit('-', 2)[0]
+                target = 'any' if pkgname in agnostic else arch
+                data = data.replace(b'%ARCH%\nx86_64\n', f'%ARCH%\n{target}\n'.encode())
+                member.size = len(data)
+                dest.addfile(member, io.BytesIO(data))
+        return path
+
     def test_invalid_args(self):
         with self.assertRaises(CommandError) as e:
             call_command('reporead')
@@ -90,3 +137,582 @@ def test_flagoutofdate_staging(self):
         objects = FlagRequest.objects.all()
         self.assertEqual(len(objects), 1)
         self.assertEqual(objects[0].pkgver, staging_pkg.pkgver)
+
+    def test_read_files(self):
+        filename = self.create_files_db()
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', filename)
+
+        pkg = Package.objects.get(pkgname='systemd')
+        self.assertIsNotNone(pkg.files_last_update)
+        files = [str(f) for f in PackageFile.objects.filter(pkg=pkg).order_by('id')]
+        self.assertEqual(files, ['usr/', 'usr/bin/', 'usr/bin/systemd'])
+
+    def test_delete_pkgs_files(self):
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', self.create_files_db())
+        pkg_ids = list(Package.objects.values_list('id', flat=True))
+        kept = pkg_ids.pop()
+        with patch('devel.management.commands.reporead.DELETE_CHUNK_SIZE', 2), \
+                CaptureQueriesContext(connection) as queries:
+            reporead.delete_pkgs_files(pkg_ids)
+        if connection.vendor != 'postgresql':
+            self.assertEqual(len(queries), (len(pkg_ids) + 1) // 2)
+        self.assertEqual(set(PackageFile.objects.values_list('pkg_id', flat=True)), {kept})
+
+    def test_read_files_unchanged(self):
+        filename = self.create_files_db()
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', filename)
+
+        # file lists are up to date, so none of them should be read again
+        with patch('devel.management.commands.reporead.logger'), \
+                patch.object(RepoArchive, 'read_member') as read_member:
+            call_command('reporead', 'x86_64', filename)
+        read_member.assert_not_called()
+
+        read_member = RepoArchive.read_member
+        reads = []
+
+        def counting_read_member(archive, offset, size):
+            reads.append(offset)
+            return read_member(archive, offset, size)
+
+        # a forced reload still skips packages that were not changed at all
+        with patch('devel.management.commands.reporead.logger'), \
+                patch.object(RepoArchive, 'read_member', counting_read_member):
+            call_command('reporead', 'x86_64', filename, filesonly=True, force=True)
+        self.assertEqual(len(reads), 0)
+
+        with patch('devel.management.commands.reporead.logger'), \
+                patch.object(RepoArchive, 'read_member', counting_read_member):
+            call_command('reporead', 'x86_64', filename, filesonly=True, force=True, digest=False)
+        self.assertEqual(len(reads), Package.objects.count())
+
+    def test_archive_replaced_after_parsing(self):
+        path = self.create_files_db()
+        _, pkgs = reporead.parse_repo(path)
+        pkg = next(iter(pkgs))
+        archive = pkg.archive
+        self.addCleanup(archive.close)
+        with open(path, 'rb') as fp:
+            self.assertEqual(archive.digest, hashlib.file_digest(fp, 'sha256').hexdigest())
+
+        # the repo tools replace the database while it is imported
+        os.replace(create_files_db(self, extra_files=['usr/share/']), path)
+        self.assertEqual(pkg.files_list, ['usr/', 'usr/bin/', f'usr/bin/{pkg.name}'])
+
+        # a copy in a worker process opens the new file, but does not read it
+        copy = pickle.loads(pickle.dumps(archive))
+        with self.assertRaisesMessage(Exception, 'was replaced since it was parsed'):
+            copy.read_member(*pkg.files_member)
+
+    def test_read_packages_batched(self):
+        packager = User.objects.create(username='dreisner')
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz', batch_size=2)
+
+        with tarfile.open('devel/fixtures/core.db.tar.gz') as tar:
+            files = [name.replace('core.db/', '') for name in tar.getnames()
+                     if name != 'core.db' and 'desc' not in name]
+        packages = Package.objects.all()
+        import_packages = [f"{pkg.pkgname}-{pkg.pkgver}-{pkg.pkgrel}" for pkg in packages]
+        self.assertCountEqual(files, import_packages)
+
+        systemd = Package.objects.get(pkgname='systemd')
+        self.assertEqual(systemd.depends.filter(deptype='D').count(), 17)
+        self.assertEqual(systemd.depends.filter(deptype='O').count(), 5)
+        self.assertEqual(systemd.provides.count(), 3)
+        self.assertEqual(systemd.conflicts.count(), 3)
+        self.assertEqual(systemd.replaces.count(), 3)
+        self.assertCountEqual([lic.name for lic in systemd.licenses.all()], ['GPL2', 'LGPL2.1'])
+        self.assertEqual(systemd.packager, packager)
+        self.assertEqual(list(systemd.maintainers), [packager])
+
+    def test_update_packages_batched(self):
+        core = Repo.objects.get(name__iexact='core')
+        x86_64 = Arch.objects.get(name='x86_64')
+        pkg = self.create_pkg()
+        Package.objects.filter(id=pkg.id).update(arch=x86_64)
+        old = Package.objects.create(arch=x86_64, repo=core, pkgname='removed',
+                                     pkgbase='removed', pkgver='1.0', pkgrel='1',
+                                     compressed_size=10, installed_size=20,
+                                     last_update=pkg.last_update, created=pkg.created)
+        FlagRequest.objects.create(pkgbase=pkg.pkgbase, repo=pkg.repo,
+                                   pkgver=pkg.pkgver, epoch=pkg.epoch,
+                                   ip_address='1.1.1.1')
+
+        with patch('devel.management.commands.reporead.logger'), \
+                CaptureQueriesContext(connection) as queries:
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz', batch_size=2)
+        if connection.vendor == 'postgresql':
+            # only packages are locked, not the arch and repo rows they share
+            locks = [query['sql'] for query in queries if 'FOR UPDATE' in query['sql']]
+            self.assertTrue(locks)
+            for sql in locks:
+                self.assertIn('FOR UPDATE OF "packages"', sql)
+
+        updated = Package.objects.get(id=pkg.id)
+        self.assertEqual(updated.full_version, '232-8')
+        self.assertEqual(updated.depends.filter(deptype='D').count(), 17)
+        self.assertGreater(updated.last_update, pkg.last_update)
+        self.assertFalse(Package.objects.filter(id=old.id).exists())
+        self.assertEqual(FlagRequest.objects.count(), 0)
+
+    def test_read_packages_batched_logs_updates(self):
+        # sqlite logs updates with triggers, force the python code path
+        with patch('devel.management.commands.reporead.logger'), \
+                patch('packages.models.database_vendor', return_value='mysql'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz', batch_size=2)
+
+        updates = Update.objects.all()
+        self.assertEqual(len(updates), Package.objects.count())
+        self.assertTrue(all(update.is_addition() and update.created for update in updates))
+
+    def test_unchanged_database_is_skipped(self):
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+        self.assertTrue(RepoDatabase.objects.filter(repo__name='Core', arch__name='x86_64').exists())
+
+        with patch('devel.management.commands.reporead.logger'), \
+                patch('devel.management.commands.reporead.parse_repo') as parse_repo:
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+        parse_repo.assert_not_called()
+
+        with patch('devel.management.commands.reporead.logger'), \
+                patch('devel.management.commands.reporead.parse_repo',
+                      wraps=reporead.parse_repo) as parse_repo:
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz', digest=False)
+        parse_repo.assert_called_once()
+
+    def test_database_kinds_are_kept_apart(self):
+        agnostic = self.create_arch_db('x86_64', ('coreutils', 'pacman'))
+        files = create_files_db(self, source=agnostic)
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', agnostic)
+        # the agnostic packages are the same, but are not skipped for the files database
+        with patch('devel.management.commands.reporead.logger'), \
+                patch('devel.management.commands.reporead.db_update',
+                      wraps=reporead.db_update) as db_update:
+            call_command('reporead', 'x86_64', files)
+        self.assertEqual([c.args[0] for c in db_update.call_args_list], ['any', 'x86_64'])
+        self.assertEqual(set(RepoDatabase.objects.values_list('arch__name', 'kind')),
+                         {('x86_64', 'db'), ('x86_64', 'files'), ('any', 'db'), ('any', 'files')})
+
+        # neither import undid the other's digest
+        for path in (agnostic, files):
+            with patch('devel.management.commands.reporead.logger'), \
+                    patch('devel.management.commands.reporead.parse_repo') as parse_repo:
+                call_command('reporead', 'x86_64', path)
+            parse_repo.assert_not_called()
+
+    def test_agnostic_packages_imported_once(self):
+        agnostic = ('coreutils', 'pacman')
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', self.create_arch_db('x86_64', agnostic))
+        self.assertEqual(Package.objects.filter(arch__name='any').count(), 2)
+        self.assertTrue(RepoDatabase.objects.filter(repo__name='Core', arch__name='any').exists())
+
+        with patch('devel.management.commands.reporead.logger'), \
+                patch('devel.management.commands.reporead.db_update',
+                      wraps=reporead.db_update) as db_update:
+            call_command('reporead', 'i686', self.create_arch_db('i686', agnostic))
+        self.assertEqual([c.args[0] for c in db_update.call_args_list], ['i686'])
+        self.assertEqual(Package.objects.filter(arch__name='i686').count(), 3)
+
+        # a different set of agnostic packages is imported again
+        with patch('devel.management.commands.reporead.logger'), \
+                patch('devel.management.commands.reporead.db_update',
+                      wraps=reporead.db_update) as db_update:
+            call_command('reporead', 'i686', self.create_arch_db('i686', ('coreutils',)))
+        self.assertEqual([c.args[0] for c in db_update.call_args_list], ['any', 'i686'])
+        self.assertEqual(list(Package.objects.filter(arch__name='any').values_list('pkgname', flat=True)),
+                         ['coreutils'])
+
+    def test_agnostic_digest_written_after_update(self):
+        path = self.create_arch_db('x86_64', ('coreutils', 'pacman'))
+        with patch('devel.management.commands.reporead.logger'), \
+                patch('devel.management.commands.reporead.db_update', side_effect=ValueError), \
+                self.assertRaises(ValueError):
+            call_command('reporead', 'x86_64', path)
+        # a failed update leaves nothing that would skip the next import
+        self.assertFalse(RepoDatabase.objects.filter(arch__name='any').exists())
+
+    def test_force_skips_unchanged_packages(self):
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+        self.assertFalse(Package.objects.filter(metadata_digest__isnull=True).exists())
+
+        Package.objects.filter(pkgname='systemd').update(metadata_digest='0' * 64)
+        with patch('devel.management.commands.reporead.logger'), \
+                patch('devel.management.commands.reporead.populate_pkg',
+                      wraps=reporead.populate_pkg) as populate_pkg:
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz', force=True)
+        self.assertEqual([c.args[0].pkgname for c in populate_pkg.call_args_list], ['systemd'])
+        systemd = Package.objects.get(pkgname='systemd')
+        self.assertNotEqual(systemd.metadata_digest, '0' * 64)
+
+    def test_read_files_incremental(self):
+        filename = self.create_files_db(extra_files=['usr/share/a', 'usr/share/b', 'usr/share/c', 'usr/share/'])
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', filename)
+        pkg = Package.objects.get(pkgname='systemd')
+        before = {str(f): f.id for f in PackageFile.objects.filter(pkg=pkg)}
+
+        # one path removed, one added: only those rows are touched
+        filename = self.create_files_db(extra_files=['usr/share/a', 'usr/share/b', 'usr/share/d', 'usr/share/'])
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', filename, filesonly=True, force=True, digest=False)
+        after = {str(f): f.id for f in PackageFile.objects.filter(pkg=pkg)}
+        self.assertEqual(set(after), set(before) - {'usr/share/c'} | {'usr/share/d'})
+        unchanged = set(before) & set(after)
+        self.assertEqual({before[p] for p in unchanged}, {after[p] for p in unchanged})
+
+        # too many changes: the whole list is rewritten
+        with self.settings(FILES_DIFF_CHURN_RATIO=0.1), \
+                patch('devel.management.commands.reporead.logger'):
+            filename = self.create_files_db(extra_files=['usr/share/e', 'usr/share/'])
+            call_command('reporead', 'x86_64', filename, filesonly=True, force=True, digest=False)
+        rewritten = {str(f): f.id for f in PackageFile.objects.filter(pkg=pkg)}
+        self.assertEqual(set(rewritten), {'usr/', 'usr/bin/', 'usr/bin/systemd', 'usr/share/', 'usr/share/e'})
+        self.assertFalse(set(rewritten.values()) & set(after.values()))
+
+    def test_read_packages_low_memory(self):
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+        expected = set(Package.objects.values_list('pkgname', 'pkgver', 'pkgrel'))
+
+        # packages sorting before, between and after the real ones are removed
+        # and an outdated one is updated, across several pages of packages
+        systemd = Package.objects.get(pkgname='systemd')
+        for pkgname in ('aaa', 'glibc-extra', 'zzz'):
+            systemd.id, systemd.pkgname = None, pkgname
+            systemd.save()
+        Package.objects.filter(pkgname='pacman').update(pkgrel='0')
+        for options in ({}, {'batch_size': 2}):
+            with patch('devel.management.commands.reporead.logger'), \
+                    patch('devel.management.commands.reporead.MERGE_BATCH_SIZE', 2):
+                call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz',
+                             low_memory=True, digest=False, **options)
+            self.assertEqual(set(Package.objects.values_list('pkgname', 'pkgver', 'pkgrel')), expected)
+
+    def test_merge_packages(self):
+        pkgs = [SimpleNamespace(name=name) for name in ('a', 'c', 'd')]
+        dbpkgs = [SimpleNamespace(pkgname=name) for name in ('b', 'c', 'e')]
+        pairs = [(pkg and pkg.name, dbpkg and dbpkg.pkgname)
+                 for pkg, dbpkg in reporead.merge_packages(pkgs, dbpkgs)]
+        self.assertEqual(pairs, [('a', None), (None, 'b'), ('c', 'c'), ('d', None), (None, 'e')])
+
+    def test_import_report(self):
+        report = os.path.join(tempfile.mkdtemp(), 'report.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(report))
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz',
+                         report=report, trace_memory=True)
+        with open(report) as fp:
+            data = json.load(fp)
+        self.assertEqual(data['repo'], 'core')
+        self.assertEqual(data['status'], 'imported')
+        self.assertTrue({'parse', 'sanity', 'add', 'remove', 'update'} <= set(data['phases']))
+        self.assertGreater(data['phases']['add']['queries'], 0)
+        self.assertGreater(data['phases']['parse']['peak_memory'], 0)
+        self.assertEqual(data['rows']['packages']['insert'], Package.objects.count())
+
+        run = ImportRun.objects.get()
+        self.assertEqual((run.repo.name, run.arch.name, run.status), ('Core', 'x86_64', ImportRun.IMPORTED))
+        self.assertEqual(run.queries, data['queries'])
+        self.assertIsNotNone(run.peak_memory)
+        self.assertEqual(run.report['phases'].keys(), data['phases'].keys())
+
+        # an unchanged database is recorded as skipped
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+        run = ImportRun.objects.latest()
+        self.assertEqual(run.status, ImportRun.SKIPPED)
+        self.assertEqual(run.report['phases'], {})
+        self.assertIsNone(run.peak_memory)
+
+    def test_queue_wait_event(self):
+        with patch('devel.management.commands.reporead.logger'):
+            reporead.read_repo('x86_64', 'devel/fixtures/core.db.tar.gz', {'queue_wait': 2.5})
+        self.assertEqual(ImportRun.objects.get().report['events']['queue_wait_seconds'], 2.5)
+
+    def test_failed_import_report(self):
+        with patch('devel.management.commands.reporead.logger') as logger, \
+                patch('devel.management.commands.reporead.import_repo', side_effect=ValueError('import')), \
+                patch('devel.management.commands.reporead.record_import_run',
+                      side_effect=DatabaseError('record')), \
+                self.assertRaisesMessage(ValueError, 'import'):
+            reporead.read_repo('x86_64', 'devel/fixtures/core.db.tar.gz', {})
+        logger.exception.assert_called_once()
+
+    def test_failed_add_is_retried(self):
+        populate_pkg = reporead.populate_pkg
+
+        def failing_populate_pkg(dbpkg, repopkg, **kwargs):
+            if repopkg.name == 'systemd':
+                raise IntegrityError('systemd')
+            return populate_pkg(dbpkg, repopkg, **kwargs)
+
+        with patch('devel.management.commands.reporead.logger'), \
+                patch('devel.management.commands.reporead.populate_pkg', failing_populate_pkg):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+        self.assertFalse(Package.objects.filter(pkgname='systemd').exists())
+        self.assertEqual(ImportRun.objects.get().report['events']['failed_adds'], 1)
+        self.assertFalse(RepoDatabase.objects.filter(arch__name='x86_64').exists())
+
+        # the unchanged database is not skipped, so the package is added now
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+        self.assertTrue(Package.objects.filter(pkgname='systemd').exists())
+        self.assertTrue(RepoDatabase.objects.filter(arch__name='x86_64').exists())
+
+    def test_read_packages_commit_size(self):
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+        expected = set(Package.objects.values_list('pkgname', 'pkgver', 'pkgrel'))
+        Package.objects.all().delete()
+
+        pkg = self.create_pkg()
+        Package.objects.filter(id=pkg.id).update(arch=Arch.objects.get(name='x86_64'))
+        Package.objects.create(arch=Arch.objects.get(name='x86_64'), repo=pkg.repo, pkgname='removed',
+                               pkgbase='removed', pkgver='1.0', pkgrel='1', compressed_size=10,
+                               installed_size=20, last_update=pkg.last_update, created=pkg.created)
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz',
+                         batch_size=2, commit_size=2, digest=False)
+        self.assertEqual(set(Package.objects.values_list('pkgname', 'pkgver', 'pkgrel')), expected)
+
+    def test_agnostic_packages_commit_size(self):
+        with patch('devel.management.commands.reporead.logger'), \
+                patch('devel.management.commands.reporead.db_update',
+                      wraps=reporead.db_update) as db_update:
+            call_command('reporead', 'x86_64', self.create_arch_db('x86_64', ('coreutils', 'pacman')),
+                         commit_size=2)
+        self.assertEqual([(c.args[0], c.kwargs['commit_size']) for c in db_update.call_args_list],
+                         [('any', 2), ('x86_64', 2)])
+        self.assertEqual(Package.objects.filter(arch__name='any').count(), 2)
+
+    @contextmanager
+    def waiting_lock(self, name, using):
+        yield 1.5
+
+    def test_import_lock_events(self):
+        report = os.path.join(tempfile.mkdtemp(), 'report.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(report))
+        with patch('devel.management.commands.reporead.logger'), \
+                patch('devel.management.commands.reporead.advisory_lock', self.waiting_lock):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz', report=report)
+        with open(report) as fp:
+            data = json.load(fp)
+        # one lock each for x86_64 and any
+        self.assertEqual(data['events'], {'lock_waits': 2, 'lock_wait_seconds': 3.0})
+        self.assertEqual(ImportRun.objects.get().report['events'], data['events'])
+
+    def test_report_to_stdout(self):
+        stdout = io.StringIO()
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz', report='-', stdout=stdout)
+        data = json.loads(stdout.getvalue())
+        self.assertEqual((data['repo'], data['arch'], data['status']), ('core', 'x86_64', 'imported'))
+        self.assertEqual(ImportRun.objects.get().report['queries'], data['queries'])
+
+    def test_packages_changed(self):
+        sent = []
+
+        def receiver(sender, arch, repo_file, changes, **kwargs):
+            sent.append(changes)
+
+        def failing_receiver(sender, **kwargs):
+            raise ValueError('broken consumer')
+
+        packages_changed.connect(receiver)
+        packages_changed.connect(failing_receiver)
+        self.addCleanup(packages_changed.disconnect, receiver)
+        self.addCleanup(packages_changed.disconnect, failing_receiver)
+
+        with patch('devel.management.commands.reporead.logger') as logger:
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+        logger.error.assert_called_once()
+        changes = sent.pop()
+        self.assertEqual(changes.added, set(Package.objects.values_list('id', flat=True)))
+        self.assertEqual(changes.pkgbases, set(Package.objects.values_list('pkgbase', flat=True)))
+        self.assertEqual(changes.repos, {Repo.objects.get(name='Core').id})
+        self.assertFalse(changes.updated or changes.removed or changes.files)
+
+        # nothing changed, nothing is sent
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+        self.assertEqual(sent, [])
+
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', self.create_files_db(), filesonly=True)
+        self.assertEqual(sent.pop().files, set(Package.objects.values_list('id', flat=True)))
+
+        pacman = Package.objects.get(pkgname='pacman')
+        Package.objects.filter(id=pacman.id).update(pkgrel='0')
+        removed = Package.objects.create(arch=pacman.arch, repo=pacman.repo, pkgname='removed',
+                                         pkgbase='removed-base', pkgver='1.0', pkgrel='1',
+                                         compressed_size=10, installed_size=20,
+                                         last_update=pacman.last_update, created=pacman.created)
+        for options in ({}, {'batch_size': 2}):
+            with patch('devel.management.commands.reporead.logger'):
+                call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz', digest=False,
+                             **options)
+            changes = sent.pop()
+            self.assertEqual((changes.added, changes.updated, changes.removed),
+                             (set(), {pacman.id}, {removed.id}))
+            self.assertEqual(changes.pkgbases, {pacman.pkgbase, 'removed-base'})
+            Package.objects.filter(id=pacman.id).update(pkgrel='0')
+            removed.save(force_insert=True)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'reporead'}})
+    def test_packages_generations(self):
+        names = ('packages', 'packages:core', 'packages:core:x86_64', 'packages:extra')
+        before = get_generations(*names).split('.')
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+        after = get_generations(*names).split('.')
+        self.assertEqual([old != new for old, new in zip(before, after, strict=True)], [True, True, True, False])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'reporead'}})
+    def test_keep_connection(self):
+        options = {'keep_connection': True, 'digest': False}
+        with patch('devel.management.commands.reporead.logger'), \
+                patch.object(connection, 'close', wraps=connection.close) as close:
+            reporead.read_repo('x86_64', 'devel/fixtures/core.db.tar.gz', options)
+            users = finder.users
+            self.assertIsNotNone(users)
+            reporead.read_repo('x86_64', 'devel/fixtures/core.db.tar.gz', options)
+            # the next import in a worker reuses the connection and user index
+            close.assert_not_called()
+            self.assertIs(finder.users, users)
+
+            reporead.read_repo('x86_64', 'devel/fixtures/core.db.tar.gz', {'digest': False})
+            close.assert_called_once()
+
+    def test_reverse_depends(self):
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+        rows = set(ReverseDepend.objects.values_list('pkg', 'target', 'name', 'deptype', 'provision'))
+        self.assertTrue(rows)
+        ReverseDepend.objects.rebuild()
+        self.assertEqual(set(ReverseDepend.objects.values_list('pkg', 'target', 'name', 'deptype', 'provision')),
+                         rows)
+
+        glibc = Package.objects.get(pkgname='glibc')
+        required = {dep.pkg_id for dep in Depend.objects.filter(name='glibc')}
+        self.assertEqual({req.pkg.id for req in glibc.get_requiredby()}, required)
+        self.assertFalse(StaleReverseDepend.objects.exists())
+
+    def test_reverse_depends_refresh_failed(self):
+        with patch('devel.management.commands.reporead.logger') as logger, \
+                patch.object(ReverseDependManager, 'refresh', side_effect=DatabaseError('refresh')):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+        logger.error.assert_called_once()
+        # the packages are known to be stale
+        self.assertFalse(ReverseDepend.objects.exists())
+        self.assertEqual(set(StaleReverseDepend.objects.values_list('pkg', flat=True)),
+                         set(Package.objects.values_list('id', flat=True)))
+
+        # the next import changing any package refreshes all of them
+        Package.objects.filter(pkgname='linux').update(pkgrel='0')
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz', digest=False)
+        self.assertFalse(StaleReverseDepend.objects.exists())
+        rows = set(ReverseDepend.objects.values_list('pkg', 'target', 'name', 'deptype', 'provision'))
+        self.assertTrue(rows)
+        ReverseDepend.objects.rebuild()
+        self.assertEqual(set(ReverseDepend.objects.values_list('pkg', 'target', 'name', 'deptype', 'provision')),
+                         rows)
+
+    def test_version_keys(self):
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+        for pkg in Package.objects.all():
+            self.assertEqual(pkg.version_key, version_key(pkg.full_version))
+        # sorting by the key sorts like vercmp()
+        keys = list(Package.objects.order_by('version_key').values_list('version_key', flat=True))
+        versions = [pkg.full_version for pkg in Package.objects.order_by('version_key')]
+        self.assertEqual(keys, sorted(keys))
+        for older, newer in pairwise(versions):
+            self.assertLessEqual(vercmp(older, newer), 0)
+
+    def test_import_history_retention(self):
+        started = datetime(2000, 1, 1, tzinfo=timezone.utc)
+        ImportRun.objects.create(repo=Repo.objects.get(name='Core'), arch=Arch.objects.get(name='x86_64'),
+                                 filename='core.db.tar.gz', started=started, duration=1.0)
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+        self.assertEqual(ImportRun.objects.count(), 1)
+        self.assertNotEqual(ImportRun.objects.get().started, started)
+
+    def test_read_files_workers(self):
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+        # SQLite allows a single writer, so the files are loaded serially
+        with patch('devel.management.commands.reporead.logger') as logger:
+            call_command('reporead', 'x86_64', self.create_files_db(), filesonly=True, files_workers=4)
+        logger.warning.assert_called_with('SQLite allows a single writer, loading files serially')
+        self.assertEqual(PackageFile.objects.count(), 3 * Package.objects.count())
+
+    def test_partition_packages_archive_order(self):
+        # later members have bigger file lists
+        items = [(i, SimpleNamespace(files_member=(1000 * i, 10 * i))) for i in range(1, 9)]
+        shards = reporead.partition_packages(items, 3)
+        self.assertCountEqual([item for shard in shards for item in shard], items)
+        for shard in shards:
+            offsets = [pkg.files_member[0] for _, pkg in shard]
+            self.assertEqual(offsets, sorted(offsets))
+
+    def test_load_files_shard(self):
+        with patch('devel.management.commands.reporead.logger'):
+            call_command('reporead', 'x86_64', 'devel/fixtures/core.db.tar.gz')
+            path = self.create_files_db()
+            _, pkgs = reporead.parse_repo(path)
+        ids = dict(Package.objects.values_list('pkgname', 'id'))
+        items = [(ids[pkg.name], pkg) for pkg in pkgs]
+
+        shards = reporead.partition_packages(items, 2)
+        self.assertEqual(len(shards), 2)
+        self.assertCountEqual([item for shard in shards for item in shard], items)
+        sizes = [sum(pkg.files_member[1] for _, pkg in shard) for shard in shards]
+        self.assertLessEqual(abs(sizes[0] - sizes[1]), max(pkg.files_member[1] for pkg in pkgs))
+        self.assertEqual(len(reporead.partition_packages(items[:1], 2)), 1)
+
+        shard = [(pkg_id, pkg.files_member, pkg.record()) for pkg_id, pkg in shards[0]]
+        with patch('devel.management.commands.reporead.logger'):
+            packages, rows = reporead.load_files_shard(items[0][1].archive, 'core', shard)
+        self.assertEqual((packages, rows), (len(shard), 3 * len(shard)))
+        self.assertEqual(PackageFile.objects.filter(pkg_id__in=[pkg_id for pkg_id, _, _ in shard]).count(),
+                         rows)
+
+    def test_parse_depend(self):
+        self.assertEqual(reporead.parse_depend('python>=3.13'), ('python', '>=', '3.13', None))
+        self.assertEqual(reporead.parse_depend('glibc: for locales'), ('glibc', None, None, 'for locales'))
+        self.assertEqual(reporead.parse_depend('systemd=1:232-8'), ('systemd', '=', '1:232-8', None))
+        self.assertIsNone(reporead.parse_depend(''))
+        self.assertEqual(reporead.parse_relation('libfoo.so=1-64'), ('libfoo.so', '=', '1-64'))
+        hits = reporead.parse_depend.cache_info().hits
+        reporead.parse_depend('python>=3.13')
+        self.assertEqual(reporead.parse_depend.cache_info().hits, hits + 1)
+
+    def test_repo_package_populate(self):
+        pkg = RepoPackage('core')
+        pkg.populate({'name': ['gcc-libs'], 'version': ['1:14.1-2'], 'depends': ['glibc'],
+                      'xdata': ['pkgtype=pkg']})
+        self.assertEqual((pkg.ver, pkg.rel, pkg.epoch), ('14.1', '2', 1))
+        self.assertEqual(pkg.depends, ('glibc',))
+        self.assertIs(pkg.depends[0], sys.intern('glibc'))
+        self.assertFalse(hasattr(pkg, '__dict__'))
+
+        copy = RepoPackage('core')
+        copy.load_record(pkg.record())
+        self.assertEqual(copy.record(), pkg.record())
+
+    def test_copy_format_row(self):
+        self.assertEqual(copy_format_row((1, True, 'usr/', None)), '1\tt\tusr/\t\\N\n')
+        self.assertEqual(copy_format_row((2, False, 'a\\b\tc\nd', 'e\rf')),
+                         '2\tf\ta\\\\b\\tc\\nd\te\\rf\n')
@@ -1,7 +1,7 @@
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
-from devel.models import UserProfile
+from devel.models import PackagerIdentity, UserProfile
 from devel.utils import UserFinder
 
 
@@ -134,4 +134,83 @@ def test_find_by_email(self):
         # Test cache
         self.assertEqual(self.finder.find_by_email(self.user1.email), self.user1)
 
+    def test_find_by_pgp_key(self):
+        self.user1.userprofile.pgp_key = '0123456789ABCDEF0123456789ABCDEF01234567'
+        self.user1.userprofile.save()
+        self.assertIsNone(self.finder.find_by_pgp_key(None))
+        self.assertIsNone(self.finder.find_by_pgp_key('FFFFFFFFFFFFFFFF'))
+        self.assertEqual(self.finder.find_by_pgp_key('0123456789ABCDEF01234567'), self.user1)
+
+    def test_identities_are_persisted(self):
+        self.assertEqual(self.user1, self.finder.find("Joe User <joe@differentdomain.com>"))
+        self.assertIsNone(self.finder.find("Unknown Packager"))
+        self.assertEqual(dict(PackagerIdentity.objects.values_list('packager', 'user')), {
+            "Joe User <joe@differentdomain.com>": self.user1.id,
+            "Unknown Packager": None,
+        })
+
+        # a new finder loads all users and known identities in two queries
+        finder = UserFinder()
+        with self.assertNumQueries(2):
+            self.assertEqual(self.user1, finder.find("Joe User <joe@differentdomain.com>"))
+            self.assertIsNone(finder.find("Unknown Packager"))
+
+    def identities(self):
+        return set(PackagerIdentity.objects.values_list('packager', flat=True))
+
+    def test_identities_are_invalidated(self):
+        self.assertIsNone(self.finder.find("Jane Doe <jane@example.org>"))
+        self.assertEqual(self.user3, self.finder.find("Bob Jones <bob@example.org>"))
+        self.assertEqual(self.identities(), {"Jane Doe <jane@example.org>", "Bob Jones <bob@example.org>"})
+
+        # logging in doesn't change anything finders care about
+        self.user1.save(update_fields=['last_login'])
+        self.assertEqual(len(self.identities()), 2)
+        # neither does any other field, which costs no more than reading the stored user
+        self.user1.is_staff = not self.user1.is_staff
+        with self.assertNumQueries(2):
+            self.user1.save()
+        self.assertEqual(len(self.identities()), 2)
+
+        # only the strings which could match the changed user are forgotten
+        self.user1.userprofile.public_email = 'jane@example.org'
+        self.user1.userprofile.save()
+        self.assertEqual(self.identities(), {"Bob Jones <bob@example.org>"})
+        self.finder.clear_cache()
+        self.assertEqual(self.user1, self.finder.find("Jane Doe <jane@example.org>"))
+
+    def test_identities_of_renamed_users_are_invalidated(self):
+        self.assertEqual(self.user4, self.finder.find("Tim One <tim@anotherdomain.com>"))
+        self.assertIsNone(self.finder.find("Jim Two <jim@anotherdomain.com>"))
+        self.assertEqual(self.user1, self.finder.find("Joe User <joe@differentdomain.com>"))
+
+        # both the strings matching the old and the new name are forgotten
+        self.user4.first_name = 'Jim'
+        self.user4.last_name = 'Two'
+        self.user4.save()
+        self.assertEqual(self.identities(), {"Joe User <joe@differentdomain.com>"})
+        self.finder.clear_cache()
+        self.assertIsNone(self.finder.find("Tim One <tim@anotherdomain.com>"))
+        self.assertEqual(self.user4, self.finder.find("Jim Two <jim@anotherdomain.com>"))
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                           'LOCATION': 'finder'}})
+    def test_refresh(self):
+        self.assertEqual(self.user1, self.finder.find_by_username('joeuser'))
+        users = self.finder.users
+        self.finder.refresh()
+        self.assertIs(self.finder.users, users)
+
+        self.user1.first_name = 'Joseph'
+        self.user1.save()
+        self.finder.refresh()
+        self.assertIsNone(self.finder.users)
+        self.assertEqual(self.user1, self.finder.find("Joseph User <joseph@example.org>"))
+
+    def test_refresh_without_cache(self):
+        # the dummy cache can't tell whether users changed
+        self.finder.find_by_username('joeuser')
+        self.finder.refresh()
+        self.assertIsNone(self.finder.users)
+
 # vim: set ts=4 sw=4 et:
@@ -0,0 +1,30 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+
+
+def create_files_db(testcase, extra_files=(), directory='', source='devel/fixtures/core.db.tar.gz'):
+    """Build a core.files.tar.gz from the core.db fixture, or another package
+    database, giving each package a small file list. It is written to
+    directory within a temporary directory removed again when testcase is
+    done."""
+    tmpdir = tempfile.mkdtemp()
+    testcase.addCleanup(shutil.rmtree, tmpdir)
+    directory = os.path.join(tmpdir, directory)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'core.files.tar.gz')
+    with tarfile.open(source) as db, \
+            tarfile.open(path, 'w:gz') as dest:
+        for member in db.getmembers():
+            dest.addfile(member, db.extractfile(member) if member.isreg() else None)
+            if member.isreg():
+                pkgid = os.path.dirname(member.name)
+                pkgname = os.path.basename(pkgid).rsplit('-', 2)[0]
+                paths = ['usr/', 'usr/bin/', f'usr/bin/{pkgname}', *extra_files]
+                data = '\n'.join(['%FILES%', *paths, '']).encode()
+                info = tarfile.TarInfo(f'{pkgid}/files')
+                info.size = len(data)
+                dest.addfile(info, io.BytesIO(data))
+    return path
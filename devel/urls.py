@@ -10,6 +10,7 @@
     path('mirrorauth/', views.tier0_mirror_auth, name='tier0-mirror-atuh'),
     path('', views.index, name='devel-index'),
     path('stats/', views.stats, name='devel-stats'),
+    path('imports/', views.imports, name='devel-imports'),
     path('newuser/', views.new_user_form),
     path('profile/', views.change_profile),
     re_path(r'^reports/(?P<report_name>.*)/(?P<username>.*)/pkgbases/$',
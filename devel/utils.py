@@ -1,18 +1,21 @@
+import hashlib
 import re
 import secrets
+import time
+from collections import defaultdict
+from contextlib import contextmanager
 
 from django.contrib.auth.models import User
-from django.core.exceptions import MultipleObjectsReturned, ObjectDoesNotExist
-from django.db import connection
-from django.db.models import Count, Q
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.db.models import Count, F
 
-from devel.models import UserProfile
+from devel.models import PackagerIdentity, UserProfile, packager_name_tokens, split_packager
 from main.models import Package
-from main.utils import cache_function
+from main.utils import cache_function, get_generations
 from packages.models import PackageRelation
 
 
-@cache_function(283)
+@cache_function(283, ['packages'])
 def get_annotated_maintainers():
     profile_ids = UserProfile.allowed_repos.through.objects.values('userprofile_id')
     maintainers = User.objects.filter(
@@ -51,63 +54,74 @@ def get_annotated_maintainers():
     return list(maintainers)
 
 
-def ignore_does_not_exist(func):
-    def new_func(*args, **kwargs):
-        try:
-            return func(*args, **kwargs)
-        except (ObjectDoesNotExist, MultipleObjectsReturned):
-            return None
-    return new_func
+def single(matches):
+    '''Returns the only item of matches, or None if there are none or several,
+    just like a failed get() would.'''
+    return matches[0] if len(matches) == 1 else None
 
 
 class UserFinder:
+    '''Matches packager strings, emails, usernames and PGP keys to users.
+    All users are loaded into an in-memory index with a single query the first
+    time it is needed, and packager strings are matched against that instead
+    of going to the database for every string. Matched packager strings are
+    stored as PackagerIdentity rows, so the next import, even in another
+    process, starts out knowing them. A long-lived process can keep the
+    index between imports with refresh(), which only drops it once users
+    changed.'''
     def __init__(self):
-        self.cache = {}
-        self.username_cache = {}
-        self.email_cache = {}
-        self.pgp_cache = {}
-
-    @staticmethod
-    @ignore_does_not_exist
-    def user_email(name, email):
+        self.clear_cache()
+
+    def _load(self):
+        if self.users is not None:
+            return
+        self.generation = get_generations('users')
+        self.users = list(User.objects.annotate(
+            public_email=F('userprofile__public_email'),
+            pgp_key=F('userprofile__pgp_key')).order_by('id'))
+        self.by_email = defaultdict(list)
+        self.by_public_email = defaultdict(list)
+        self.by_username = {}
+        for user in self.users:
+            if user.email:
+                self.by_email[user.email].append(user)
+            if user.public_email:
+                self.by_public_email[user.public_email].append(user)
+            self.by_username[user.username] = user
+
+        for identity in PackagerIdentity.objects.select_related('user'):
+            self.cache.setdefault(identity.packager, identity.user)
+
+    def user_email(self, name, email):
         if email:
-            return User.objects.get(email=email)
+            return single(self.by_email.get(email, []))
         return None
 
-    @staticmethod
-    @ignore_does_not_exist
-    def username_email(name, email):
+    def username_email(self, name, email):
         if email and '@' in email:
             # split email addr at '@' symbol, ensure domain matches
             # or is a subdomain of archlinux.org
             # TODO: configurable domain/regex somewhere?
             username, domain = email.split('@', 1)
             if re.match(r'^(.+\.)?archlinux.org$', domain):
-                return User.objects.get(username=username)
+                return self.by_username.get(username)
         return None
 
-    @staticmethod
-    @ignore_does_not_exist
-    def profile_email(name, email):
+    def profile_email(self, name, email):
         if email:
-            return User.objects.get(userprofile__public_email=email)
+            return single(self.by_public_email.get(email, []))
         return None
 
-    @staticmethod
-    @ignore_does_not_exist
-    def user_name(name, email):
+    def user_name(self, name, email):
         # yes, a bit odd but this is the easiest way since we can't always be
         # sure how to split the name. Ensure every 'token' appears in at least
         # one of the two name fields.
         if not name:
             return None
-        name_q = Q()
-        for token in name.split():
-            # ignore quoted parts; e.g. nicknames in strings
-            if re.match(r'^[\'"].*[\'"]$', token):
-                continue
-            name_q &= (Q(first_name__icontains=token) | Q(last_name__icontains=token))
-        return User.objects.get(name_q)
+        tokens = packager_name_tokens(name)
+        return single([user for user in self.users
+                       if all(token in user.first_name.lower() or token in user.last_name.lower()
+                              for token in tokens)])
 
     def find(self, userstring):
         '''
@@ -119,17 +133,11 @@ def find(self, userstring):
         '''
         if not userstring:
             return None
+        self._load()
         if userstring in self.cache:
             return self.cache[userstring]
 
-        name = email = None
-
-        matches = re.match(r'^([^<]+)? ?<([^>]*)>?', userstring)
-        if not matches:
-            name = userstring.strip()
-        else:
-            name = matches.group(1)
-            email = matches.group(2)
+        name, email = split_packager(userstring)
 
         user = None
         find_methods = (self.user_email, self.profile_email,
@@ -141,25 +149,26 @@ def find(self, userstring):
 
         self.cache[userstring] = user
         self.email_cache[email] = user
+        self._remember(userstring, user)
         return user
 
+    @staticmethod
+    def _remember(userstring, user):
+        if len(userstring) > PackagerIdentity._meta.get_field('packager').max_length:
+            return
+        PackagerIdentity.objects.bulk_create([PackagerIdentity(packager=userstring, user=user)],
+                                             ignore_conflicts=True)
+
     def find_by_username(self, username):
         if not username:
             return None
-        if username in self.username_cache:
-            return self.username_cache[username]
-
-        try:
-            user = User.objects.get(username=username)
-        except User.DoesNotExist:
-            user = None
-
-        self.username_cache[username] = user
-        return user
+        self._load()
+        return self.by_username.get(username)
 
     def find_by_email(self, email):
         if not email:
             return None
+        self._load()
         if email in self.email_cache:
             return self.email_cache[email]
 
@@ -175,26 +184,61 @@ def find_by_email(self, email):
     def find_by_pgp_key(self, pgp_key):
         if not pgp_key:
             return None
-        if pgp_key in self.pgp_cache:
-            return self.pgp_cache[pgp_key]
-
-        try:
-            user = User.objects.get(
-                userprofile__pgp_key__endswith=pgp_key)
-        except User.DoesNotExist:
-            user = None
-
-        self.pgp_cache[pgp_key] = user
-        return user
+        self._load()
+        return single([user for user in self.users
+                       if user.pgp_key and user.pgp_key.endswith(pgp_key)])
+
+    def refresh(self):
+        '''Drops the index if any user changed since it was loaded, as told by
+        the users generation. Without a cache shared with the processes
+        changing users, that is always assumed.'''
+        generation = get_generations('users')
+        if self.users is not None and generation != '0' and generation == self.generation:
+            return
+        self.clear_cache()
 
     def clear_cache(self):
+        self.generation = None
         self.cache = {}
-        self.username_cache = {}
         self.email_cache = {}
-        self.pgp_cache = {}
+        self.users = None
 
 
 def generate_repo_auth_token():
     return secrets.token_hex(16)
 
+
+def advisory_lock_key(name):
+    '''The signed 64 bit key of the PostgreSQL advisory lock with this name.'''
+    digest = hashlib.sha256(name.encode()).digest()
+    return int.from_bytes(digest[:8], 'big', signed=True)
+
+
+@contextmanager
+def advisory_lock(name, using=DEFAULT_DB_ALIAS):
+    '''
+    Holds the PostgreSQL advisory lock with this name, on a connection of its
+    own so closing the regular one does not release it. Yields the number of
+    seconds spent waiting for another session to release it first, or None
+    if it was free. Other databases have no such locks, there this yields
+    None right away.
+    '''
+    if connections[using].vendor != 'postgresql':
+        yield None
+        return
+    key = advisory_lock_key(name)
+    lock_connection = connections.create_connection(using)
+    try:
+        with lock_connection.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_lock(%s)', [key])
+            waited = None
+            if not cursor.fetchone()[0]:
+                start = time.perf_counter()
+                cursor.execute('SELECT pg_advisory_lock(%s)', [key])
+                waited = time.perf_counter() - start
+        yield waited
+    finally:
+        # closing the session releases the lock
+        lock_connection.close()
+
 # vim: set ts=4 sw=4 et:
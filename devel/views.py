@@ -24,7 +24,7 @@
 from django.utils.timezone import now
 from django.views.decorators.cache import cache_control, never_cache
 
-from main.models import Arch, Package, Repo
+from main.models import Arch, ImportRun, Package, Repo
 from main.utils import groupby_preserve_order
 from news.models import News
 from packages.models import FlagRequest, PackageRelation, Signoff
@@ -126,6 +126,14 @@ def stats(request):
     return render(request, 'devel/stats.html', page_dict)
 
 
+@login_required
+@user_passes_test(lambda u: u.is_staff)
+def imports(request):
+    """The most recent reporead runs and what they spent their time on."""
+    runs = ImportRun.objects.select_related('repo', 'arch')[:200]
+    return render(request, 'devel/imports.html', {'runs': runs})
+
+
 SELECTED_GROUPS = ['Developers', 'Package Maintainers', 'Support Staff']
 
 
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from main.models import Arch, Donor, Package, Repo
+from main.models import Arch, Donor, ImportRun, Package, Repo, RepoDatabase
 
 
 class DonorAdmin(admin.ModelAdmin):
@@ -29,10 +29,23 @@ class PackageAdmin(admin.ModelAdmin):
     date_hierarchy = 'build_date'
 
 
+class RepoDatabaseAdmin(admin.ModelAdmin):
+    list_display = ('repo', 'arch', 'kind', 'digest', 'last_import')
+    list_filter = ('kind', 'repo', 'arch')
+
+
+class ImportRunAdmin(admin.ModelAdmin):
+    list_display = ('repo', 'arch', 'started', 'status', 'duration', 'queries', 'files_only', 'forced')
+    list_filter = ('status', 'files_only', 'repo', 'arch')
+    date_hierarchy = 'started'
+
+
 admin.site.register(Donor, DonorAdmin)
 
 admin.site.register(Package, PackageAdmin)
 admin.site.register(Arch, ArchAdmin)
 admin.site.register(Repo, RepoAdmin)
+admin.site.register(RepoDatabase, RepoDatabaseAdmin)
+admin.site.register(ImportRun, ImportRunAdmin)
 
 # vim: set ts=4 sw=4 et:
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.14 on 2026-10-18 20:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_remove_repo_svn_root'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='package',
+            name='metadata_digest',
+            field=models.CharField(blank=True, help_text='SHA-256 of the desc/depends entries this package was imported from', max_length=64, null=True),
+        ),
+        migrations.CreateModel(
+            name='RepoDatabase',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(help_text='SHA-256 of the imported database file', max_length=64)),
+                ('last_import', models.DateTimeField()),
+                ('arch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='databases', to='main.arch')),
+                ('repo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='databases', to='main.repo')),
+            ],
+            options={
+                'db_table': 'repo_databases',
+                'unique_together': {('repo', 'arch')},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.14 on 2026-10-18 20:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_repodatabase_package_metadata_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(max_length=255)),
+                ('started', models.DateTimeField(db_index=True)),
+                ('duration', models.FloatField(help_text='Wall time in seconds')),
+                ('status', models.PositiveSmallIntegerField(choices=[(0, 'Imported'), (1, 'Skipped'), (2, 'Failed')], default=0)),
+                ('files_only', models.BooleanField(default=False)),
+                ('forced', models.BooleanField(default=False)),
+                ('queries', models.PositiveIntegerField(default=0)),
+                ('peak_memory', models.BigIntegerField(blank=True, help_text='Peak memory traced by tracemalloc, in bytes', null=True)),
+                ('report', models.JSONField(default=dict)),
+                ('arch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_runs', to='main.arch')),
+                ('repo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_runs', to='main.repo')),
+            ],
+            options={
+                'db_table': 'import_runs',
+                'ordering': ('-started',),
+                'get_latest_by': 'started',
+            },
+        ),
+    ]
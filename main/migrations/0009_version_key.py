@@ -0,0 +1,33 @@
+# Generated by Django 5.2.14 on 2026-10-18 21:32
+
+from django.db import migrations, models
+
+from packages.alpm import version_key
+
+
+def fill_version_keys(apps, schema_editor):
+    Package = apps.get_model('main', 'Package')
+    packages = list(Package.objects.only('epoch', 'pkgver', 'pkgrel'))
+    for pkg in packages:
+        pkg.version_key = version_key(f'{pkg.epoch}:{pkg.pkgver}-{pkg.pkgrel}')
+    Package.objects.bulk_update(packages, ['version_key'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_importrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='package',
+            name='version_key',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='package',
+            index=models.Index(fields=['version_key'], name='packages_version_key'),
+        ),
+        migrations.RunPython(fill_version_keys, migrations.RunPython.noop),
+    ]
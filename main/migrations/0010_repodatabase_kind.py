@@ -0,0 +1,26 @@
+# Generated by Django 5.2.14 on 2026-10-18 22:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_version_key'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='repodatabase',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='repodatabase',
+            name='kind',
+            field=models.CharField(choices=[('db', 'Package database'), ('files', 'Files database')], default='db', max_length=5),
+        ),
+        migrations.AlterUniqueTogether(
+            name='repodatabase',
+            unique_together={('repo', 'arch', 'kind')},
+        ),
+    ]
@@ -1,16 +1,17 @@
+from collections import defaultdict
 from datetime import datetime, timezone
 from itertools import groupby
 
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.db import models
-from django.db.models import Q
+from django.db.models import Case, Q, Value, When
 from pgpdump import BinaryData
 
 from devel.models import DeveloperKey
 from packages.alpm import AlpmAPI
 
-from .utils import DependStandin, SignatureWrapper, set_created_field
+from .utils import DependStandin, SignatureWrapper, set_created_field, set_version_key
 
 
 class PackageManager(models.Manager):
@@ -94,6 +95,8 @@ class Package(models.Model):
     pkgver = models.CharField(max_length=255)
     pkgrel = models.CharField(max_length=255)
     epoch = models.PositiveIntegerField(default=0)
+    # sorts like the full version, see packages.alpm.version_key()
+    version_key = models.TextField(default='', editable=False)
     pkgdesc = models.TextField('description', null=True)
     url = models.CharField('URL', max_length=255, null=True)
     filename = models.CharField(max_length=255)
@@ -107,6 +110,8 @@ class Package(models.Model):
     packager = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
     signature_bytes = models.BinaryField('PGP signature', null=True)
     flag_date = models.DateTimeField(null=True, blank=True)
+    metadata_digest = models.CharField(max_length=64, null=True, blank=True,
+                                       help_text="SHA-256 of the desc/depends entries this package was imported from")
 
     objects = PackageManager()
 
@@ -115,6 +120,7 @@ class Meta:
         ordering = ('pkgname',)
         get_latest_by = 'last_update'
         unique_together = (('pkgname', 'repo', 'arch'),)
+        indexes = [models.Index(fields=['version_key'], name='packages_version_key')]
 
     def __str__(self):
         return self.pkgname
@@ -198,49 +204,16 @@ def get_requiredby(self):
         list slim by including the corresponding package in the same testing
         category as this package if that check makes sense.
         """
-        from packages.models import Depend
-        sorttype = '''(CASE deptype
-        WHEN 'D' THEN 0
-        WHEN 'O' THEN 1
-        WHEN 'M' THEN 2
-        WHEN 'C' THEN 3
-        ELSE 1000 END)'''
-        name_clause = '''packages_depend.name IN (
-        SELECT %s UNION ALL
-        SELECT z.name FROM packages_provision z WHERE z.pkg_id = %s
-        )'''
-        requiredby = Depend.objects.select_related(
-            'pkg', 'pkg__arch', 'pkg__repo').extra(
-            select={'sorttype': sorttype},
-            where=[name_clause], params=[self.pkgname, self.id]).order_by(
-            'sorttype', 'pkg__pkgname',
-            'pkg__arch__name', 'pkg__repo__name')
-        if not self.arch.agnostic:
-            # make sure we match architectures if possible
-            requiredby = requiredby.filter(
-                pkg__arch__in=self.applicable_arches())
-
-        # if we can use ALPM, ensure our returned Depend objects abide by the
-        # version comparison operators they may specify
-        alpm = AlpmAPI()
-        if alpm.available:
-            provides = self.provides.all()
-            new_rqd = []
-            for dep in requiredby:
-                if not dep.comparison or not dep.version:
-                    # no comparison/version, so always let it through
-                    new_rqd.append(dep)
-                elif self.pkgname == dep.name:
-                    # depends on this package, so check it directly
-                    if alpm.compare_versions(self.full_version, dep.comparison, dep.version):
-                        new_rqd.append(dep)
-                else:
-                    # it must be a provision of ours at this point
-                    for provide in (p for p in provides if p.name == dep.name):
-                        if alpm.compare_versions(provide.version, dep.comparison, dep.version):
-                            new_rqd.append(dep)
-                            break
-            requiredby = new_rqd
+        from packages.models import ReverseDepend
+        sorttype = Case(*(When(deptype=deptype, then=Value(order))
+                          for order, deptype in enumerate('DOMC')),
+                        default=Value(1000))
+        # the index only holds packages that can be installed along with this
+        # one, and tells whether their version requirements are met
+        requiredby = ReverseDepend.objects.filter(
+            target=self, satisfied=True).select_related(
+            'pkg', 'pkg__arch', 'pkg__repo').order_by(
+            sorttype, 'pkg__pkgname', 'pkg__arch__name', 'pkg__repo__name')
 
         # sort out duplicate packages; this happens if something has a double
         # versioned depend such as a kernel module
@@ -262,8 +235,12 @@ def grouper(depend):
             else:
                 filtered.append(DependStandin(dep_pkgs))
 
-        # find another package by this name in a different testing or staging
-        # repo; if we can't, we can short-circuit some checks
+        # without a package listed twice there is nothing to trim, else find
+        # another package by this name in a different testing or staging repo;
+        # if we can't, we can short-circuit some checks
+        pkgnames = [dep.pkg.pkgname for dep in filtered]
+        if len(set(pkgnames)) == len(pkgnames):
+            return filtered
         repo_q = (Q(repo__testing=(not self.repo.testing)) | Q(repo__staging=(not self.repo.staging)))
         if not Package.objects.filter(
                 repo_q, pkgname=self.pkgname, arch=self.arch).exclude(id=self.id).exists():
@@ -295,15 +272,7 @@ def get_depends(self):
         providers.
         Packages will match the testing status of this package if possible.
         """
-        deps = []
-        # TODO: we can use list comprehension and an 'in' query to make this
-        # more effective
-        for dep in self.depends.all():
-            pkg = dep.get_best_satisfier()
-            providers = None
-            if not pkg:
-                providers = dep.get_providers()
-            deps.append({'dep': dep, 'pkg': pkg, 'providers': providers})
+        deps = self.resolve_related(self.depends.all(), providers=True)
         # sort the list; deptype sorting makes this tricker than expected
         sort_order = {'D': 0, 'O': 1, 'M': 2, 'C': 3}
 
@@ -312,6 +281,51 @@ def sort_key(val):
             return (sort_order.get(dep.deptype, 1000), dep.name)
         return sorted(deps, key=sort_key)
 
+    def resolve_related(self, related, providers=False):
+        """
+        Resolves depends, conflicts, provides or replaces of this package like
+        get_best_satisfier() and get_providers() do one at a time, with one
+        query for all satisfiers and, if providers is set, two for the
+        providers of the ones without a satisfier. Returns a list of dicts
+        like get_depends() does, in the order of related.
+        """
+        related = list(related)
+        if not related:
+            return []
+        pkgs = Package.objects.normal()
+        if not self.arch.agnostic:
+            # make sure we match architectures if possible
+            pkgs = pkgs.filter(arch__in=self.applicable_arches())
+
+        named = defaultdict(list)
+        for pkg in pkgs.filter(pkgname__in={rel.name for rel in related}):
+            named[pkg.pkgname].append(pkg)
+        resolved = []
+        for rel in related:
+            resolved.append({'dep': rel, 'pkg': rel.best_satisfier(named[rel.name]),
+                             'providers': None})
+
+        virtual = {item['dep'].name for item in resolved if item['pkg'] is None}
+        if providers and virtual:
+            providing = defaultdict(list)
+            for pkg in pkgs.filter(provides__name__in=virtual).order_by().distinct().prefetch_related(
+                    'provides'):
+                for name in {provide.name for provide in pkg.provides.all()} & virtual:
+                    providing[name].append(pkg)
+            for item in resolved:
+                if item['pkg'] is None:
+                    item['providers'] = item['dep'].best_providers(providing[item['dep'].name])
+        return resolved
+
+    def get_provides(self):
+        return self.resolve_related(self.provides.all())
+
+    def get_replaces(self):
+        return self.resolve_related(self.replaces.all())
+
+    def get_conflicts(self):
+        return self.resolve_related(self.conflicts.all())
+
     def reverse_conflicts(self):
         """
         Returns a list of packages with conflicts against this package.
@@ -339,25 +353,40 @@ def reverse_conflicts(self):
                     new_pkgs.append(package)
         return new_pkgs
 
+    _neighborhood = None
+
+    def neighborhood(self):
+        """
+        Loads every package sharing the name or pkgbase of this package, its
+        base package and the lib32 and multilib variants of its name in a
+        single query, which base_package(), split_packages(), in_testing(),
+        in_staging() and elsewhere() pick their results from. The packages are
+        kept on this instance, including this one itself.
+        """
+        if self._neighborhood is None:
+            names = [*self._elsewhere_names(), self.pkgbase]
+            self._neighborhood = list(Package.objects.normal().filter(
+                Q(pkgname__in=names) | Q(pkgbase=self.pkgbase)))
+        return self._neighborhood
+
     def base_package(self):
         """
         Locate the base package for this package. It may be this very package,
         or if it was built in a way that the base package isn't real, will
         return None.
         """
-        try:
-            # start by looking for something in this repo
-            return Package.objects.normal().get(
-                arch=self.arch, repo=self.repo, pkgname=self.pkgbase)
-        except Package.DoesNotExist:
-            # this package might be split across repos? find one
-            # that matches the correct [testing] repo flag
-            pkglist = Package.objects.normal().filter(
-                arch=self.arch, repo__testing=self.repo.testing,
-                repo__staging=self.repo.staging, pkgname=self.pkgbase)
-            if len(pkglist) > 0:
-                return pkglist[0]
-            return None
+        bases = [pkg for pkg in self.neighborhood()
+                 if pkg.pkgname == self.pkgbase and pkg.arch_id == self.arch_id]
+        # start by looking for something in this repo
+        for pkg in bases:
+            if pkg.repo_id == self.repo_id:
+                return pkg
+        # this package might be split across repos? find one
+        # that matches the correct [testing] repo flag
+        for pkg in bases:
+            if pkg.repo.testing == self.repo.testing and pkg.repo.staging == self.repo.staging:
+                return pkg
+        return None
 
     def split_packages(self):
         """
@@ -367,11 +396,11 @@ def split_packages(self):
         repo.testing and repo.staging flags. For any non-split packages, the
         return value will be an empty list.
         """
-        return Package.objects.normal().filter(
-            arch__in=self.applicable_arches(),
-            repo__testing=self.repo.testing,
-            repo__staging=self.repo.staging,
-            pkgbase=self.pkgbase).exclude(id=self.id)
+        arches = {self.arch_id}
+        arches.update(pkg.arch_id for pkg in self.neighborhood() if pkg.arch.agnostic)
+        flags = (self.repo.testing, self.repo.staging)
+        split = [pkg for pkg in self.neighborhood() if pkg.pkgbase == self.pkgbase and pkg.id != self.id]
+        return [pkg for pkg in split if pkg.arch_id in arches and (pkg.repo.testing, pkg.repo.staging) == flags]
 
     def flag_request(self):
         if self.flag_date is None:
@@ -400,26 +429,19 @@ def in_testing(self):
         a testing repo we will always return None.'''
         if self.repo.testing:
             return None
-        try:
-            return Package.objects.normal().get(
-                repo__testing=True, pkgname=self.pkgname, arch=self.arch)
-        except Package.DoesNotExist:
-            return None
+        return next((pkg for pkg in self._same_package() if pkg.repo.testing), None)
 
     def in_staging(self):
         '''attempt to locate this package in a staging repo; if we are in
         a staging repo we will always return None.'''
         if self.repo.staging:
             return None
-        try:
-            return Package.objects.normal().get(
-                repo__staging=True, pkgname=self.pkgname, arch=self.arch)
-        except Package.DoesNotExist:
-            return None
+        return next((pkg for pkg in self._same_package() if pkg.repo.staging), None)
 
-    def elsewhere(self):
-        '''attempt to locate this package anywhere else, regardless of
-        architecture or repository. Excludes this package from the list.'''
+    def _same_package(self):
+        return [pkg for pkg in self.neighborhood() if pkg.pkgname == self.pkgname and pkg.arch_id == self.arch_id]
+
+    def _elsewhere_names(self):
         names = [self.pkgname]
         if self.pkgname.startswith('lib32-'):
             names.append(self.pkgname[6:])
@@ -428,9 +450,73 @@ def elsewhere(self):
         else:
             names.append('lib32-' + self.pkgname)
             names.append(self.pkgname + '-multilib')
-        return Package.objects.normal().filter(
-            pkgname__in=names).exclude(id=self.id).order_by(
-            'arch__name', 'repo__name')
+        return names
+
+    def elsewhere(self):
+        '''attempt to locate this package anywhere else, regardless of
+        architecture or repository. Excludes this package from the list.'''
+        names = self._elsewhere_names()
+        others = [pkg for pkg in self.neighborhood() if pkg.pkgname in names and pkg.id != self.id]
+        return sorted(others, key=lambda pkg: (pkg.arch.name, pkg.repo.name))
+
+
+class RepoDatabase(models.Model):
+    '''The state of the last successful import of a repo database file of
+    either kind for a given repo and architecture, used by reporead to skip
+    unchanged files. Agnostic packages are listed in the database of every
+    architecture, so for an agnostic architecture the digest covers only
+    those packages.'''
+    PACKAGES = 'db'
+    FILES = 'files'
+    KIND_CHOICES = (
+        (PACKAGES, 'Package database'),
+        (FILES, 'Files database'),
+    )
+    repo = models.ForeignKey(Repo, related_name="databases", on_delete=models.CASCADE)
+    arch = models.ForeignKey(Arch, related_name="databases", on_delete=models.CASCADE)
+    kind = models.CharField(max_length=5, choices=KIND_CHOICES, default=PACKAGES)
+    digest = models.CharField(max_length=64, help_text="SHA-256 of the imported database file")
+    last_import = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.repo.name.lower()}.{self.kind} ({self.arch.name})'
+
+    class Meta:
+        db_table = 'repo_databases'
+        unique_together = (('repo', 'arch', 'kind'),)
+
+
+class ImportRun(models.Model):
+    '''One run of reporead on a repo database file, with the report of what
+    it spent its time on.'''
+    IMPORTED = 0
+    SKIPPED = 1
+    FAILED = 2
+    STATUS_CHOICES = (
+        (IMPORTED, 'Imported'),
+        (SKIPPED, 'Skipped'),
+        (FAILED, 'Failed'),
+    )
+    repo = models.ForeignKey(Repo, related_name="import_runs", on_delete=models.CASCADE)
+    arch = models.ForeignKey(Arch, related_name="import_runs", on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    started = models.DateTimeField(db_index=True)
+    duration = models.FloatField(help_text="Wall time in seconds")
+    status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES, default=IMPORTED)
+    files_only = models.BooleanField(default=False)
+    forced = models.BooleanField(default=False)
+    queries = models.PositiveIntegerField(default=0)
+    peak_memory = models.BigIntegerField(null=True, blank=True,
+                                         help_text="Peak memory traced by tracemalloc, in bytes")
+    report = models.JSONField(default=dict)
+
+    def __str__(self):
+        return f'{self.repo.name.lower()} ({self.arch.name}) at {self.started}'
+
+    class Meta:
+        db_table = 'import_runs'
+        ordering = ('-started',)
+        get_latest_by = 'started'
 
 
 class PackageFile(models.Model):
@@ -496,5 +582,7 @@ def __str__(self):
 # note: reporead sets the 'created' field on Package objects, so no signal
 # listener is set up here to do so
 pre_save.connect(set_created_field, sender=Donor, dispatch_uid="main.models")
+# reporead sets the version key itself when bulk saving packages
+pre_save.connect(set_version_key, sender=Package, dispatch_uid="main.models.version_key")
 
 # vim: set ts=4 sw=4 et:
@@ -0,0 +1,44 @@
+import pytest
+
+from main.utils import bump_generations, cache_function, get_generations
+from news.models import News
+
+
+@pytest.fixture
+def locmem_cache(settings):
+    settings.CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "generations",
+        }
+    }
+
+
+def test_generations(locmem_cache):
+    before = get_generations('packages', 'packages:core', 'packages:extra', 'news')
+    assert get_generations('packages', 'packages:core', 'packages:extra', 'news') == before
+
+    bump_generations('packages:core:x86_64')
+    after = get_generations('packages', 'packages:core', 'packages:extra', 'news')
+    changed = [old != new for old, new in zip(before.split('.'), after.split('.'), strict=True)]
+    assert changed == [True, True, False, False]
+
+
+def test_cache_function_generations(locmem_cache):
+    calls = []
+
+    @cache_function(3600, ['mirrors'])
+    def mirror_count():
+        calls.append(None)
+        return len(calls)
+
+    assert mirror_count() == 1
+    assert mirror_count() == 1
+    bump_generations('mirrors')
+    assert mirror_count() == 2
+
+
+def test_news_list_generation(locmem_cache, client, admin_user):
+    assert b'Generation news' not in client.get('/news/').content
+    News.objects.create(title='Generation news', content='text', author=admin_user, slug='generation-news')
+    assert b'Generation news' in client.get('/news/').content
@@ -1,6 +1,7 @@
 import hashlib
 import pickle
 import re
+import time
 from functools import WRAPPER_ASSIGNMENTS, wraps
 
 import markdown
@@ -13,6 +14,8 @@
 from markdown.extensions import Extension
 from pgpdump.packet import SignaturePacket
 
+from packages.alpm import version_key
+
 
 def cache_function_key(func, args, kwargs):
     raw = [func.__name__, func.__module__, args, kwargs]
@@ -21,7 +24,49 @@ def cache_function_key(func, args, kwargs):
     return 'cache_function.' + func.__name__ + '.' + key
 
 
-def cache_function(length):
+def generation_key(name):
+    return 'generation.' + name
+
+
+def get_generations(*names):
+    """
+    Returns the current generations of the named data, joined into a string
+    for use in cache keys. Everything cached under it goes stale as soon as
+    one of them is bumped with bump_generations().
+
+    A generation starts out at the current time in nanoseconds, so one that
+    got evicted from the cache does not start over at a value it had before.
+    """
+    keys = [generation_key(name) for name in names]
+    values = cache.get_many(keys)
+    missing = [key for key in keys if key not in values]
+    if missing:
+        for key in missing:
+            # another process may have been faster, add() keeps its value
+            cache.add(key, time.time_ns(), None)
+        values.update(cache.get_many(missing))
+    return '.'.join(str(values.get(key, 0)) for key in keys)
+
+
+def bump_generations(*names):
+    """
+    Bumps the generations of the named data after it changed. Names are
+    hierarchical: bumping 'packages:core:x86_64' also bumps 'packages:core'
+    and 'packages', so caches can depend on as much of the data as they
+    show.
+    """
+    keys = set()
+    for name in names:
+        parts = name.split(':')
+        keys.update(generation_key(':'.join(parts[:i])) for i in range(1, len(parts) + 1))
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), None)
+
+
+def cache_function(length, generations=()):
     """
     A variant of the snippet posted by Jeff Wheeler at
     http://www.djangosnippets.org/snippets/109/
@@ -31,11 +76,14 @@ def cache_function(length):
     function, as it should.
 
     The decorator itself takes a length argument, which is the number of
-    seconds the cache will keep the result around.
+    seconds the cache will keep the result around, and optionally the names
+    of the generations (see get_generations()) the result depends on.
     """
     def decorator(func):
         def inner_func(*args, **kwargs):
             key = cache_function_key(func, args, kwargs)
+            if generations:
+                key += '.' + get_generations(*generations)
             value = cache.get(key)
             if value is not None:
                 return value
@@ -64,17 +112,33 @@ def empty_response():
 make_choice = lambda l: [(str(m), str(m)) for m in l]   # noqa E741
 
 
-def cache_user_page(timeout):
-    '''Cache the page only for non-logged in users'''
+def cache_user_page(timeout, generations=()):
+    '''Cache the page only for non-logged in users, until the given
+    generations are bumped if any'''
 
     def decorator(view_func):
         @wraps(view_func, assigned=WRAPPER_ASSIGNMENTS)
         def _wrapped_view(request, *args, **kwargs):
             if request.user.is_authenticated:
                 return view_func(request, *args, **kwargs)
-            result = cache_page(
-                timeout,
-                key_prefix=(f"_auth_{request.user.is_authenticated}_"))
+            key_prefix = f"_auth_{request.user.is_authenticated}_"
+            if generations:
+                key_prefix += get_generations(*generations)
+            result = cache_page(timeout, key_prefix=key_prefix)
+            return result(view_func)(request, *args, **kwargs)
+        return _wrapped_view
+    return decorator
+
+
+def cache_generation_page(timeout, generations):
+    '''Cache the page like cache_page, until the given generations are
+    bumped'''
+
+    def decorator(view_func):
+        @wraps(view_func, assigned=WRAPPER_ASSIGNMENTS)
+        def _wrapped_view(request, *args, **kwargs):
+            key_prefix = f"_generation_{get_generations(*generations)}"
+            result = cache_page(timeout, key_prefix=key_prefix)
             return result(view_func)(request, *args, **kwargs)
         return _wrapped_view
     return decorator
@@ -94,6 +158,26 @@ def set_created_field(sender, **kwargs):
         obj.last_modified = time
 
 
+def set_version_key(sender, **kwargs):
+    '''This will set the 'version_key' field on any object from its 'epoch',
+    'pkgver' and 'pkgrel' fields, and likewise the 'old_version_key' and
+    'new_version_key' fields from the old and new version fields. Versions
+    without a pkgver get an empty key, or none if the field is nullable.
+    For use as a pre_save signal handler.'''
+    obj = kwargs['instance']
+    for prefix in ('', 'old_', 'new_'):
+        if not hasattr(obj, f'{prefix}version_key'):
+            continue
+        pkgver = getattr(obj, f'{prefix}pkgver')
+        if pkgver:
+            epoch = getattr(obj, f'{prefix}epoch') or 0
+            pkgrel = getattr(obj, f'{prefix}pkgrel')
+            key = version_key(f'{epoch}:{pkgver}-{pkgrel}')
+        else:
+            key = None if obj._meta.get_field(f'{prefix}version_key').null else ''
+        setattr(obj, f'{prefix}version_key', key)
+
+
 def find_unique_slug(model, title):
     '''Attempt to find a unique slug for this model with given title.'''
     existing = set(model.objects.values_list(
@@ -190,7 +274,6 @@ def __init__(self, depends):
         self.name = first.name
         self.version = first.version
         self.comparison = first.comparison
-        self.description = first.description
         self.deptype = first.deptype
         self.pkg = first.pkg.base_package() or PackageStandin(first.pkg)
 
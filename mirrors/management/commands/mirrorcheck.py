@@ -28,6 +28,7 @@
 from django.db import transaction
 from django.utils.timezone import now
 
+from main.utils import bump_generations
 from mirrors.models import CheckLocation, MirrorLog, MirrorUrl
 
 logger = logging.getLogger("command")
@@ -76,6 +77,7 @@ def handle(self, **options):
 
         pool = MirrorCheckPool(urls, location, timeout)
         pool.run()
+        bump_generations('mirrors')
         pool.cleanup()
         return 0
 
@@ -5,10 +5,10 @@
 from django.contrib.sites.models import Site
 from django.core.exceptions import ValidationError
 from django.db import models
-from django.db.models.signals import pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django_countries.fields import CountryField
 
-from main.utils import set_created_field
+from main.utils import bump_generations, set_created_field
 
 from .fields import IPNetworkField
 
@@ -190,7 +190,14 @@ class Meta:
         get_latest_by = 'check_time'
 
 
+def bump_mirrors_generation(sender, **kwargs):
+    bump_generations('mirrors')
+
+
 for model in (Mirror, MirrorProtocol, MirrorUrl, MirrorRsync, CheckLocation):
     pre_save.connect(set_created_field, sender=model, dispatch_uid="mirrors.models")
+for model in (Mirror, MirrorProtocol, MirrorUrl, MirrorRsync):
+    post_save.connect(bump_mirrors_generation, sender=model, dispatch_uid="mirrors.models")
+    post_delete.connect(bump_mirrors_generation, sender=model, dispatch_uid="mirrors.models")
 
 # vim: set ts=4 sw=4 et:
@@ -1,5 +1,6 @@
 from django.urls import path, re_path
-from django.views.decorators.cache import cache_page
+
+from main.utils import cache_generation_page
 
 from .views import mirror_details, mirrors, status, url_details
 from .views.api import locations_json, mirror_details_json, status_json
@@ -11,7 +12,7 @@
     path('status/json/', status_json, name='mirror-status-json'),
     re_path(r'^status/tier/(?P<tier>\d+)/$', status, name='mirror-status-tier'),
     re_path(r'^status/tier/(?P<tier>\d+)/json/$', status_json, name='mirror-status-tier-json'),
-    path('locations/json/', cache_page(317)(locations_json), name='mirror-locations-json'),
+    path('locations/json/', cache_generation_page(317, ['mirrors'])(locations_json), name='mirror-locations-json'),
     re_path(r'^(?P<name>[\.\-\w]+)/$', mirror_details),
     re_path(r'^(?P<name>[\.\-\w]+)/json/$', mirror_details_json),
     re_path(r'^(?P<name>[\.\-\w]+)/(?P<url_id>\d+)/$', url_details),
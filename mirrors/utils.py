@@ -113,7 +113,7 @@ def annotate_url(url, url_data):
     return url
 
 
-@cache_function(178)
+@cache_function(178, ['mirrors'])
 def get_mirror_statuses(cutoff=DEFAULT_CUTOFF, mirror_id=None, show_all=False):
     cutoff_time = now() - cutoff
 
@@ -177,7 +177,7 @@ def get_mirror_errors(cutoff=DEFAULT_CUTOFF, mirror_id=None, show_all=False):
     return errors
 
 
-@cache_function(295)
+@cache_function(295, ['mirrors'])
 def get_mirror_url_for_download(cutoff=DEFAULT_CUTOFF):
     '''Find a good mirror URL to use for package downloads. If we have mirror
     status data available, it is used to determine a good choice by looking at
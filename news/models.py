@@ -1,11 +1,11 @@
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.db import models
-from django.db.models.signals import pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.utils.safestring import mark_safe
 from django.utils.timezone import now
 
-from main.utils import parse_markdown
+from main.utils import bump_generations, parse_markdown
 
 
 class News(models.Model):
@@ -46,6 +46,12 @@ def set_news_fields(sender, **kwargs):
         news.guid = f"tag:{Site.objects.get_current()},{current_time.strftime('%Y-%m-%d')}:{news.get_absolute_url()}"
 
 
+def bump_news_generation(sender, **kwargs):
+    bump_generations('news')
+
+
 pre_save.connect(set_news_fields, sender=News, dispatch_uid="news.models")
+post_save.connect(bump_news_generation, sender=News, dispatch_uid="news.models")
+post_delete.connect(bump_news_generation, sender=News, dispatch_uid="news.models")
 
 # vim: set ts=4 sw=4 et:
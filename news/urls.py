@@ -14,7 +14,7 @@
 )
 
 urlpatterns = [
-    path('', cache_user_page(317)(NewsListView.as_view()), name='news-list'),
+    path('', cache_user_page(317, ['news'])(NewsListView.as_view()), name='news-list'),
 
     path('preview/', preview),
     # old news URLs, permanent redirect view so we don't break all links
@@ -23,7 +23,7 @@
     path('add/',
          permission_required('news.add_news')(NewsCreateView.as_view())),
     re_path(r'^(?P<slug>[-\w]+)/$',
-            cache_user_page(317)(NewsDetailView.as_view())),
+            cache_user_page(317, ['news'])(NewsDetailView.as_view())),
     re_path(r'^(?P<slug>[-\w]+)/edit/$',
             permission_required('news.change_news')(NewsEditView.as_view())),
     re_path(r'^(?P<slug>[-\w]+)/delete/$',
@@ -1,6 +1,8 @@
 import ctypes
 import operator
+import timeit
 from ctypes.util import find_library
+from functools import lru_cache
 
 
 def load_alpm(name=None):  # pragma: no cover
@@ -27,6 +29,186 @@ def load_alpm(name=None):  # pragma: no cover
 
 ALPM = load_alpm()
 
+# comparisons and parsed versions kept around, the same few thousand versions
+# get compared over and over when resolving depends
+VERCMP_CACHE_SIZE = 65536
+
+
+def _isdigit(char):
+    return 48 <= char <= 57
+
+
+def _isalpha(char):
+    return 65 <= char <= 90 or 97 <= char <= 122
+
+
+def _isalnum(char):
+    return _isdigit(char) or _isalpha(char)
+
+
+def rpmvercmp(a, b):
+    '''
+    Compares two version strings given as bytes, returning -1, 0 or 1. A line
+    by line port of rpmvercmp() in pacman's lib/libalpm/version.c, including
+    its handling of separators and of alpha against numeric segments. Only
+    ASCII letters and digits count as such, like in the C locale.
+    '''
+    if a == b:
+        return 0
+    len1, len2 = len(a), len(b)
+    one = ptr1 = two = ptr2 = 0
+
+    while one < len1 and two < len2:
+        while one < len1 and not _isalnum(a[one]):
+            one += 1
+        while two < len2 and not _isalnum(b[two]):
+            two += 1
+
+        # ran to the end of either, we are finished with the loop
+        if not (one < len1 and two < len2):
+            break
+
+        # different separator lengths decide it
+        if one - ptr1 != two - ptr2:
+            return -1 if one - ptr1 < two - ptr2 else 1
+
+        ptr1, ptr2 = one, two
+
+        # grab the first completely alpha or completely numeric segment,
+        # the type of which is decided by the first string
+        isnum = _isdigit(a[ptr1])
+        isseg = _isdigit if isnum else _isalpha
+        while ptr1 < len1 and isseg(a[ptr1]):
+            ptr1 += 1
+        while ptr2 < len2 and isseg(b[ptr2]):
+            ptr2 += 1
+
+        # the segments are of different types, numeric ones are newer
+        if two == ptr2:
+            return 1 if isnum else -1
+
+        seg1, seg2 = a[one:ptr1], b[two:ptr2]
+        if isnum:
+            # whichever number has more digits wins
+            seg1, seg2 = seg1.lstrip(b'0'), seg2.lstrip(b'0')
+            if len(seg1) != len(seg2):
+                return 1 if len(seg1) > len(seg2) else -1
+        if seg1 != seg2:
+            return 1 if seg1 > seg2 else -1
+
+        one, two = ptr1, ptr2
+
+    # all segments compared identically but the separators were different
+    if one >= len1 and two >= len2:
+        return 0
+
+    # a remaining alpha string never beats an empty one
+    if (one >= len1 and not _isalpha(b[two])) or (one < len1 and _isalpha(a[one])):
+        return -1
+    return 1
+
+
+@lru_cache(maxsize=VERCMP_CACHE_SIZE)
+def parse_evr(evr):
+    '''
+    Splits a version into its epoch, version and release, the last of which
+    is None if there is no release, like parseEVR() in pacman.
+    '''
+    evr = evr.encode()
+    end = 0
+    while end < len(evr) and _isdigit(evr[end]):
+        end += 1
+    release_start = evr.rfind(b'-', end)
+    if evr[end:end + 1] == b':':
+        epoch = evr[:end] or b'0'
+        version_start = end + 1
+    else:
+        epoch = b'0'
+        version_start = 0
+    if release_start == -1:
+        return epoch, evr[version_start:], None
+    return epoch, evr[version_start:release_start], evr[release_start + 1:]
+
+
+def evr_vercmp(evr1, evr2):
+    '''Compares two versions already split by parse_evr().'''
+    epoch1, version1, release1 = evr1
+    epoch2, version2, release2 = evr2
+    ret = rpmvercmp(epoch1, epoch2)
+    if ret == 0:
+        ret = rpmvercmp(version1, version2)
+        if ret == 0 and release1 is not None and release2 is not None:
+            ret = rpmvercmp(release1, release2)
+    return ret
+
+
+@lru_cache(maxsize=VERCMP_CACHE_SIZE)
+def vercmp(ver1, ver2):
+    '''
+    Compares two package versions, returning -1, 0 or 1 exactly like
+    alpm_pkg_vercmp(), without needing libalpm.
+    '''
+    ver1, ver2 = str(ver1), str(ver2)
+    if ver1 == ver2:
+        return 0
+    return evr_vercmp(parse_evr(ver1), parse_evr(ver2))
+
+
+# lead bytes of the segments in a version key; a version ending sorts after an
+# alpha segment directly following the previous one, like the 'rc' in
+# '1.0rc', but before anything else
+KEY_ALPHA = b'\x10'
+KEY_END = b'\x20'
+KEY_DIGIT = b'\x30'
+KEY_SEPARATED = b'\x40'
+
+
+def _key_number(digits):
+    # longer numbers are larger, with the length prefixed by its own length
+    digits = digits.lstrip(b'0')
+    length = str(len(digits)).encode()
+    return bytes((len(length),)) + length + digits
+
+
+def _key_segments(part):
+    key = []
+    pos, end = 0, len(part)
+    while True:
+        start = pos
+        while pos < end and not _isalnum(part[pos]):
+            pos += 1
+        if pos == end:
+            # trailing separators are ignored
+            key.append(KEY_END)
+            return b''.join(key)
+        separators = pos - start
+        isnum = _isdigit(part[pos])
+        isseg = _isdigit if isnum else _isalpha
+        start = pos
+        while pos < end and isseg(part[pos]):
+            pos += 1
+        if separators:
+            key.append(KEY_SEPARATED + _key_number(str(separators).encode()) + (b'n' if isnum else b'a'))
+        else:
+            key.append(KEY_DIGIT if isnum else KEY_ALPHA)
+        key.append(_key_number(part[start:pos]) if isnum else part[start:pos] + b'\x01')
+
+
+@lru_cache(maxsize=VERCMP_CACHE_SIZE)
+def version_key(version):
+    '''
+    Returns a string of hex digits for the version which sorts like the
+    version does with vercmp(), so versions can be compared and ordered by
+    the database whatever the collation. Versions without a release give the key all
+    releases of the version start with. Unlike vercmp(), trailing separators
+    are ignored, which includes versions made only of separators:
+    vercmp('_b2.', '__') == -1, but their keys compare the other way. vercmp()
+    is not transitive for such versions ('1a1' < '1a.b' < '1a_' < '1a1'), so
+    no key could follow it there. Leading separators are compared like
+    vercmp() does.
+    '''
+    return b''.join(_key_segments(part) for part in parse_evr(str(version)) if part is not None).hex()
+
 
 class AlpmAPI:
     OPERATOR_MAP = {
@@ -41,33 +223,86 @@ class AlpmAPI:
 
     def __init__(self):
         self.alpm = ALPM
-        self.available = ALPM is not None
+        # versions are compared in Python, libalpm is optional
+        self.available = True
 
     def version(self):
-        if not self.available:
+        '''The version of the loaded libalpm, if any.'''
+        if not self.available or self.alpm is None:
             return None
-        return ALPM.alpm_version()
+        return self.alpm.alpm_version()
 
     def vercmp(self, ver1, ver2):
         if not self.available:
             return None
-        return ALPM.alpm_pkg_vercmp(str(ver1).encode(), str(ver2).encode())
+        return vercmp(ver1, ver2)
 
-    def compare_versions(self, ver1, oper, ver2):
+    def operator(self, oper):
         func = self.OPERATOR_MAP.get(oper, None)
         if func is None:
             raise Exception("Invalid operator %s specified" % oper)
+        return func
+
+    def compare_versions(self, ver1, oper, ver2):
+        func = self.operator(oper)
         if not self.available:
             return None
         res = self.vercmp(ver1, ver2)
         return func(res, 0)
 
+    def compare_constraints(self, ver1, constraints):
+        '''
+        Checks one version against many (operator, version) constraints,
+        returning a list of the results in the same order.
+        '''
+        constraints = [(self.operator(oper), ver2) for oper, ver2 in constraints]
+        if not self.available:
+            return [None] * len(constraints)
+        return [func(vercmp(ver1, ver2), 0) for func, ver2 in constraints]
+
+    def compare_many(self, versions, oper, ver2):
+        '''
+        Checks many versions against a single operator and version, returning
+        a list of the results in the same order.
+        '''
+        func = self.operator(oper)
+        versions = list(versions)
+        if not self.available:
+            return [None] * len(versions)
+        return [func(vercmp(ver1, ver2), 0) for ver1 in versions]
+
+
+def libalpm_vercmp(ver1, ver2):
+    '''Compares two versions with libalpm, None if it is not loaded.'''
+    if ALPM is None:
+        return None
+    return ALPM.alpm_pkg_vercmp(str(ver1).encode(), str(ver2).encode())
+
+
+def benchmark(number=100000):  # pragma: no cover
+    '''Prints the time per comparison of the implementations.'''
+    pairs = [('1:2.38-1', '2.38-2'), ('6.1.12.arch1-1', '6.1.9.arch2-1'),
+             ('1.0rc1-1', '1.0-1'), ('2.0_a', '2_0.a')]
+    api = AlpmAPI()
+    versions = [ver1 for ver1, _ in pairs]
+    timings = [
+        ('python, uncached', lambda: [rpmvercmp(*(v.encode() for v in pair)) for pair in pairs]),
+        ('python, cached', lambda: [vercmp(*pair) for pair in pairs]),
+        ('batch, cached', lambda: api.compare_many(versions, '>=', '2.0')),
+    ]
+    if ALPM is not None:
+        timings.append(('libalpm', lambda: [libalpm_vercmp(*pair) for pair in pairs]))
+    for name, func in timings:
+        seconds = timeit.timeit(func, number=number)
+        print(f'{name}: {seconds / number / len(pairs) * 1e9:.0f} ns per comparison')
+
 
 def main():  # pragma: no cover
     api = AlpmAPI()
     print(api.version())
     print(api.vercmp(1, 2))
     print(api.compare_versions(1, '<', 2))
+    benchmark()
 
 
 if __name__ == '__main__':  # pragma: no cover
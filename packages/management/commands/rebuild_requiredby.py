@@ -0,0 +1,36 @@
+"""
+rebuild_requiredby command
+
+Recomputes the reverse depends of all packages, which reporead otherwise keeps
+up to date for the packages it imports. Needed after anything changed depends
+or provisions behind reporead's back; packages left stale by a failed refresh
+after an import are taken care of too.
+
+Usage: ./manage.py rebuild_requiredby
+"""
+
+import logging
+
+from django.core.management.base import BaseCommand
+
+from ...models import ReverseDepend
+
+logger = logging.getLogger("command")
+
+
+class Command(BaseCommand):
+    help = "Recompute the reverse depends used for the required by lists of all packages."
+
+    def handle(self, **options):
+        v = int(options.get('verbosity', None))
+        if v == 0:
+            logger.level = logging.ERROR
+        elif v == 1:
+            logger.level = logging.INFO
+        elif v >= 2:
+            logger.level = logging.DEBUG
+
+        count = ReverseDepend.objects.rebuild()
+        logger.info('Rebuilt %d reverse depends', count)
+
+# vim: set ts=4 sw=4 et:
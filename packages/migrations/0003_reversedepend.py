@@ -0,0 +1,76 @@
+# Generated by Django 5.2.14 on 2026-10-18 21:24
+
+import operator
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from packages.alpm import vercmp
+
+OPERATORS = {
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+def fill_reverse_depends(apps, schema_editor):
+    # the same as ReverseDepend.objects.rebuild() when this table was created
+    Depend = apps.get_model('packages', 'Depend')
+    Package = apps.get_model('main', 'Package')
+    Provision = apps.get_model('packages', 'Provision')
+    ReverseDepend = apps.get_model('packages', 'ReverseDepend')
+
+    targets = defaultdict(list)
+    for target_id, arch_id, agnostic, pkgname, epoch, pkgver, pkgrel in Package.objects.values_list(
+            'id', 'arch_id', 'arch__agnostic', 'pkgname', 'epoch', 'pkgver', 'pkgrel'):
+        version = f'{epoch}:{pkgver}-{pkgrel}' if epoch > 0 else f'{pkgver}-{pkgrel}'
+        targets[pkgname].append((target_id, arch_id, agnostic, version, False))
+    for target_id, arch_id, agnostic, name, version in Provision.objects.values_list(
+            'pkg_id', 'pkg__arch_id', 'pkg__arch__agnostic', 'name', 'version'):
+        targets[name].append((target_id, arch_id, agnostic, version, True))
+
+    rows = []
+    for pkg_id, arch_id, agnostic, name, comparison, version, deptype in Depend.objects.values_list(
+            'pkg_id', 'pkg__arch_id', 'pkg__arch__agnostic', 'name', 'comparison', 'version', 'deptype'):
+        for target_id, target_arch_id, target_agnostic, target_version, provision in targets[name]:
+            if not (agnostic or target_agnostic or arch_id == target_arch_id):
+                continue
+            satisfied = True
+            if comparison and version:
+                satisfied = OPERATORS[comparison](vercmp(target_version, version), 0)
+            rows.append(ReverseDepend(pkg_id=pkg_id, target_id=target_id, name=name,
+                                      comparison=comparison, version=version, deptype=deptype,
+                                      provision=provision, satisfied=satisfied))
+    ReverseDepend.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_importrun'),
+        ('packages', '0002_flagdenylist'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReverseDepend',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('comparison', models.CharField(default='', max_length=255)),
+                ('version', models.CharField(default='', max_length=255)),
+                ('deptype', models.CharField(choices=[('D', 'Depend'), ('O', 'Optional Depend'), ('M', 'Make Depend'), ('C', 'Check Depend')], default='D', max_length=1)),
+                ('provision', models.BooleanField(default=False)),
+                ('satisfied', models.BooleanField(default=True)),
+                ('pkg', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.package')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reverse_depends', to='main.package')),
+            ],
+        ),
+        migrations.RunPython(fill_reverse_depends, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.14 on 2026-10-18 21:32
+
+from django.db import migrations, models
+
+from packages.alpm import version_key
+
+
+def fill_version_keys(apps, schema_editor):
+    for model, prefixes in (('FlagRequest', ('',)), ('Signoff', ('',)), ('Update', ('old_', 'new_'))):
+        Model = apps.get_model('packages', model)
+        fields = [f'{prefix}version_key' for prefix in prefixes]
+        batch = []
+        for obj in Model.objects.iterator(chunk_size=1000):
+            for prefix in prefixes:
+                pkgver = getattr(obj, f'{prefix}pkgver')
+                if pkgver:
+                    epoch = getattr(obj, f'{prefix}epoch') or 0
+                    pkgrel = getattr(obj, f'{prefix}pkgrel')
+                    setattr(obj, f'{prefix}version_key', version_key(f'{epoch}:{pkgver}-{pkgrel}'))
+            batch.append(obj)
+            if len(batch) >= 1000:
+                Model.objects.bulk_update(batch, fields)
+                batch = []
+        Model.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('packages', '0003_reversedepend'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flagrequest',
+            name='version_key',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='signoff',
+            name='version_key',
+            field=models.TextField(default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='update',
+            name='new_version_key',
+            field=models.TextField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='update',
+            name='old_version_key',
+            field=models.TextField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_version_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.14 on 2026-10-18 22:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_repodatabase_kind'),
+        ('packages', '0004_version_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaleReverseDepend',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pkg', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.package')),
+            ],
+        ),
+    ]
@@ -1,12 +1,15 @@
-from collections import namedtuple
+from collections import defaultdict, namedtuple
+from itertools import batched
 
 from django.contrib.admin.models import ADDITION, CHANGE, DELETION
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models.signals import pre_save
+from django.db import models, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_save
 
+from devel.signals import packages_changed
 from main.models import Arch, Package, Repo
-from main.utils import database_vendor, set_created_field
+from main.utils import bump_generations, database_vendor, set_created_field, set_version_key
 from packages.alpm import AlpmAPI
 
 
@@ -146,6 +149,7 @@ class Signoff(models.Model):
     pkgver = models.CharField(max_length=255)
     pkgrel = models.CharField(max_length=255)
     epoch = models.PositiveIntegerField(default=0)
+    version_key = models.TextField(default='', editable=False)
     arch = models.ForeignKey(Arch, on_delete=models.CASCADE)
     repo = models.ForeignKey(Repo, on_delete=models.CASCADE)
     user = models.ForeignKey(User, related_name="package_signoffs", on_delete=models.CASCADE)
@@ -186,6 +190,7 @@ class FlagRequest(models.Model):
     pkgver = models.CharField(max_length=255)
     pkgrel = models.CharField(max_length=255)
     epoch = models.PositiveIntegerField(default=0)
+    version_key = models.TextField(default='', editable=False)
     repo = models.ForeignKey(Repo, on_delete=models.CASCADE)
     num_packages = models.PositiveIntegerField('number of packages', default=1)
     message = models.TextField('message to developer', blank=True)
@@ -241,6 +246,29 @@ def log_update(self, old_pkg, new_pkg):
         if database_vendor(Package, 'write') in ('sqlite', 'postgresql'):
             # we log updates using database triggers for these backends
             return
+        update = self._build_update(old_pkg, new_pkg)
+        if update is None:
+            return
+        update.save(force_insert=True)
+        return update
+
+    def log_updates(self, pairs):
+        '''Bulk variant of log_update(), taking an iterable of (old_pkg,
+        new_pkg) tuples and inserting all resulting rows at once.'''
+        if database_vendor(Package, 'write') in ('sqlite', 'postgresql'):
+            # we log updates using database triggers for these backends
+            return []
+        updates = []
+        for old_pkg, new_pkg in pairs:
+            update = self._build_update(old_pkg, new_pkg)
+            if update is not None:
+                # bulk_create() does not send the pre_save signal
+                set_created_field(Update, instance=update)
+                set_version_key(Update, instance=update)
+                updates.append(update)
+        return self.bulk_create(updates)
+
+    def _build_update(self, old_pkg, new_pkg):
         update = Update()
         if new_pkg:
             update.action_flag = ADDITION
@@ -259,7 +287,7 @@ def log_update(self, old_pkg, new_pkg):
                 if old_pkg.pkgver == new_pkg.pkgver and old_pkg.pkgrel == new_pkg.pkgrel \
                    and old_pkg.epoch == new_pkg.epoch:
                     # all relevant fields were the same; e.g. a force update
-                    return
+                    return None
             else:
                 update.action_flag = DELETION
                 update.arch = old_pkg.arch
@@ -270,8 +298,6 @@ def log_update(self, old_pkg, new_pkg):
             update.old_pkgver = old_pkg.pkgver
             update.old_pkgrel = old_pkg.pkgrel
             update.old_epoch = old_pkg.epoch
-
-        update.save(force_insert=True)
         return update
 
 
@@ -294,10 +320,12 @@ class Update(models.Model):
     old_pkgver = models.CharField(max_length=255, null=True)
     old_pkgrel = models.CharField(max_length=255, null=True)
     old_epoch = models.PositiveIntegerField(null=True)
+    old_version_key = models.TextField(null=True, editable=False)
 
     new_pkgver = models.CharField(max_length=255, null=True)
     new_pkgrel = models.CharField(max_length=255, null=True)
     new_epoch = models.PositiveIntegerField(null=True)
+    new_version_key = models.TextField(null=True, editable=False)
 
     objects = UpdateManager()
 
@@ -395,12 +423,18 @@ def get_best_satisfier(self):
             # make sure we match architectures if possible
             arches = self.pkg.applicable_arches()
             pkgs = pkgs.filter(arch__in=arches)
+        return self.best_satisfier(pkgs)
+
+    def best_satisfier(self, pkgs):
+        '''Picks the best satisfier out of the given packages named like this
+        related package, see get_best_satisfier().'''
         # if we have a comparison operation, make sure the packages we grab
         # actually satisfy the requirements
-        if self.comparison and self.version:
-            alpm = AlpmAPI()
-            pkgs = [pkg for pkg in pkgs if not alpm.available or alpm.compare_versions(pkg.full_version,
-                                                                                       self.comparison, self.version)]
+        alpm = AlpmAPI()
+        if alpm.available and self.comparison and self.version:
+            pkgs = list(pkgs)
+            matches = alpm.compare_many([pkg.full_version for pkg in pkgs], self.comparison, self.version)
+            pkgs = [pkg for pkg, match in zip(pkgs, matches, strict=True) if match]
         if len(pkgs) == 0:
             # couldn't find a package in the DB
             # it should be a virtual depend (or a removed package)
@@ -431,12 +465,18 @@ def get_providers(self):
             # make sure we match architectures if possible
             arches = self.pkg.applicable_arches()
             pkgs = pkgs.filter(arch__in=arches)
+        if self.comparison and self.version:
+            pkgs = pkgs.prefetch_related('provides')
+        return self.best_providers(pkgs)
 
+    def best_providers(self, pkgs):
+        '''Filters and sorts the given packages providing this related package,
+        see get_providers(). Their provides have to be prefetched if this
+        has a version requirement.'''
         # If we have a comparison operation, make sure the packages we grab
         # actually satisfy the requirements.
         alpm = AlpmAPI()
         if alpm.available and self.comparison and self.version:
-            pkgs = pkgs.prefetch_related('provides')
             new_pkgs = []
             for package in pkgs:
                 for provide in package.provides.all():
@@ -504,9 +544,162 @@ class Replacement(RelatedToBase):
     comparison = models.CharField(max_length=255, default='')
 
 
+# ids or names per IN (...) lookup, well below the 999 variables older SQLite
+# versions allow in a query
+IN_CHUNK_SIZE = 500
+
+
+def filter_in(queryset, lookup, values):
+    '''Yields the results of queryset filtered by an IN lookup on values,
+    with one query per IN_CHUNK_SIZE of them.'''
+    for chunk in batched(values, IN_CHUNK_SIZE, strict=False):
+        yield from queryset.filter(**{lookup: chunk})
+
+
+class ReverseDependManager(models.Manager):
+    def refresh(self, pkg_ids):
+        '''Recomputes the rows the given packages take part in, either
+        depending on or depended on. Removed packages lose theirs through the
+        cascade.'''
+        pkg_ids = set(pkg_ids)
+        with transaction.atomic():
+            for chunk in batched(pkg_ids, IN_CHUNK_SIZE, strict=False):
+                self.filter(Q(pkg_id__in=chunk) | Q(target_id__in=chunk)).delete()
+            self.bulk_create(self._build(pkg_ids), batch_size=1000)
+
+    def mark_stale(self, pkg_ids):
+        '''Records that the rows of the given packages are out of date, in the
+        transaction changing them, see StaleReverseDepend.'''
+        StaleReverseDepend.objects.bulk_create(
+            (StaleReverseDepend(pkg_id=pkg_id) for pkg_id in pkg_ids), batch_size=1000)
+
+    def refresh_stale(self, pkg_ids=()):
+        '''Refreshes the given packages and all marked by mark_stale() so far,
+        removing their marks. Returns the number of packages refreshed.'''
+        with transaction.atomic():
+            stale = list(StaleReverseDepend.objects.values_list('id', 'pkg_id'))
+            pkg_ids = set(pkg_ids) | {pkg_id for _, pkg_id in stale}
+            self.refresh(pkg_ids)
+            # packages marked in the meantime keep their marks
+            for chunk in batched([mark_id for mark_id, _ in stale], IN_CHUNK_SIZE, strict=False):
+                StaleReverseDepend.objects.filter(id__in=chunk).delete()
+        return len(pkg_ids)
+
+    def rebuild(self):
+        '''Recomputes all rows, returning how many there are.'''
+        with transaction.atomic():
+            StaleReverseDepend.objects.all().delete()
+            self.all().delete()
+            return len(self.bulk_create(self._build(), batch_size=1000))
+
+    def _build(self, pkg_ids=None):
+        depends = Depend.objects.values_list(
+            'id', 'pkg_id', 'pkg__arch_id', 'pkg__arch__agnostic',
+            'name', 'comparison', 'version', 'deptype')
+        packages = Package.objects.values_list(
+            'id', 'arch_id', 'arch__agnostic', 'pkgname', 'epoch', 'pkgver', 'pkgrel')
+        provisions = Provision.objects.values_list(
+            'pkg_id', 'pkg__arch_id', 'pkg__arch__agnostic', 'name', 'version')
+        if pkg_ids is not None:
+            # the depends of these packages and those on their names
+            names = set(filter_in(Package.objects.values_list('pkgname', flat=True), 'id__in', pkg_ids))
+            names.update(filter_in(Provision.objects.values_list('name', flat=True), 'pkg_id__in', pkg_ids))
+            found = {dep[0]: dep for dep in filter_in(depends, 'pkg_id__in', pkg_ids)}
+            found.update((dep[0], dep) for dep in filter_in(depends, 'name__in', names))
+            depends = found.values()
+            wanted = {dep[4] for dep in depends}
+            packages = filter_in(packages, 'pkgname__in', wanted)
+            provisions = filter_in(provisions, 'name__in', wanted)
+
+        # everything by the name it can be depended on by
+        targets = defaultdict(list)
+        for target_id, arch_id, agnostic, pkgname, epoch, pkgver, pkgrel in packages:
+            version = f'{epoch}:{pkgver}-{pkgrel}' if epoch > 0 else f'{pkgver}-{pkgrel}'
+            targets[pkgname].append((target_id, arch_id, agnostic, version, False))
+        for target_id, arch_id, agnostic, name, version in provisions:
+            targets[name].append((target_id, arch_id, agnostic, version, True))
+
+        alpm = AlpmAPI()
+        for _, pkg_id, arch_id, agnostic, name, comparison, version, deptype in depends:
+            for target_id, target_arch_id, target_agnostic, target_version, provision in targets[name]:
+                if pkg_ids is not None and pkg_id not in pkg_ids and target_id not in pkg_ids:
+                    # this row was left in place
+                    continue
+                if not (agnostic or target_agnostic or arch_id == target_arch_id):
+                    continue
+                satisfied = True
+                if comparison and version and alpm.available:
+                    satisfied = alpm.compare_versions(target_version, comparison, version)
+                yield self.model(pkg_id=pkg_id, target_id=target_id, name=name,
+                                 comparison=comparison, version=version, deptype=deptype,
+                                 provision=provision, satisfied=satisfied)
+
+
+class ReverseDepend(models.Model):
+    '''
+    A package depending on another one, either by its name or by one of its
+    provisions, for the architectures it can be installed together with.
+    Maintained from the depends when packages are imported, so the packages
+    requiring one can be looked up directly.
+    '''
+    pkg = models.ForeignKey(Package, related_name='+', on_delete=models.CASCADE)
+    target = models.ForeignKey(Package, related_name='reverse_depends', on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+    comparison = models.CharField(max_length=255, default='')
+    version = models.CharField(max_length=255, default='')
+    deptype = models.CharField(max_length=1, default='D', choices=Depend.DEPTYPE_CHOICES)
+    # depended on by one of its provisions rather than its name
+    provision = models.BooleanField(default=False)
+    # the version requirement is met, or could not be checked
+    satisfied = models.BooleanField(default=True)
+
+    objects = ReverseDependManager()
+
+    def __str__(self):
+        return f'{self.pkg_id} requires {self.target_id} ({self.name})'
+
+
+class StaleReverseDepend(models.Model):
+    '''
+    A package whose reverse depends are out of date. reporead marks the
+    packages it adds or updates in the same transaction, and the marks are
+    removed once the rows are refreshed after the import. If that fails or
+    never happens, the next import changing any packages or rebuild_requiredby
+    takes care of them.
+    '''
+    pkg = models.ForeignKey(Package, related_name='+', on_delete=models.CASCADE)
+
+    def __str__(self):
+        return f'reverse depends of {self.pkg_id}'
+
+
+def bump_signoffs_generation(sender, **kwargs):
+    bump_generations('signoffs')
+
+
+def refresh_reverse_depends(sender, changes, **kwargs):
+    ReverseDepend.objects.refresh_stale(changes.added | changes.updated)
+
+
+def bump_packages_generations(sender, changes, **kwargs):
+    '''Bumps the packages:<repo>:<arch> generations of everything an import
+    changed.'''
+    repos = Repo.objects.filter(id__in=changes.repos).values_list('name', flat=True)
+    arches = list(Arch.objects.filter(id__in=changes.arches).values_list('name', flat=True))
+    bump_generations(*(f'packages:{repo.lower()}:{arch}' for repo in repos for arch in arches))
+
+
 # hook up some signals
 for sender in (FlagRequest, PackageRelation,
                SignoffSpecification, Signoff, Update):
     pre_save.connect(set_created_field, sender=sender, dispatch_uid="packages.models")
+for sender in (FlagRequest, Signoff, Update):
+    pre_save.connect(set_version_key, sender=sender, dispatch_uid="packages.models.version_key")
+for sender in (SignoffSpecification, Signoff):
+    post_save.connect(bump_signoffs_generation, sender=sender, dispatch_uid="packages.models")
+    post_delete.connect(bump_signoffs_generation, sender=sender, dispatch_uid="packages.models")
+# caches depend on the reverse depends, so refresh them first
+packages_changed.connect(refresh_reverse_depends, dispatch_uid="packages.models.reverse_depends")
+packages_changed.connect(bump_packages_generations, dispatch_uid="packages.models")
 
 # vim: set ts=4 sw=4 et:
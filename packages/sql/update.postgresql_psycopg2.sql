@@ -1,8 +1,8 @@
 CREATE OR REPLACE FUNCTION packages_on_insert() RETURNS trigger AS $body$
 BEGIN
 	INSERT INTO packages_update
-		(action_flag, created, package_id, arch_id, repo_id, pkgname, pkgbase, new_pkgver, new_pkgrel, new_epoch) 
-		VALUES (1, now(), NEW.id, NEW.arch_id, NEW.repo_id, NEW.pkgname, NEW.pkgbase, NEW.pkgver, NEW.pkgrel, NEW.epoch);
+		(action_flag, created, package_id, arch_id, repo_id, pkgname, pkgbase, new_pkgver, new_pkgrel, new_epoch, new_version_key) 
+		VALUES (1, now(), NEW.id, NEW.arch_id, NEW.repo_id, NEW.pkgname, NEW.pkgbase, NEW.pkgver, NEW.pkgrel, NEW.epoch, NEW.version_key);
 	RETURN NULL;
 END;
 $body$ LANGUAGE plpgsql;
@@ -10,8 +10,8 @@ $body$ LANGUAGE plpgsql;
 CREATE OR REPLACE FUNCTION packages_on_update() RETURNS trigger AS $body$
 BEGIN
 	INSERT INTO packages_update
-		(action_flag, created, package_id, arch_id, repo_id, pkgname, pkgbase, old_pkgver, old_pkgrel, old_epoch, new_pkgver, new_pkgrel, new_epoch)
-		VALUES (2, now(), NEW.id, NEW.arch_id, NEW.repo_id, NEW.pkgname, NEW.pkgbase, OLD.pkgver, OLD.pkgrel, OLD.epoch, NEW.pkgver, NEW.pkgrel, NEW.epoch);
+		(action_flag, created, package_id, arch_id, repo_id, pkgname, pkgbase, old_pkgver, old_pkgrel, old_epoch, old_version_key, new_pkgver, new_pkgrel, new_epoch, new_version_key)
+		VALUES (2, now(), NEW.id, NEW.arch_id, NEW.repo_id, NEW.pkgname, NEW.pkgbase, OLD.pkgver, OLD.pkgrel, OLD.epoch, OLD.version_key, NEW.pkgver, NEW.pkgrel, NEW.epoch, NEW.version_key);
 	RETURN NULL;
 END;
 $body$ LANGUAGE plpgsql;
@@ -19,8 +19,8 @@ $body$ LANGUAGE plpgsql;
 CREATE OR REPLACE FUNCTION packages_on_delete() RETURNS trigger AS $body$
 BEGIN
 	INSERT INTO packages_update
-		(action_flag, created, arch_id, repo_id, pkgname, pkgbase, old_pkgver, old_pkgrel, old_epoch)
-		VALUES (3, now(), OLD.arch_id, OLD.repo_id, OLD.pkgname, OLD.pkgbase, OLD.pkgver, OLD.pkgrel, OLD.epoch);
+		(action_flag, created, arch_id, repo_id, pkgname, pkgbase, old_pkgver, old_pkgrel, old_epoch, old_version_key)
+		VALUES (3, now(), OLD.arch_id, OLD.repo_id, OLD.pkgname, OLD.pkgbase, OLD.pkgver, OLD.pkgrel, OLD.epoch, OLD.version_key);
 	RETURN NULL;
 END;
 $body$ LANGUAGE plpgsql;
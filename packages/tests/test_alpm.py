@@ -1,11 +1,113 @@
+import random
+
 import pytest
 
-from packages.alpm import AlpmAPI
+from packages.alpm import ALPM, AlpmAPI, libalpm_vercmp, parse_evr, vercmp, version_key
 
 alpm = AlpmAPI()
 
+# (version, version, result), mostly from pacman's test/util/vercmptest.sh
+VERCMP_CORPUS = [
+    ('1.5.0', '1.5.0', 0),
+    ('1.5.1', '1.5.0', 1),
+    ('1.5.1', '1.5', 1),
+    ('1.5.0-1', '1.5.0-1', 0),
+    ('1.5.0-1', '1.5.0-2', -1),
+    ('1.5.0-1', '1.5.1-1', -1),
+    ('1.5.0-2', '1.5.1-1', -1),
+    ('1.5-1', '1.5.1-1', -1),
+    ('1.5-2', '1.5.1-1', -1),
+    ('1.5-2', '1.5.1-2', -1),
+    ('1.5', '1.5-1', 0),
+    ('1.5-1', '1.5', 0),
+    ('1.1-1', '1.1', 0),
+    ('1.0-1', '1.1', -1),
+    ('1.1-1', '1.0', 1),
+    ('1.5b-1', '1.5-1', -1),
+    ('1.5b', '1.5', -1),
+    ('1.5b-1', '1.5', -1),
+    ('1.5b', '1.5.1', -1),
+    ('1.0a', '1.0alpha', -1),
+    ('1.0alpha', '1.0b', -1),
+    ('1.0b', '1.0beta', -1),
+    ('1.0beta', '1.0rc', -1),
+    ('1.0rc', '1.0', -1),
+    ('1.5.a', '1.5', 1),
+    ('1.5.b', '1.5.a', 1),
+    ('1.5.1', '1.5.b', 1),
+    ('1.5.b-1', '1.5.b', 0),
+    ('1.5-1', '1.5.b', -1),
+    ('2.0', '2_0', 0),
+    ('2.0_a', '2_0.a', 0),
+    ('2.0a', '2.0.a', -1),
+    ('2___a', '2_a', 1),
+    ('0:1.0', '0:1.0', 0),
+    ('0:1.0', '0:1.1', -1),
+    ('1:1.0', '0:1.0', 1),
+    ('1:1.0', '0:1.1', 1),
+    ('1:1.0', '2:1.1', -1),
+    ('1:1.0', '0:1.0-1', 1),
+    ('1:1.0-1', '0:1.1-1', 1),
+    ('0:1.0', '1.0', 0),
+    ('0:1.0', '1.1', -1),
+    ('0:1.1', '1.0', 1),
+    ('1:1.0', '1.0', 1),
+    ('1:1.0', '1.1', 1),
+    ('1:1.1', '1.1', 1),
+    ('1.01', '1.1', 0),
+    ('1.100000000000000000000', '1.99', 1),
+    ('6.1.12.arch1-1', '6.1.9.arch2-1', 1),
+    ('', '1.0', -1),
+]
 
-@pytest.mark.skipif(not alpm.available, reason="ALPM is unavailable")
+
+@pytest.mark.parametrize('ver1,ver2,result', VERCMP_CORPUS)
+def test_vercmp_corpus(ver1, ver2, result):
+    assert vercmp(ver1, ver2) == result
+    assert vercmp(ver2, ver1) == -result
+
+
+def test_version_key():
+    # vercmp() ignores the release when only one version has one
+    pairs = [(ver1, ver2) for ver1, ver2, _ in VERCMP_CORPUS
+             if (parse_evr(ver1)[2] is None) == (parse_evr(ver2)[2] is None)]
+    rand = random.Random(0)
+    segments = ['0', '1', '2', '10', '01', 'a', 'b', 'B', 'rc', 'alpha']
+    for _ in range(200):
+        ver1, ver2 = (
+            f"{rand.choice(['', '1:'])}{rand.choice(['', '.', '_'])}{rand.choice(segments)}"
+            f"{''.join(rand.choice(['', '.', '_', '..']) + rand.choice(segments) for _ in range(3))}"
+            f"-{rand.choice(['1', '2', '1.1'])}"
+            for _ in range(2))
+        pairs.append((ver1, ver2))
+    for ver1, ver2 in pairs:
+        key1, key2 = version_key(ver1), version_key(ver2)
+        assert (key1 > key2) - (key1 < key2) == vercmp(ver1, ver2), (ver1, ver2)
+
+    # all releases of a version sort after it
+    assert version_key('1.0') < version_key('1.0-1') < version_key('1.0-2') < version_key('1.0.1')
+    assert set(version_key('1:1.0rc1-1')) <= set('0123456789abcdef')
+
+
+@pytest.mark.skipif(ALPM is None, reason="libalpm is unavailable")
+def test_vercmp_libalpm():
+    versions = [ver for pair in VERCMP_CORPUS for ver in pair[:2]]
+    rand = random.Random(0)
+    alphabet = '0123456789abz.-_:+~'
+    versions += [''.join(rand.choice(alphabet) for _ in range(rand.randint(0, 8))) for _ in range(200)]
+    for ver1 in versions:
+        for ver2 in versions:
+            assert vercmp(ver1, ver2) == libalpm_vercmp(ver1, ver2), (ver1, ver2)
+
+
+def test_compare_constraints():
+    assert alpm.compare_constraints('1:2.0-1', [('>=', '2.0'), ('<', '2:1.0'), ('=', '2.0')]) == [True, True, False]
+    assert alpm.compare_many(['1.0', '2.0-1', '1:0.1'], '>', '1.5') == [False, True, True]
+    with pytest.raises(Exception, match='Invalid operator'):
+        alpm.compare_many(['1.0'], '=>', '1.0')
+
+
+@pytest.mark.skipif(ALPM is None, reason="libalpm is unavailable")
 def test_version():
     version = alpm.version()
     assert version
@@ -41,3 +143,4 @@ def test_behavior_when_unavailable():
     assert mock_alpm.version() is None
     assert mock_alpm.vercmp("1.0", "1.0") is None
     assert mock_alpm.compare_versions("1.0", "=", "1.0") is None
+    assert mock_alpm.compare_many(["1.0"], "=", "1.0") == [None]
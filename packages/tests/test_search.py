@@ -94,3 +94,12 @@ def test_packages_suggest_uppercase(client, package):
 def test_group_search(client, package):
     response = client.get('/groups/search/json/?name=base-devel')
     assert response.status_code == 200
+
+
+def test_sort_version(client, package):
+    response = client.get('/packages/?sort=-version')
+    assert response.status_code == 200
+    content = response.content.decode()
+    names = ['systemd', 'coreutils', 'pacman', 'linux', 'glibc']
+    positions = [content.index(f'title="View package details for {name}"') for name in names]
+    assert positions == sorted(positions)
@@ -1,3 +1,7 @@
+from main.models import Package, Repo
+from packages.models import Signoff
+
+
 def test_signoffs(client, developer_client):
     response = client.get('/packages/signoffs/')
     assert response.status_code == 200
@@ -7,3 +11,20 @@ def test_signoffs_json(client, developer_client):
     response = client.get('/packages/signoffs/json/')
     assert response.status_code == 200
     assert response.json()['signoff_groups'] == []
+
+
+def test_signoffs_json_generation(settings, developer_client, developer, package):
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                   'LOCATION': 'signoffs'}}
+    pkg = Package.objects.first()
+    Package.objects.filter(id=pkg.id).update(repo=Repo.objects.get(name='Extra-Testing'))
+    pkg.refresh_from_db()
+    response = developer_client.get('/packages/signoffs/json/')
+    [group] = response.json()['signoff_groups']
+    assert group['signoffs'] == []
+
+    Signoff.objects.create(pkgbase=pkg.pkgbase, pkgver=pkg.pkgver, pkgrel=pkg.pkgrel, epoch=pkg.epoch,
+                           arch=pkg.arch, repo=pkg.repo, user=developer)
+    response = developer_client.get('/packages/signoffs/json/')
+    [group] = response.json()['signoff_groups']
+    assert len(group['signoffs']) == 1
@@ -1,3 +1,13 @@
+from unittest.mock import patch
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from main.models import Package, Repo
+from packages.models import Conflict, Depend, Provision, ReverseDepend
+
+
 def test_feed(db, client):
     response = client.get('/feeds/packages/')
     assert response.status_code == 200
@@ -91,6 +101,130 @@ def test_packages_detail(client, package):
     assert response.status_code == 302
 
 
+@pytest.fixture
+def depends(package):
+    pacman = Package.objects.get(pkgname='pacman')
+    Provision.objects.create(pkg=Package.objects.get(pkgname='glibc'), name='libc.so', version='6-64')
+    Provision.objects.create(pkg=Package.objects.get(pkgname='coreutils'), name='sh')
+    Provision.objects.create(pkg=Package.objects.get(pkgname='systemd'), name='sh')
+    for name, comparison, version, deptype in [('glibc', '>=', '2.0', 'D'), ('sh', '', '', 'D'),
+                                               ('libc.so', '=', '6-64', 'D'), ('linux', '', '', 'O'),
+                                               ('missing', '', '', 'M'), ('systemd', '', '', 'C')]:
+        Depend.objects.create(pkg=pacman, name=name, comparison=comparison, version=version,
+                              deptype=deptype)
+    Conflict.objects.create(pkg=pacman, name='coreutils')
+    return pacman
+
+
+def add_depends(pkg, count):
+    for i in range(count):
+        Depend.objects.create(pkg=pkg, name=f'extra-{i}')
+    Depend.objects.create(pkg=pkg, name='glibc', deptype='O')
+
+
+def test_get_depends(depends, django_assert_num_queries):
+    expected = []
+    for dep in depends.depends.all():
+        satisfier = dep.get_best_satisfier()
+        expected.append((dep.name, satisfier, None if satisfier else dep.get_providers()))
+
+    pkg = Package.objects.normal().get(id=depends.id)
+    # the depends, the agnostic arches, the satisfiers and the providers with
+    # their provides, however many depends there are
+    with django_assert_num_queries(5):
+        deps = pkg.get_depends()
+    assert sorted((d['dep'].name, d['pkg'], d['providers']) for d in deps) == sorted(expected)
+    assert [d['dep'].name for d in deps] == ['glibc', 'libc.so', 'sh', 'linux', 'missing', 'systemd']
+
+    add_depends(pkg, 20)
+    pkg = Package.objects.normal().get(id=depends.id)
+    with django_assert_num_queries(5):
+        pkg.get_depends()
+
+
+def test_packages_detail_depends(client, depends):
+    url = '/packages/core/x86_64/pacman/'
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+    assert response.status_code == 200
+    content = response.content.decode()
+    assert 'title="View package details for glibc"' in content
+    assert 'title="View package details for coreutils"' in content
+    assert 'missing <span class="virtual-dep">(virtual)</span>' in content
+
+    # the page needs the same number of queries with more depends
+    add_depends(depends, 20)
+    with CaptureQueriesContext(connection) as more_queries:
+        client.get(url)
+    assert len(more_queries) == len(queries)
+
+
+def test_get_requiredby(depends, django_assert_num_queries):
+    ReverseDepend.objects.rebuild()
+    glibc = Package.objects.normal().get(pkgname='glibc')
+    with django_assert_num_queries(1):
+        rqdby = glibc.get_requiredby()
+    # by its name and by its libc.so provision
+    assert [(req.pkg, req.name) for req in rqdby] == [(depends, 'glibc')]
+
+    coreutils = Package.objects.normal().get(pkgname='coreutils')
+    assert [(req.pkg, req.name) for req in coreutils.get_requiredby()] == [(depends, 'sh')]
+    systemd = Package.objects.normal().get(pkgname='systemd')
+    # listed once, for its strongest depend
+    assert [(req.name, req.deptype) for req in systemd.get_requiredby()] == [('sh', 'D')]
+
+
+def test_reverse_depends_refresh(depends):
+    ReverseDepend.objects.rebuild()
+    coreutils = Package.objects.get(pkgname='coreutils')
+    coreutils.provides.all().delete()
+    depends.depends.filter(name='linux').delete()
+    # one id or name per IN (...) lookup
+    with patch('packages.models.IN_CHUNK_SIZE', 1):
+        ReverseDepend.objects.refresh([coreutils.id, depends.id])
+    assert not coreutils.get_requiredby()
+    assert not Package.objects.get(pkgname='linux').get_requiredby()
+    assert [req.name for req in Package.objects.get(pkgname='glibc').get_requiredby()] == ['glibc']
+
+    rows = set(ReverseDepend.objects.values_list('pkg', 'target', 'name', 'provision'))
+    ReverseDepend.objects.rebuild()
+    assert set(ReverseDepend.objects.values_list('pkg', 'target', 'name', 'provision')) == rows
+
+
+@pytest.fixture
+def neighborhood(package):
+    def copy(pkgname, repo, pkgbase='linux'):
+        pkg = Package.objects.get(pkgname='linux', repo__name='Core')
+        pkg.pk = None
+        pkg.pkgname, pkg.pkgbase, pkg.repo = pkgname, pkgbase, Repo.objects.get(name=repo)
+        pkg.save()
+        return pkg
+
+    return {
+        'split': copy('linux-docs', 'Core'),
+        'testing_split': copy('linux-headers', 'Core-Testing'),
+        'testing': copy('linux', 'Core-Testing'),
+        'staging': copy('linux', 'Core-Staging'),
+        'lib32': copy('lib32-linux', 'Multilib', pkgbase='lib32-linux'),
+    }
+
+
+def test_neighborhood(neighborhood, django_assert_num_queries):
+    pkg = Package.objects.normal().get(pkgname='linux', repo__name='Core')
+    with django_assert_num_queries(1):
+        assert pkg.base_package() == pkg
+        assert pkg.split_packages() == [neighborhood['split']]
+        assert pkg.in_testing() == neighborhood['testing']
+        assert pkg.in_staging() == neighborhood['staging']
+        assert pkg.elsewhere() == [neighborhood['staging'], neighborhood['testing'], neighborhood['lib32']]
+
+    headers = Package.objects.normal().get(pkgname='linux-headers')
+    assert headers.base_package() == neighborhood['testing']
+    assert headers.split_packages() == [neighborhood['testing']]
+    assert headers.in_testing() is None
+    assert neighborhood['lib32'].elsewhere() == [pkg, neighborhood['staging'], neighborhood['testing']]
+
+
 def test_packages_json(client, package):
     response = client.get('/packages/core/x86_64/linux/json/')
     assert response.status_code == 200
@@ -99,6 +233,16 @@ def test_packages_json(client, package):
     # TODO verify more of the structure
 
 
+def test_packages_json_depends(client, depends):
+    response = client.get('/packages/core/x86_64/pacman/json/')
+    assert response.status_code == 200
+    data = response.json()
+    assert data['depends'] == ['glibc>=2.0', 'libc.so=6-64', 'sh']
+    assert data['optdepends'] == ['linux']
+    assert data['checkdepends'] == ['systemd']
+    assert data['conflicts'] == ['coreutils']
+
+
 def test_packages_files(client, package):
     response = client.get('/packages/core/x86_64/linux/files/')
     assert response.status_code == 200
@@ -446,9 +446,12 @@ def default(self, obj):
             data = {attr: getattr(obj, attr) for attr in self.pkg_attributes}
             for attr in self.pkg_list_attributes:
                 data[attr] = getattr(obj, attr).all()
-            all_deps = obj.depends.all()
+            # split in memory, so prefetched depends need no more queries
+            all_deps = defaultdict(list)
+            for dep in obj.depends.all():
+                all_deps[dep.deptype].append(dep)
             for (deptype, name) in DEPENDENCY_TYPES:
-                data[name] = all_deps.filter(deptype=deptype)
+                data[name] = all_deps[deptype]
             return data
         if isinstance(obj, PackageFile):
             filename = obj.filename or ''
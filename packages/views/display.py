@@ -185,8 +185,8 @@ def group_details(request, arch, name):
 def files(request, name, repo, arch):
     pkg = get_object_or_404(Package.objects.normal(),
                             pkgname=name, repo__name__iexact=repo, arch__name=arch)
-    # files are inserted in sorted order, so preserve that
-    fileslist = PackageFile.objects.filter(pkg=pkg).order_by('id')
+    # file lists are updated incrementally, so row order means nothing
+    fileslist = sorted(PackageFile.objects.filter(pkg=pkg), key=str)
     dir_count = sum(1 for f in fileslist if f.is_directory)
     files_count = len(fileslist) - dir_count
     context = {
@@ -219,8 +219,9 @@ def sonames_json(request, name, repo, arch):
 
 
 def details_json(request, name, repo, arch):
-    pkg = get_object_or_404(Package.objects.normal(),
-                            pkgname=name, repo__name__iexact=repo, arch__name=arch)
+    pkgs = Package.objects.normal().select_related('packager').prefetch_related(
+        *PackageJSONEncoder.pkg_list_attributes, 'depends')
+    pkg = get_object_or_404(pkgs, pkgname=name, repo__name__iexact=repo, arch__name=arch)
     to_json = json.dumps(pkg, ensure_ascii=False, cls=PackageJSONEncoder)
     return HttpResponse(to_json, content_type='application/json')
 
@@ -228,8 +229,8 @@ def details_json(request, name, repo, arch):
 def files_json(request, name, repo, arch):
     pkg = get_object_or_404(Package.objects.normal(),
                             pkgname=name, repo__name__iexact=repo, arch__name=arch)
-    # files are inserted in sorted order, so preserve that
-    fileslist = PackageFile.objects.filter(pkg=pkg).order_by('id')
+    # file lists are updated incrementally, so row order means nothing
+    fileslist = sorted(PackageFile.objects.filter(pkg=pkg), key=str)
     dir_count = sum(1 for f in fileslist if f.is_directory)
     files_count = len(fileslist) - dir_count
     data = {
@@ -144,9 +144,11 @@ class SearchListView(ListView):
     template_name = "packages/search.html"
     paginate_by = 100
 
-    sort_fields = ("arch", "repo", "pkgname", "pkgbase", "compressed_size",
+    sort_fields = ("arch", "repo", "pkgname", "pkgbase", "version", "compressed_size",
                    "installed_size", "build_date", "last_update", "flag_date")
     allowed_sort = list(sort_fields) + ["-" + s for s in sort_fields]
+    # sort fields ordering by another column
+    sort_columns = {"version": "version_key"}
 
     def get(self, request, *args, **kwargs):
         if request.method == 'HEAD':
@@ -163,7 +165,8 @@ def get_queryset(self):
             packages = parse_form(self.form, packages)
             sort = self.form.cleaned_data['sort']
             if sort in self.allowed_sort:
-                return packages.order_by(sort)
+                field = sort.lstrip('-')
+                return packages.order_by(sort[:-len(field)] + self.sort_columns.get(field, field))
             return packages.order_by('pkgname')
 
         # Form had errors so don't return any results
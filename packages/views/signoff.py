@@ -14,6 +14,7 @@
 from django.views.decorators.cache import never_cache
 
 from main.models import Arch, Package, Repo
+from main.utils import cache_generation_page
 
 from ..models import Signoff, SignoffSpecification
 from ..utils import PackageSignoffGroup, approved_by_signoffs, get_signoff_groups
@@ -202,6 +203,7 @@ def default(self, obj):
 
 
 @permission_required('packages.change_signoff')
+@cache_generation_page(317, ['packages', 'signoffs'])
 def signoffs_json(request):
     signoff_groups = sorted(get_signoff_groups(), key=attrgetter('pkgbase'))
     data = {
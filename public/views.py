@@ -11,6 +11,7 @@
 
 from devel.models import DeveloperKey, MasterKey, PGPSignature, StaffGroup, UserProfile
 from main.models import Arch, Donor, Repo
+from main.utils import get_generations
 from mirrors.models import MirrorUrl
 from news.models import News
 from releng.models import Release
@@ -32,6 +33,8 @@ def updates():
         'pkg_updates': updates,
         'staff_groups': StaffGroup.objects.all(),
         'domain': f'{request.scheme}://{current_site.domain}',
+        'news_generation': get_generations('news'),
+        'packages_generation': get_generations('packages'),
     }
     return render(request, 'public/index.html', context)
 
@@ -74,6 +77,7 @@ def download(request):
     context = {
         'release': release,
         'mirror_urls': _mirror_urls,
+        'mirrors_generation': get_generations('mirrors'),
     }
     return render(request, 'public/download.html', context)
 
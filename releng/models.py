@@ -5,12 +5,12 @@
 
 from bencode import bdecode, bencode
 from django.db import models
-from django.db.models.signals import pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 
 from devel.fields import PGPKeyField
-from main.utils import parse_markdown, set_created_field
+from main.utils import bump_generations, parse_markdown, set_created_field
 
 
 class Release(models.Model):
@@ -94,6 +94,12 @@ def torrent(self):
         return metadata
 
 
+def bump_releases_generation(sender, **kwargs):
+    bump_generations('releases')
+
+
 pre_save.connect(set_created_field, sender=Release, dispatch_uid="releng.models")
+post_save.connect(bump_releases_generation, sender=Release, dispatch_uid="releng.models")
+post_delete.connect(bump_releases_generation, sender=Release, dispatch_uid="releng.models")
 
 # vim: set ts=4 sw=4 et:
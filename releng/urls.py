@@ -1,17 +1,19 @@
 from django.conf.urls import include
 from django.urls import path, re_path
-from django.views.decorators.cache import cache_page
 
+from main.utils import cache_generation_page
 from releng import views
 
 from .views import ReleaseDetailView, ReleaseListView
 
+cache_release = cache_generation_page(311, ['releases'])
+
 releases_patterns = [
     path('', ReleaseListView.as_view(), name='releng-release-list'),
     path('json/', views.releases_json, name='releng-release-list-json'),
-    re_path(r'^(?P<version>[-.\w]+)/$', cache_page(311)(ReleaseDetailView.as_view()),
+    re_path(r'^(?P<version>[-.\w]+)/$', cache_release(ReleaseDetailView.as_view()),
             name='releng-release-detail'),
-    re_path(r'^(?P<version>[-.\w]+)/torrent/$', cache_page(311)(views.release_torrent),
+    re_path(r'^(?P<version>[-.\w]+)/torrent/$', cache_release(views.release_torrent),
             name='releng-release-torrent'),
 ]
 
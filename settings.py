@@ -225,6 +225,13 @@
 # Bumpbuddy json endpoint
 BUMPBUDDY_URL = "https://bumpbuddy.archlinux.org/data.json"
 
+# reporead only diffs a package's stored file list against the new one while
+# fewer than this fraction of its paths change; past that the list is rewritten
+FILES_DIFF_CHURN_RATIO = 0.5
+
+# Days the per-run reports of reporead are kept in the import history
+IMPORT_HISTORY_RETENTION_PERIOD = 30
+
 # Protected TIER0 Mirror
 TIER0_MIRROR_DOMAIN = 'repos.archlinux.org'
 # TIER0_MIRROR_SECRET = ''
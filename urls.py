@@ -20,6 +20,7 @@
 import todolists.urls
 import visualize.urls
 from feeds import NewsFeed, PackageFeed, PackageUpdatesFeed, PlanetFeed, ReleaseFeed
+from main.utils import cache_generation_page
 
 our_sitemaps = {
     'base':           sitemaps.BaseSitemap,
@@ -33,6 +34,7 @@
 }
 
 news_sitemaps = {'news': sitemaps.RecentNewsSitemap}
+cache_sitemap = cache_generation_page(1831, ['packages', 'news', 'releases'])
 
 urlpatterns: list[URLPattern | URLResolver] = []
 
@@ -50,19 +52,20 @@
 ])
 
 # Feeds patterns, used below
+cache_packages_feed = cache_generation_page(313, ['packages'])
 feeds_patterns = [
     path('', public.views.feeds, name='feeds-list'),
-    path('news/', cache_page(311)(NewsFeed())),
-    path('packages/', cache_page(313)(PackageFeed())),
-    re_path(r'^packages/(added|removed)/$', cache_page(313)(PackageUpdatesFeed())),
-    re_path(r'^packages/(added|removed)/(?P<arch>[A-z0-9]+)/$', cache_page(313)(PackageUpdatesFeed())),
-    re_path(r'^packages/(added|removed)/all/(?P<repo>[A-z0-9\-]+)/$', cache_page(313)(PackageUpdatesFeed())),
+    path('news/', cache_generation_page(311, ['news'])(NewsFeed())),
+    path('packages/', cache_packages_feed(PackageFeed())),
+    re_path(r'^packages/(added|removed)/$', cache_packages_feed(PackageUpdatesFeed())),
+    re_path(r'^packages/(added|removed)/(?P<arch>[A-z0-9]+)/$', cache_packages_feed(PackageUpdatesFeed())),
+    re_path(r'^packages/(added|removed)/all/(?P<repo>[A-z0-9\-]+)/$', cache_packages_feed(PackageUpdatesFeed())),
     re_path(r'^packages/(added|removed)/(?P<arch>[A-z0-9]+)/(?P<repo>[A-z0-9\-]+)/$',
-            cache_page(313)(PackageUpdatesFeed())),
-    re_path(r'^packages/(?P<arch>[A-z0-9]+)/$', cache_page(313)(PackageFeed())),
-    re_path(r'^packages/all/(?P<repo>[A-z0-9\-]+)/$', cache_page(313)(PackageFeed())),
-    re_path(r'^packages/(?P<arch>[A-z0-9]+)/(?P<repo>[A-z0-9\-]+)/$', cache_page(313)(PackageFeed())),
-    path('releases/', cache_page(317)(ReleaseFeed())),
+            cache_packages_feed(PackageUpdatesFeed())),
+    re_path(r'^packages/(?P<arch>[A-z0-9]+)/$', cache_packages_feed(PackageFeed())),
+    re_path(r'^packages/all/(?P<repo>[A-z0-9\-]+)/$', cache_packages_feed(PackageFeed())),
+    re_path(r'^packages/(?P<arch>[A-z0-9]+)/(?P<repo>[A-z0-9\-]+)/$', cache_packages_feed(PackageFeed())),
+    path('releases/', cache_generation_page(317, ['releases'])(ReleaseFeed())),
     path('planet/', cache_page(317)(PlanetFeed()), name='planet-feed'),
 ]
 
@@ -91,12 +94,12 @@
 
 # Sitemaps
 urlpatterns.extend([
-    path('sitemap.xml', cache_page(1831)(sitemap_views.index),
+    path('sitemap.xml', cache_sitemap(sitemap_views.index),
          {'sitemaps': our_sitemaps, 'sitemap_url_name': 'sitemaps'}),
-    re_path(r'^sitemap-(?P<section>.+)\.xml$', cache_page(1831)(sitemap_views.sitemap),
+    re_path(r'^sitemap-(?P<section>.+)\.xml$', cache_sitemap(sitemap_views.sitemap),
             {'sitemaps': our_sitemaps, 'template_name': 'sitemaps/sitemap.xml'},
             name='sitemaps'),
-    path('news-sitemap.xml', cache_page(1831)(sitemap_views.sitemap),
+    path('news-sitemap.xml', cache_generation_page(1831, ['news'])(sitemap_views.sitemap),
          {'sitemaps': news_sitemaps, 'template_name': 'sitemaps/news_sitemap.xml'},
          name='news-sitemap'),
 ])
@@ -121,6 +124,10 @@
 
 # prometheus metrics
 if settings.PROMETHEUS_METRICS:  # pragma: no cover
+    from prometheus_client import REGISTRY
+
+    from devel.metrics import ImportRunCollector
+    REGISTRY.register(ImportRunCollector())
     urlpatterns.extend([
         path('', include('django_prometheus.urls')),
     ])
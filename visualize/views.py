@@ -3,9 +3,9 @@
 from django.db.models import Count, Sum
 from django.http import HttpResponse
 from django.shortcuts import render
-from django.views.decorators.cache import cache_page
 
 from main.models import Arch, Package, Repo
+from main.utils import cache_generation_page
 
 
 def index(request):
@@ -58,14 +58,14 @@ def build_map(name, arch, repo):
     return data
 
 
-@cache_page(1800)
+@cache_generation_page(1800, ['packages'])
 def by_arch(request):
     data = arch_repo_data()
     to_json = json.dumps(data['by_arch'], ensure_ascii=False)
     return HttpResponse(to_json, content_type='application/json')
 
 
-@cache_page(1800)
+@cache_generation_page(1800, ['packages'])
 def by_repo(request):
     data = arch_repo_data()
     to_json = json.dumps(data['by_repo'], ensure_ascii=False)